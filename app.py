@@ -8,18 +8,31 @@ A before-and-after slider app for Wix.
 import os
 import json
 import urllib.parse
-import base64
+import time
 from datetime import datetime, timedelta
-import jwt
-import requests
 from dotenv import load_dotenv
 
 # Flask imports
-from flask import Flask, Response, abort, redirect, render_template, request, url_for
+from flask import Flask, Response, abort, g, redirect, render_template, request, url_for
+import jwt
+from sqlalchemy import update
 
 # Local imports
-from database import db, db_uri, migrate
+from database import db, db_uri, migrate, init_db_command
+import assets
+import billing
+import cache
 import logic
+import logs
+import metrics
+import queries
+import reconcile
+import response_compression
+import signals
+import snapshots
+import timing
+import webhooks
+import writes
 
 # Import models.
 from models import Instance, Extension
@@ -37,6 +50,21 @@ app.config[ 'SQLALCHEMY_DATABASE_URI'] = db_uri
 # Disable tracking modifications of objects to use less memory.
 app.config[ 'SQLALCHEMY_TRACK_MODIFICATIONS' ] = False
 
+# Initialize variables.
+engine_options = {}
+
+# Size each worker's database connection pool to its concurrency, e.g. for gevent workers.
+if os.getenv( "DATABASE_POOL_SIZE" ):
+
+    engine_options[ 'pool_size' ] = int( os.getenv( "DATABASE_POOL_SIZE" ) )
+    engine_options[ 'max_overflow' ] = int( os.getenv( "DATABASE_MAX_OVERFLOW", "10" ) )
+
+# Time waits for pooled connections. SQLite keeps the pool SQLAlchemy picks for it.
+if not db_uri.startswith( 'sqlite' ):
+    engine_options[ 'poolclass' ] = metrics.TimedQueuePool
+
+app.config[ 'SQLALCHEMY_ENGINE_OPTIONS' ] = engine_options
+
 # Disable strict slashes.
 app.url_map.strict_slashes = False
 
@@ -46,17 +74,154 @@ db.init_app( app )
 # Create a Migrate object.
 migrate.init_app( app, db )
 
+# Register command line tasks.
+app.cli.add_command( reconcile.reconcile_billing_command )
+app.cli.add_command( webhooks.drain_webhooks_command )
+app.cli.add_command( snapshots.publish_widget_snapshots_command )
+app.cli.add_command( assets.build_assets_command )
+app.cli.add_command( init_db_command )
+app.cli.add_command( queries.check_paging_command )
+
 # Define constants.
 APP_VERSION = '1.1.3'
 WEBHOOK_PUBLIC_KEY = os.getenv( "WEBHOOK_PUBLIC_KEY" )
+WEBHOOK_PUBLIC_KEYS = os.getenv( "WEBHOOK_PUBLIC_KEYS" )
 APP_ID = os.getenv( "APP_ID" )
 APP_SECRET = os.getenv( "APP_SECRET" )
 AUTH_PROVIDER_BASE_URL = os.getenv( "AUTH_PROVIDER_BASE_URL" )
-INSTANCE_API_URL = os.getenv( "INSTANCE_API_URL" )
 TRIAL_DAYS = timedelta( days = 10 )
 DEFAULT_EXTENSION_LIMIT = 999
 BEFORE_PLACEHOLDER_THUMBNAIL = 'images/placeholder-12.svg'
 AFTER_PLACEHOLDER_THUMBNAIL = 'images/placeholder-12.svg'
+WIDGET_CACHE_SIZE = int( os.getenv( "WIDGET_CACHE_SIZE", "2048" ) )
+WIDGET_CACHE_TTL = int( os.getenv( "WIDGET_CACHE_TTL", "60" ) )
+
+# Other workers' changes reach a cached widget within this many seconds.
+WIDGET_CACHE_REVALIDATE = float( os.getenv( "WIDGET_CACHE_REVALIDATE", "2" ) )
+
+# Browsers and the Wix editor may keep a widget but must revalidate it on every load.
+WIDGET_CACHE_CONTROL = 'public, no-cache'
+
+# Create a cache of rendered widgets keyed by extension ID.
+widget_cache = cache.WidgetCache( WIDGET_CACHE_SIZE, WIDGET_CACHE_TTL )
+
+# Drop cached widgets whenever the data they were rendered from changes.
+@signals.extension_changed.connect
+def invalidate_extension_widget( extension_id, **_extra ):
+
+    """
+    Remove the cached widget for a saved or deleted extension.
+    """
+    widget_cache.invalidate( extension_id )
+
+@signals.instance_changed.connect
+def invalidate_instance_widgets( instance_id, **_extra ):
+
+    """
+    Remove the cached widgets of an instance whose entitlement changed.
+    """
+    widget_cache.invalidate_instance( instance_id )
+
+# Create the parser of signed app instances, which caches verified tokens.
+signed_instances = logic.SignedInstanceParser( APP_SECRET or '' )
+
+# Parse the webhook public keys once. WEBHOOK_PUBLIC_KEYS may add more keys for rotation.
+webhook_verifier = webhooks.WebhookVerifier.from_pem( WEBHOOK_PUBLIC_KEY, WEBHOOK_PUBLIC_KEYS )
+
+# Create the pool of threads that apply queued webhooks.
+webhook_workers = webhooks.WebhookWorkerPool()
+
+# Create the buffer that merges rapid saves of the same extension.
+extension_writes = writes.ExtensionWriteBuffer()
+
+# Time requests from their first hook to their last, so register these first.
+timing.instrument()
+metrics.instrument()
+
+# Report the lookups of the in-process caches.
+cache_metrics = metrics.CacheMetrics()
+cache_metrics.track( 'widget', widget_cache )
+cache_metrics.track( 'signed_instance', signed_instances.claims )
+cache_metrics.track( 'access_token', logic.access_tokens.tokens )
+cache_metrics.track( 'webhook_replay', webhook_verifier.seen )
+
+# Report how well the Wix API connections are reused.
+wix_pool_metrics = metrics.WixPoolMetrics( logic.wix )
+
+@app.before_request
+def start_request_timer():
+
+    """
+    Start timing a sample of requests.
+    """
+    g.request_started = time.perf_counter()
+    timing.start()
+
+@app.after_request
+def report_request_timing( response ):
+
+    """
+    Report where a timed request spent its time, in a header and the log.
+    """
+
+    metrics.observe_request(
+        request.method,
+        request.url_rule.rule if request.url_rule is not None else None,
+        response.status_code,
+        time.perf_counter() - g.get( 'request_started', time.perf_counter() )
+    )
+    cache_metrics.sync()
+    wix_pool_metrics.sync()
+
+    return timing.finish( response, request )
+
+# Start the webhook workers with the first request each worker process serves,
+# so that command line tasks never start them.
+@app.before_request
+def start_webhook_workers():
+
+    """
+    Make sure this process drains the webhook queue.
+    """
+    webhook_workers.start( app )
+
+# Start writing buffered extension saves the same way.
+@app.before_request
+def start_extension_writes():
+
+    """
+    Make sure this process writes its buffered extension saves.
+    """
+    extension_writes.start( app )
+
+# Store refresh tokens that Wix rotates while issuing cached access tokens.
+def persist_refresh_token( instance_id, refresh_token ):
+
+    """
+    Save a rotated refresh token to the instance record.
+
+    Runs in its own application context, and so its own session, so that the
+    caller's pending changes are neither committed nor rolled back with it.
+    """
+
+    with app.app_context():
+
+        try:
+
+            db.session.execute(
+                update( Instance )
+                .where( Instance.instance_id == instance_id )
+                .values( refresh_token = refresh_token )
+            )
+            db.session.commit()
+
+        except Exception as err :
+
+            # The access token is still valid, so report the failure without raising it.
+            db.session.rollback()
+            logs.error( 'refresh-token-save-failed', err, instance_id = instance_id )
+
+logic.access_tokens.on_rotate = persist_refresh_token
 
 # Use a template context processor to pass the current date to every template
 # Source: https://stackoverflow.com/a/41231621
@@ -68,6 +233,37 @@ def inject_now():
     """
     return {'now': datetime.utcnow()}
 
+# Read the names of the fingerprinted bundles once.
+asset_manifest = assets.AssetManifest()
+
+@app.context_processor
+def inject_asset_url():
+
+    """
+    Let templates link the built bundles.
+    """
+    return {'asset_url': asset_manifest.url}
+
+@app.after_request
+def compress_response( response ):
+
+    """
+    Compress text responses for clients that accept it.
+    """
+    return response_compression.compress_response( response, request.accept_encodings )
+
+@app.after_request
+def cache_fingerprinted_assets( response ):
+
+    """
+    Let browsers keep bundles for a year, since a changed bundle gets a new name.
+    """
+
+    if request.path.startswith( url_for( 'static', filename = assets.DIST_DIR + '/' ) ):
+        response.headers[ 'Cache-Control' ] = assets.IMMUTABLE_CACHE_CONTROL
+
+    return response
+
 # Define Flask routes.
 # Homepage.
 @app.route('/')
@@ -112,8 +308,7 @@ def app_wix():
     url = permission_request_url + '?token=' + token + '&state=start'
     url += '&appId=' + app_id + '&redirectUrl=' + redirect_url
 
-    print( "redirecting to " + url )
-    print( "=============================" )
+    logs.info( 'redirect', url = url )
 
     # Redirect to the app installation URL.
     return redirect( url )
@@ -143,23 +338,16 @@ def redirect_wix():
     try:
 
         # Initialize variables.
-        auth_provider_base_url = AUTH_PROVIDER_BASE_URL
-        app_secret = APP_SECRET
-        app_id = APP_ID
         site_url = 'Not published'
         site_id = ''
 
-        # Prepare request.
-        request_body_parameters = {
-            'code': authorization_code,
-            'client_secret': app_secret,
-            'client_id': app_id,
-            'grant_type': "authorization_code"
-        }
-
         # Request an access token from Wix.
-        token_request = requests.post( auth_provider_base_url + "/access",
-                                      json = request_body_parameters, timeout=2.50 ).text
+        token_request = logic.get_tokens_from_wix(
+            authorization_code,
+            AUTH_PROVIDER_BASE_URL,
+            APP_SECRET,
+            APP_ID
+        )
 
         # Parse response as JSON.
         tokens = json.loads( token_request )
@@ -168,15 +356,12 @@ def redirect_wix():
         access_token = tokens[ 'access_token' ]
         refresh_token = tokens[ 'refresh_token' ]
 
+        # Cache the new access token so the instance API call below can reuse it.
+        logic.access_tokens.store( instance_id, tokens )
+
         # Check with Wix for the current instance data.
         # Get data about the installation of this app on the user's website.
-        app_instance = logic.get_app_instance(
-            refresh_token,
-            INSTANCE_API_URL,
-            AUTH_PROVIDER_BASE_URL,
-            APP_SECRET,
-            APP_ID
-        )
+        app_instance = billing.get_app_instance( instance_id, refresh_token )
 
         # If the app instance API call returned site info...
         if 'site' in app_instance :
@@ -190,7 +375,6 @@ def redirect_wix():
 
                 # Extract site url.
                 site_url = app_instance['site']['url']
-                print( "Site URL: " + site_url )
 
         # Construct the URL to Completes the OAuth flow.
         # https://dev.wix.com/api/rest/getting-started/authentication#getting-started_authentication_step-5a-app-completes-the-oauth-flow
@@ -218,14 +402,14 @@ def redirect_wix():
 
             # Update the instance record to the Instance table.
             instance_in_db.refresh_token = refresh_token
-            instance_in_db.site_url = site_url,
+            instance_in_db.site_url = site_url
             instance_in_db.site_id = site_id
 
         # Add the new or updated instance record to the Instance table.
         db.session.commit()
 
-        # Return feedback to the console.
-        print( "Instance #" + instance_id + " installed." )
+        # Log event.
+        logs.info( 'instance-installed', instance_id = instance_id, site_url = site_url )
 
         # Mark the installation complete.
         logic.finish_app_installation( access_token )
@@ -236,14 +420,12 @@ def redirect_wix():
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
 
-        print( "redirecting to " + complete_oauth_redirect_url )
-        print( "=============================" )
+        logs.info( 'redirect', url = complete_oauth_redirect_url )
 
         return redirect( complete_oauth_redirect_url )
 
     except Exception as err:
-        print( "Error getting token from Wix" )
-        print( err )
+        logs.error( 'install-failed', err, instance_id = instance_id )
         return Response("{'error':'wixError'}", status=500, mimetype='application/json')
 
 
@@ -261,52 +443,8 @@ def uninstall():
     # Log event.
     logic.log_call( "uninstall" )
 
-    # Initialize variables.
-    instance_id = ''
-    secret = WEBHOOK_PUBLIC_KEY
-
-    # If the user submitted a POST request...
-    if request.method == 'POST':
-
-        # Get the encoded data received.
-        encoded_jwt = request.data
-
-        # Decode the data using our secret.
-        data = jwt.decode( encoded_jwt, secret, algorithms=["RS256"] )
-
-        # Load the JSON payload.
-        request_data = json.loads( data['data'] )
-
-        # Extract the instance ID
-        instance_id = request_data[ 'instanceId' ]
-
-        # Search the tables for records, filtering by instance ID.
-        instance = Instance.query.filter_by( instance_id = instance_id ).first()
-        extensions = Extension.query.filter_by( instance_id = instance_id )
-
-        # Wix will repeatedly call this route if we return an error code.
-        # Prevent that from happening by proceeding only if the instance exists.
-
-        # If the instance exists...
-        if instance is not None:
-
-            # Iterate over extensions.
-            for extension in extensions:
-
-                # Delete the instance.
-                db.session.delete( extension )
-
-                # Return feedback to the console.
-                print( "Deleted extension #" + extension.extension_id )
-
-            # Reset the extension count.
-            instance.extension_count = 0
-
-            # Save changes.
-            db.session.commit()
-
-            # Return feedback to the console.
-            print( "Instance #" + instance_id + " uninstalled." )
+    # Verify the webhook and queue it for the workers.
+    enqueue_webhook( "uninstall" )
 
     # The app must return a 200 response upon successful receipt of a webhook.
     # Source: https://dev.wix.com/docs/rest/articles/getting-started/webhooks
@@ -326,77 +464,8 @@ def upgrade():
     # Log event.
     logic.log_call( "upgrade" )
 
-    # Initialize variables.
-    instance_id = ''
-    secret = WEBHOOK_PUBLIC_KEY
-    now = datetime.utcnow()
-    one_month_from_now = now + timedelta( 1 * 30 )
-
-    # If the user submitted a POST request...
-    if request.method == 'POST':
-
-        # Get the encoded data received.
-        encoded_jwt = request.data
-
-        # Decode the data using our secret.
-        data = jwt.decode( encoded_jwt, secret, algorithms=["RS256"] )
-
-        # Load the JSON payload.
-        request_data = json.loads( data['data'] )
-        product_data = json.loads( request_data['data'] )
-
-        # Extract the instance ID
-        instance_id = request_data[ 'instanceId' ]
-
-        # Extract the product ID
-        product_id = product_data[ 'vendorProductId' ]
-
-        # Search the tables for records, filtering by instance ID.
-        instance = Instance.query.filter_by( instance_id = instance_id ).first()
-
-        # Log the key webhook fields so missed or malformed upgrades are diagnosable.
-        print( "Upgrade webhook received: instanceId=" + str( instance_id ) +
-              ", vendorProductId=" + str( product_id ) +
-              ", expiresOn=" + str( product_data.get( 'expiresOn' ) ) +
-              ", instance_found=" + str( instance is not None ) )
-
-        # If the instance exists and the product_id is not null.
-        if instance and product_id:
-
-            # Change the user to a paid user.
-            instance.is_free = False
-            instance.did_cancel = False
-
-            # Extract the expiration date
-            if 'expiresOn' in product_data :
-
-                instance.expires_on = datetime.strptime( product_data[ 'expiresOn' ],
-                                                        '%Y-%m-%dT%H:%M:%SZ' )
-
-            else :
-
-                # Default to the shortest allowable paid interval.
-                instance.expires_on = one_month_from_now
-
-            # Add the new or updated instance record to the Instance table.
-            db.session.commit()
-
-            # Return feedback to the console.
-            print( "Instance #" + instance_id + " upgraded. expires_on=" +
-                  str( instance.expires_on ) )
-
-        elif instance is None:
-
-            # The webhook fired for an instance we have no record of. Without this
-            # the user silently stays on the free tier despite paying.
-            print( "UPGRADE MISS: no Instance record for instanceId=" +
-                  str( instance_id ) + ". Paid user may be stranded on free tier." )
-
-        else:
-
-            # Return feedback to the console.
-            print( "UPGRADE MISS: vendorProductId missing for instanceId=" +
-                  str( instance_id ) + "." )
+    # Verify the webhook and queue it for the workers.
+    enqueue_webhook( "upgrade" )
 
     # The app must return a 200 response upon successful receipt of a webhook.
     # Source: https://dev.wix.com/docs/rest/articles/getting-started/webhooks
@@ -417,47 +486,59 @@ def downgrade():
     # Log event.
     logic.log_call( "downgrade" )
 
-    # Initialize variables.
-    instance_id = ''
-    secret = WEBHOOK_PUBLIC_KEY
+    # Verify the webhook and queue it for the workers.
+    enqueue_webhook( "downgrade" )
 
-    # If the user submitted a POST request...
-    if request.method == 'POST':
+    # The app must return a 200 response upon successful receipt of a webhook.
+    # Source: https://dev.wix.com/docs/rest/articles/getting-started/webhooks
+    return "", 200
 
-        # Get the encoded data received.
-        encoded_jwt = request.data
+def enqueue_webhook( event_type ):
 
-        # Decode the data using our secret.
-        data = jwt.decode( encoded_jwt, secret, algorithms=["RS256"] )
+    """
+    Verify the webhook in the current request and durably queue it.
 
-        # Load the JSON payload.
-        request_data = json.loads( data['data'] )
-        product_data = json.loads( request_data['data'] )
+    The workers apply it to the database later, so the response does not wait on
+    that work. Redeliveries of a webhook we already queued are acknowledged
+    without queuing it again. An invalid signature raises, and Wix retries the
+    delivery.
+    """
 
-        # Extract the instance ID
-        instance_id = request_data[ 'instanceId' ]
+    # Get the encoded data received.
+    encoded_jwt = request.data
 
-        # Extract the product ID
-        product_id = product_data[ 'vendorProductId' ]
+    # If Wix is redelivering a webhook we already queued...
+    if webhook_verifier.is_replay( encoded_jwt ):
 
-        # Search the tables for records, filtering by instance ID.
-        instance = Instance.query.filter_by( instance_id = instance_id ).first()
+        # Log event.
+        logs.info( 'webhook-redelivered', event_type = event_type )
+        signals.webhook_received.send( event_type, outcome = 'redelivered' )
+
+        return
 
-        # If the instance exists and the product_id is not null.
-        if instance and product_id:
+    # Verify the signature and decode the event.
+    try:
 
-            # Flag the user cancellation.
-            instance.did_cancel = True
+        event = webhook_verifier.verify( event_type, encoded_jwt )
 
-            # Add the new or updated instance record to the Instance table.
-            db.session.commit()
+    except jwt.PyJWTError:
 
-            # Return feedback to the console.
-            print( "Instance #" + instance_id + " downgraded.")
+        signals.webhook_received.send( event_type, outcome = 'invalid' )
+        raise
 
-    # The app must return a 200 response upon successful receipt of a webhook.
-    # Source: https://dev.wix.com/docs/rest/articles/getting-started/webhooks
-    return "", 200
+    # Queue the event.
+    queued = webhooks.enqueue( event_type, event.instance_id, event.payload )
+
+    # Remember the delivery only once it is safely queued.
+    webhook_verifier.remember( event )
+
+    # Wake the workers of this process.
+    webhook_workers.notify()
+    signals.webhook_received.send( event_type, outcome = 'queued' )
+
+    # Log event.
+    logs.info( 'webhook-queued', event_type = event_type, webhook_id = queued.id,
+              instance_id = event.instance_id )
 
 # App Settings Panel
 @app.route('/settings/', methods=['POST','GET'])
@@ -480,7 +561,7 @@ def settings():
     # Initialize variables.
     instance_id = None
     requested_extension_id = None
-    extension_in_db = None
+    extension_view = None
     is_free = True # Change to True for production.
     trial_days = TRIAL_DAYS
     before_image = url_for( 'static', filename = BEFORE_PLACEHOLDER_THUMBNAIL )
@@ -506,35 +587,39 @@ def settings():
         # Assign the value of 'origCompId' from the GET request to the extension_id variable.
         requested_extension_id = request.args.get( 'origCompId' )
 
-        # Search the Extension table for the extension by its extension ID (primary key).
-        extension_in_db = Extension.query.get( requested_extension_id )
+        # Write any buffered saves of the extension so the panel shows them.
+        if requested_extension_id:
+            extension_writes.flush( requested_extension_id )
+
+        # Read the extension and its instance's entitlement in one query.
+        extension_view = queries.load_widget_view( requested_extension_id )
 
         # Load existing extension...
-        if extension_in_db is not None:
+        if extension_view is not None:
 
             # Update the local variables with the requested_extension values.
-            instance_id                 = extension_in_db.instance.instance_id
-            is_free                     = extension_in_db.instance.is_free
+            instance_id                 = extension_view.instance_id
+            is_free                     = extension_view.is_free
             trial_days                  = logic.calculate_trial_days(
                                                 trial_days,
-                                                extension_in_db.instance.created_at
+                                                extension_view.instance_created_at
                                             )
-            before_image                = extension_in_db.before_image
-            before_image_thumbnail      = extension_in_db.before_image_thumbnail
-            before_label_text           = extension_in_db.before_label_text
-            before_alt_text             = extension_in_db.before_alt_text
-            after_image                 = extension_in_db.after_image
-            after_image_thumbnail       = extension_in_db.after_image_thumbnail
-            after_label_text            = extension_in_db.after_label_text
-            after_alt_text              = extension_in_db.after_alt_text
-            slider_offset               = extension_in_db.offset
-            slider_offset_float         = extension_in_db.offset_float
-            mouseover_action            = extension_in_db.mouseover_action
-            handle_animation            = extension_in_db.handle_animation
-            handle_border_color         = extension_in_db.handle_border_color
-            is_move_on_click_enabled    = extension_in_db.is_move_on_click_enabled
-            is_vertical                 = extension_in_db.is_vertical
-            is_dark                     = extension_in_db.is_dark
+            before_image                = extension_view.before_image
+            before_image_thumbnail      = extension_view.before_image_thumbnail
+            before_label_text           = extension_view.before_label_text
+            before_alt_text             = extension_view.before_alt_text
+            after_image                 = extension_view.after_image
+            after_image_thumbnail       = extension_view.after_image_thumbnail
+            after_label_text            = extension_view.after_label_text
+            after_alt_text              = extension_view.after_alt_text
+            slider_offset               = extension_view.offset
+            slider_offset_float         = extension_view.offset_float
+            mouseover_action            = extension_view.mouseover_action
+            handle_animation            = extension_view.handle_animation
+            handle_border_color         = extension_view.handle_border_color
+            is_move_on_click_enabled    = extension_view.is_move_on_click_enabled
+            is_vertical                 = extension_view.is_vertical
+            is_dark                     = extension_view.is_dark
 
     # Pass local variables to Flask and render the template.
     return render_template('settings.html',
@@ -578,33 +663,12 @@ def widget():
     # Initialize variables.
     requested_extension_id = None
     extension_in_db = None
-    is_free = True # Change to True for production.
-    did_cancel = False
+    extension_view = None
+    cached_widget = None
+    values = None
     trial_days = TRIAL_DAYS
     extension_count = 0
     extension_limit = DEFAULT_EXTENSION_LIMIT
-    before_image = url_for( 'static', filename = BEFORE_PLACEHOLDER_THUMBNAIL )
-    before_image_thumbnail = url_for( 'static', filename = BEFORE_PLACEHOLDER_THUMBNAIL )
-    before_label_text = 'Before'
-    before_alt_text = ''
-    after_image = url_for( 'static', filename = AFTER_PLACEHOLDER_THUMBNAIL )
-    after_image_thumbnail = url_for( 'static', filename = AFTER_PLACEHOLDER_THUMBNAIL )
-    after_label_text = 'After'
-    after_alt_text = ''
-    slider_offset = 50
-    slider_offset_float = 0.5
-    slider_orientation = 'horizontal'
-    is_vertical = False
-    slider_dark_mode = ''
-    is_dark = False
-    mouseover_action = 1
-    handle_animation = 0
-    handle_border_color = '#BBBBBB'
-    encoded_handle_border_color = '%23BBBBBB'
-    slider_no_overlay = False
-    slider_move_slider_on_hover = False
-    is_move_on_click_enabled = False
-    expiration_date = datetime.utcnow()
 
     # If the user submitted a POST request...
     if request.method == 'POST':
@@ -613,6 +677,26 @@ def widget():
         request_data = json.loads( request.data )
         requested_extension_id = request_data[ "extensionId" ]
 
+        # Check the saved values now, since buffered saves are written after we answer.
+        if request_data[ "action" ] != "delete":
+
+            try:
+
+                values = extension_values( request_data )
+
+            except ( KeyError, TypeError, ValueError ):
+
+                abort( 400 )
+
+        # Merge repeated saves of an extension without reading it again.
+        if ( request_data[ "action" ] == "save" and
+                extension_writes.is_pending( requested_extension_id ) ):
+
+            extension_writes.submit( requested_extension_id, values )
+
+            # Return a success message.
+            return "", 201
+
         # Search the Extension table for the extension by its extension ID (primary key).
         extension_in_db = Extension.query.get( requested_extension_id )
 
@@ -622,7 +706,8 @@ def widget():
             # Delete existing extension.
             if request_data[ "action" ] == "delete" :
 
-                # Delete the extension by its ID.
+                # Drop any buffered saves, then delete the extension by its ID.
+                extension_writes.discard( requested_extension_id )
                 db.session.delete( extension_in_db )
 
                 # Decrement the user's extension count.
@@ -631,68 +716,18 @@ def widget():
                 # Save changes to the database.
                 db.session.commit()
 
+                # Drop anything derived from the extension.
+                signals.extension_changed.send( requested_extension_id )
+
                 # Log event.
-                print( 'Instance #' + extension_in_db.instance.instance_id +
-                      ' deleted extension #' + requested_extension_id )
+                logs.info( 'extension-deleted', instance_id = extension_in_db.instance.instance_id,
+                          extension_id = requested_extension_id )
 
             else:
 
-                 # Update existing extension.
-
-                # If the user selected the vertical orientation...
-                if request_data[ 'sliderOrientation' ] == 'vertical' :
-
-                    # Update the variable.
-                    is_vertical = True
-
-                # If the user selected dark mode...
-                if request_data[ 'sliderDarkMode' ] == 'dark' :
-
-                    # Update the variable.
-                    is_dark = True
-
-                # If the user selected the move on click option...
-                if int( request_data[ 'sliderMoveOnClickToggle' ] ) == 1 :
-
-                    # Update the variable.
-                    is_move_on_click_enabled = True
-
-                # Newly instantiated extensions may not yet have thumbnails.
-                if 'beforeImageThumbnail' in request_data :
-
-                    # Update the variable.
-                    before_image_thumbnail = request_data[ 'beforeImageThumbnail' ]
-
-                # Check if the request_data contains these properties.
-                if 'afterImageThumbnail' in request_data :
-
-                    # Update the variable.
-                    after_image_thumbnail = request_data[ 'afterImageThumbnail' ]
-
-                # Edit the extensionSlider record.
-                extension_in_db.before_image = request_data[ 'beforeImage' ]
-                extension_in_db.before_image_thumbnail = before_image_thumbnail
-                extension_in_db.before_label_text = request_data[ 'beforeLabelText' ]
-                extension_in_db.before_alt_text = request_data[ 'beforeAltText' ]
-                extension_in_db.after_image = request_data[ 'afterImage' ]
-                extension_in_db.after_image_thumbnail = after_image_thumbnail
-                extension_in_db.after_label_text = request_data[ 'afterLabelText' ]
-                extension_in_db.after_alt_text = request_data[ 'afterAltText' ]
-                extension_in_db.offset = request_data[ 'sliderOffset' ]
-                extension_in_db.offset_float = request_data[ 'sliderOffsetFloat' ]
-                extension_in_db.is_vertical = is_vertical
-                extension_in_db.is_dark = is_dark
-                extension_in_db.mouseover_action = request_data[ 'sliderMouseoverAction' ]
-                extension_in_db.handle_animation = request_data[ 'sliderHandleAnimation' ]
-                extension_in_db.handle_border_color = request_data[ 'sliderHandleBorderColor' ]
-                extension_in_db.is_move_on_click_enabled = is_move_on_click_enabled
-
-                # Add a new extension to the Extension table.
-                db.session.commit()
-
-                # Log event.
-                print( 'Instance #' + extension_in_db.instance.instance_id +
-                      ' edited extension #' + requested_extension_id )
+                # Buffer the update, which is written with any further saves shortly. The
+                # buffer drops anything derived from the extension once it is written.
+                extension_writes.submit( requested_extension_id, values )
 
         else:
 
@@ -715,45 +750,11 @@ def widget():
                     # Get the associated Instance.
                     instance_in_db = Instance.query.get( instance_id )
 
-                    # If the user selected the vertical orientation...
-                    if request_data[ 'sliderOrientation' ] == 'vertical' :
-
-                        # Update the variable.
-                        is_vertical = True
-
-                    # If the user selected dark mode...
-                    if request_data[ 'sliderDarkMode' ] == 'dark' :
-
-                        # Update the variable.
-                        is_dark = True
-
-                    # If the user selected the move on click option...
-                    if int( request_data[ 'sliderMoveOnClickToggle' ] ) == 1 :
-
-                        # Update the variable.
-                        is_move_on_click_enabled = True
-
                     # Construct a new Extension record.
                     extension = Extension(
                         extension_id = requested_extension_id,
                         instance_id = instance_in_db.instance_id,
-                        before_image = request_data[ 'beforeImage' ],
-                        # New extensions will not have thumbnails, so use the default.
-                        before_image_thumbnail = before_image_thumbnail,
-                        before_label_text = request_data[ 'beforeLabelText' ],
-                        before_alt_text = request_data[ 'beforeAltText' ],
-                        after_image = request_data[ 'afterImage' ],
-                        after_image_thumbnail = after_image_thumbnail,
-                        after_label_text = request_data[ 'afterLabelText' ],
-                        after_alt_text = request_data[ 'afterAltText' ],
-                        offset = request_data[ 'sliderOffset' ],
-                        offset_float = request_data[ 'sliderOffsetFloat' ],
-                        is_vertical = is_vertical,
-                        is_dark = is_dark,
-                        mouseover_action = request_data[ 'sliderMouseoverAction' ],
-                        handle_animation = request_data[ 'sliderHandleAnimation' ],
-                        handle_border_color = request_data[ 'sliderHandleBorderColor' ],
-                        is_move_on_click_enabled = is_move_on_click_enabled
+                        **values
                     )
 
                     # Check the extension count.
@@ -772,12 +773,15 @@ def widget():
                         instance_in_db.extension_count += 1
 
                         # Log event.
-                        print( 'Instance #' + instance_id +
-                              ' created new extension #' + requested_extension_id )
+                        logs.info( 'extension-created', instance_id = instance_id,
+                                  extension_id = requested_extension_id )
 
                     # Save changes to the database.
                     db.session.commit()
 
+                    # Drop anything derived from the extension.
+                    signals.extension_changed.send( requested_extension_id )
+
         # Return a success message.
         return "", 201
 
@@ -796,56 +800,27 @@ def widget():
             # Assign its value to extension_id.
             requested_extension_id = request.args.get( 'viewerCompId' )
 
-        # Search the database and get the extension by the requested extension ID (primary key).
-        extension_in_db = Extension.query.get( requested_extension_id )
+        # Write any buffered saves of the extension so the widget shows them.
+        if requested_extension_id:
+            extension_writes.flush( requested_extension_id )
+
+        # Serve the rendered widget from the cache while it was checked recently.
+        cached_widget = widget_cache.get( requested_extension_id )
+
+        if ( cached_widget is not None and
+                time.monotonic() - cached_widget.checked_at < WIDGET_CACHE_REVALIDATE ):
+
+            return widget_response( cached_widget.body, cached_widget.etag, cached_widget )
+
+        # Read the extension and its instance's entitlement in one query.
+        extension_view = queries.load_widget_view( requested_extension_id )
 
         # Extension found.
-        if extension_in_db is not None:
+        if extension_view is not None:
 
-            # Update the local variables with stored values from the database.
-            is_free = extension_in_db.instance.is_free
+            # Update the trial days with the stored installation date.
             trial_days = logic.calculate_trial_days( trial_days,
-                                                    extension_in_db.instance.created_at )
-            did_cancel = extension_in_db.instance.did_cancel
-            expiration_date = extension_in_db.instance.expires_on
-            before_image = extension_in_db.before_image
-            before_image_thumbnail = extension_in_db.before_image_thumbnail
-            before_label_text = extension_in_db.before_label_text
-            before_alt_text = extension_in_db.before_alt_text
-            after_image = extension_in_db.after_image
-            after_image_thumbnail = extension_in_db.after_image_thumbnail
-            after_label_text = extension_in_db.after_label_text
-            after_alt_text = extension_in_db.after_alt_text
-            slider_offset = extension_in_db.offset
-            slider_offset_float = extension_in_db.offset_float
-            mouseover_action = extension_in_db.mouseover_action
-            handle_animation = extension_in_db.handle_animation
-            handle_border_color = extension_in_db.handle_border_color
-            encoded_handle_border_color = handle_border_color.replace( "#", "%23" )
-            is_move_on_click_enabled = extension_in_db.is_move_on_click_enabled
-
-            # Mouseover action logic.
-            # Move slider on mouseover.
-            if mouseover_action == 2:
-                slider_no_overlay = False
-                slider_move_slider_on_hover = True
-
-            # Do nothing on mouseover.
-            if mouseover_action == 0:
-                slider_no_overlay = True
-                slider_move_slider_on_hover = False
-
-            # If the user selected the vertical orientation...
-            if extension_in_db.is_vertical is True :
-
-                # Update the local variable for use in the widget template.
-                slider_orientation  = 'vertical'
-
-            # If the user selected dark mode...
-            if extension_in_db.is_dark is True :
-
-                # Update the local variable for use in the widget template.
-                slider_dark_mode  = 'dark'
+                                                    extension_view.instance_created_at )
 
             # Reconcile our records with Wix whenever the stored expiration date
             # has passed. This covers two cases:
@@ -853,51 +828,189 @@ def widget():
             #   2. A user resubscribed but the Paid Plan Purchased webhook never
             #      arrived, which would otherwise leave them stuck on the free tier.
             # Trial users (expires_on is None) are skipped so we don't call Wix needlessly.
-            if expiration_date is not None and expiration_date < datetime.utcnow():
-
-                try:
-
-                    # Check with Wix for the current instance data.
-                    # Get data about the installation of this app on the user's website.
-                    app_instance = logic.get_app_instance(
-                        extension_in_db.instance.refresh_token,
-                        INSTANCE_API_URL,
-                        AUTH_PROVIDER_BASE_URL,
-                        APP_SECRET,
-                        APP_ID
-                    )
+            #
+            # The refresh runs in the background so visitors never wait on Wix. This
+            # view renders from the stored values, and the refresh drops the cached
+            # widgets of the instance if anything changed.
+            if ( extension_view.expires_on is not None and
+                    extension_view.expires_on < datetime.utcnow() ):
 
-                    # Extract the isFree status.
-                    is_free = app_instance['instance']['isFree']
+                billing.schedule_refresh( app, extension_view.instance_id )
 
-                    # Update the record in the database.
-                    extension_in_db.instance.is_free = is_free
+    # Build a validator from the stored state the widget is rendered from.
+    etag = logic.widget_etag( extension_view, trial_days, APP_VERSION + asset_manifest.version )
 
-                    # If the billing key is present...
-                    if 'billing' in app_instance:
+    # Keep serving a cached widget that another worker has not changed since.
+    if cached_widget is not None and cached_widget.etag == etag:
 
-                        # Extract the billing data.
-                        billing = app_instance['billing']
+        cached_widget.checked_at = time.monotonic()
+        return widget_response( cached_widget.body, etag, cached_widget )
 
-                        # If the 'expirationDate key is present...
-                        if 'expirationDate' in billing:
+    # If the visitor already has this version of the widget, in any encoding they accept...
+    if variant_etag_held( etag ) is not None:
 
-                            # Get the new renewal date.
-                            renewal_date = datetime.strptime( billing['expirationDate'],
-                                                             '%Y-%m-%dT%H:%M:%SZ' )
+        # Tell them to reuse it without rendering the template.
+        return widget_response( None, etag )
 
-                            # Update the record in the database.
-                            extension_in_db.instance.expires_on = renewal_date
+    # Render the template.
+    body = render_widget( requested_extension_id, extension_view, trial_days )
 
-                    # Save changes.
-                    db.session.commit()
+    # Cache the rendered widget for subsequent views.
+    cached_widget = cache.CachedWidget(
+        body,
+        etag,
+        extension_view.instance_id if extension_view is not None else None
+    )
+
+    if requested_extension_id is not None:
+        widget_cache.set( requested_extension_id, cached_widget )
+
+    return widget_response( body, etag, cached_widget )
+
+def variant_etag_held( etag ):
+
+    """
+    Return the entity tag of the widget variant the visitor already has, or None.
+
+    Widgets smaller than COMPRESSION_MIN_SIZE are sent unencoded even to visitors
+    that accept an encoding, so either variant may be current.
+    """
+
+    # Initialize variables.
+    encoding = response_compression.choose_encoding( request.accept_encodings )
+
+    for variant_etag in ( response_compression.encoded_etag( etag, encoding ), etag ):
+
+        if request.if_none_match.contains( variant_etag ):
+            return variant_etag
+
+    return None
+
+def widget_response( body, etag, cached_widget = None ):
+
+    """
+    Return a widget response with validators, or a 304 if the visitor already has it.
+
+    The body is compressed for the visitor when it is at least COMPRESSION_MIN_SIZE
+    bytes, reusing the compressed copy kept on the cached widget.
+    """
+
+    # Initialize variables.
+    encoding = response_compression.choose_encoding( request.accept_encodings )
+    data = body.encode( 'utf-8' ) if body is not None else None
+
+    # Small widgets are not worth compressing.
+    if data is not None and len( data ) < response_compression.COMPRESSION_MIN_SIZE:
+        encoding = None
+
+    variant_etag = response_compression.encoded_etag( etag, encoding )
+    held_etag = variant_etag_held( etag )
+
+    # If the visitor's copy is current, or the caller has no body to send...
+    if data is None or held_etag is not None:
+
+        response = Response( status = 304 )
+        variant_etag = held_etag or variant_etag
+
+    elif encoding is None:
+
+        response = Response( data, mimetype = 'text/html' )
+
+    else:
+
+        # Compress the body once per cached widget and encoding.
+        encoded = None
+
+        if cached_widget is not None:
+            encoded = cached_widget.encoded_bodies.get( encoding )
+
+        if encoded is None:
+
+            encoded = response_compression.compress( data, encoding )
+
+            if cached_widget is not None:
+                cached_widget.encoded_bodies[ encoding ] = encoded
+
+        response = Response( encoded, mimetype = 'text/html' )
+        response.headers[ 'Content-Encoding' ] = encoding
+
+    # Add the validator and caching policy.
+    response.set_etag( variant_etag )
+    response.vary.add( 'Accept-Encoding' )
+    response.headers[ 'Cache-Control' ] = WIDGET_CACHE_CONTROL
+
+    return response
+
+def render_widget( extension_id, extension_view, trial_days ):
+
+    # pylint: disable=too-many-locals
+    # Our variables are reasonable in this case.
+
+    """
+    Render the widget HTML of an extension from its WidgetView, or the placeholder if None.
+    """
 
-                except Exception as err :
+    # Initialize variables.
+    extension_version = None
+    is_free = True # Change to True for production.
+    before_image = url_for( 'static', filename = BEFORE_PLACEHOLDER_THUMBNAIL )
+    before_image_thumbnail = url_for( 'static', filename = BEFORE_PLACEHOLDER_THUMBNAIL )
+    before_label_text = 'Before'
+    before_alt_text = ''
+    after_image = url_for( 'static', filename = AFTER_PLACEHOLDER_THUMBNAIL )
+    after_image_thumbnail = url_for( 'static', filename = AFTER_PLACEHOLDER_THUMBNAIL )
+    after_label_text = 'After'
+    after_alt_text = ''
+    slider_offset = 50
+    slider_offset_float = 0.5
+    slider_orientation = 'horizontal'
+    slider_dark_mode = ''
+    mouseover_action = 1
+    handle_animation = 0
+    handle_border_color = '#BBBBBB'
+    encoded_handle_border_color = '%23BBBBBB'
+    is_move_on_click_enabled = False
 
-                    # Provide feedback for the user.
-                    print( 'Unable to resolve isFree status for Instance #' +
-                          extension_in_db.instance.instance_id + '. Error:' )
-                    print( err )
+    # Extension found.
+    if extension_view is not None:
+
+        # Update the local variables with stored values from the database.
+        is_free = extension_view.is_free
+        before_image = extension_view.before_image
+        before_image_thumbnail = extension_view.before_image_thumbnail
+        before_label_text = extension_view.before_label_text
+        before_alt_text = extension_view.before_alt_text
+        after_image = extension_view.after_image
+        after_image_thumbnail = extension_view.after_image_thumbnail
+        after_label_text = extension_view.after_label_text
+        after_alt_text = extension_view.after_alt_text
+        slider_offset = extension_view.offset
+        slider_offset_float = extension_view.offset_float
+        mouseover_action = extension_view.mouseover_action
+        handle_animation = extension_view.handle_animation
+        handle_border_color = extension_view.handle_border_color
+        encoded_handle_border_color = handle_border_color.replace( "#", "%23" )
+        is_move_on_click_enabled = extension_view.is_move_on_click_enabled
+        extension_version = extension_view.version
+
+        # If the user selected the vertical orientation...
+        if extension_view.is_vertical is True :
+
+            # Update the local variable for use in the widget template.
+            slider_orientation  = 'vertical'
+
+        # If the user selected dark mode...
+        if extension_view.is_dark is True :
+
+            # Update the local variable for use in the widget template.
+            slider_dark_mode  = 'dark'
+
+    # Mouseover action logic.
+    slider_no_overlay, slider_move_slider_on_hover = logic.mouseover_flags( mouseover_action )
+
+    # Offer resized copies of Wix images to smaller screens.
+    before_image_srcset = logic.wix_image_srcset( before_image )
+    after_image_srcset = logic.wix_image_srcset( after_image )
 
     # Pass local variables and render the template.
     return render_template( 'widget.html',
@@ -905,12 +1018,15 @@ def widget():
         app_version = APP_VERSION,
         is_free = is_free,
         trial_days = trial_days.days,
-        extension_id = requested_extension_id,
+        extension_id = extension_id,
+        extension_version = extension_version,
         before_image = before_image,
+        before_image_srcset = before_image_srcset,
         before_image_thumbnail = before_image_thumbnail,
         before_label_text = before_label_text,
         before_alt_text = before_alt_text,
         after_image = after_image,
+        after_image_srcset = after_image_srcset,
         after_image_thumbnail = after_image_thumbnail,
         after_label_text = after_label_text,
         after_alt_text = after_alt_text,
@@ -927,10 +1043,190 @@ def widget():
         slider_dark_mode = slider_dark_mode
     )
 
+# Publish static snapshots of widgets when WIDGET_SNAPSHOT_DIR is set.
+widget_snapshots = snapshots.SnapshotPublisher( app, render_widget, TRIAL_DAYS )
+app.extensions[ 'widget_snapshots' ] = widget_snapshots
+
+# Refresh snapshots whenever the data they were rendered from changes.
+@signals.extension_changed.connect
+def publish_extension_snapshot( extension_id, **_extra ):
+
+    """
+    Refresh the snapshot of a saved or deleted extension.
+    """
+    widget_snapshots.schedule( extension_id )
+
+@signals.instance_changed.connect
+def publish_instance_snapshots( instance_id, **_extra ):
+
+    """
+    Refresh the snapshots of an instance whose entitlement changed.
+    """
+    widget_snapshots.schedule_instance( instance_id )
+
+# Map the settings fields a partial update may change to Extension columns and their types.
+EXTENSION_PATCH_FIELDS = {
+    'beforeImage': ( 'before_image', str ),
+    'beforeImageThumbnail': ( 'before_image_thumbnail', str ),
+    'beforeLabelText': ( 'before_label_text', str ),
+    'beforeAltText': ( 'before_alt_text', str ),
+    'afterImage': ( 'after_image', str ),
+    'afterImageThumbnail': ( 'after_image_thumbnail', str ),
+    'afterLabelText': ( 'after_label_text', str ),
+    'afterAltText': ( 'after_alt_text', str ),
+    'sliderOffset': ( 'offset', int ),
+    'sliderOffsetFloat': ( 'offset_float', float ),
+    'sliderOrientation': ( 'is_vertical', lambda value: value == 'vertical' ),
+    'sliderDarkMode': ( 'is_dark', lambda value: value == 'dark' ),
+    'sliderMouseoverAction': ( 'mouseover_action', int ),
+    'sliderHandleAnimation': ( 'handle_animation', int ),
+    'sliderHandleBorderColor': ( 'handle_border_color', str ),
+    'sliderMoveOnClickToggle': ( 'is_move_on_click_enabled', lambda value: int( value ) == 1 )
+}
+
+# Partial widget updates
+@app.route( '/widget/<string:extension_id>', methods=['PATCH'] )
+def patch_widget( extension_id ):
+
+    """
+    Apply only the changed settings of an existing extension.
+
+    The body is {"version": <version the editor last saw>, "changes": {<field>: <value>}},
+    using the field names of the full save. Answers with the extension's current
+    version: 200 when saved or already up to date, 409 when another editor saved
+    first, and 404 when the extension is not saved yet, so the editor falls back
+    to a full save. A 409 also carries the saved settings as "state", so the
+    editor can show them instead of resending its stale changes.
+
+    Changes are written before answering, after any buffered full saves of the
+    extension, so a 200 means the version it carries is stored.
+    """
+
+    # Get the data received.
+    request_data = request.get_json( silent = True )
+
+    if ( not isinstance( request_data, dict ) or
+            not isinstance( request_data.get( 'changes' ), dict ) or
+            not isinstance( request_data.get( 'version' ), int ) ):
+
+        abort( 400 )
+
+    # Convert the changed fields to column values.
+    values = {}
+
+    try:
+
+        for field, value in request_data[ 'changes' ].items():
+
+            column, convert = EXTENSION_PATCH_FIELDS[ field ]
+            values[ column ] = convert( value )
+
+        # Reject values that do not fit their columns, e.g. labels that are too long.
+        writes.validate( values )
+
+    except ( KeyError, TypeError, ValueError ):
+
+        abort( 400 )
+
+    result = extension_writes.patch( extension_id, request_data[ 'version' ], values )
+
+    if result.status == 'missing':
+        abort( 404 )
+
+    if result.status == 'conflict':
+
+        # Send the saved settings, including any buffered saves.
+        extension_writes.flush( extension_id )
+        extension_view = queries.load_widget_view( extension_id )
+
+        if extension_view is None:
+            abort( 404 )
+
+        return { 'version': extension_view.version,
+                 'state': extension_state( extension_view ) }, 409
+
+    return { 'version': result.version }, 200
+
+def extension_state( extension_view ):
+
+    """
+    Return the saved settings of an extension with the field names of a full save.
+    """
+
+    return {
+        'beforeImage': extension_view.before_image,
+        'beforeImageThumbnail': extension_view.before_image_thumbnail,
+        'beforeLabelText': extension_view.before_label_text,
+        'beforeAltText': extension_view.before_alt_text,
+        'afterImage': extension_view.after_image,
+        'afterImageThumbnail': extension_view.after_image_thumbnail,
+        'afterLabelText': extension_view.after_label_text,
+        'afterAltText': extension_view.after_alt_text,
+        'sliderOffset': extension_view.offset,
+        'sliderOffsetFloat': extension_view.offset_float,
+        'sliderOrientation': 'vertical' if extension_view.is_vertical else 'horizontal',
+        'sliderMouseoverAction': extension_view.mouseover_action,
+        'sliderHandleAnimation': extension_view.handle_animation,
+        'sliderMoveOnClickToggle': int( bool( extension_view.is_move_on_click_enabled ) ),
+        'sliderHandleBorderColor': extension_view.handle_border_color,
+        'sliderDarkMode': 'dark' if extension_view.is_dark else ''
+    }
+
+def extension_values( request_data ):
+
+    """
+    Return the Extension column values of a save request from the settings panel.
+
+    Raises KeyError, TypeError or ValueError if the request is incomplete or a
+    value does not fit its column.
+    """
+
+    # Initialize variables.
+    before_image_thumbnail = url_for( 'static', filename = BEFORE_PLACEHOLDER_THUMBNAIL )
+    after_image_thumbnail = url_for( 'static', filename = AFTER_PLACEHOLDER_THUMBNAIL )
+
+    # Newly instantiated extensions may not yet have thumbnails.
+    if 'beforeImageThumbnail' in request_data :
+
+        # Update the variable.
+        before_image_thumbnail = request_data[ 'beforeImageThumbnail' ]
+
+    # Check if the request_data contains these properties.
+    if 'afterImageThumbnail' in request_data :
+
+        # Update the variable.
+        after_image_thumbnail = request_data[ 'afterImageThumbnail' ]
+
+    values = {
+        'before_image': request_data[ 'beforeImage' ],
+        'before_image_thumbnail': before_image_thumbnail,
+        'before_label_text': request_data[ 'beforeLabelText' ],
+        'before_alt_text': request_data[ 'beforeAltText' ],
+        'after_image': request_data[ 'afterImage' ],
+        'after_image_thumbnail': after_image_thumbnail,
+        'after_label_text': request_data[ 'afterLabelText' ],
+        'after_alt_text': request_data[ 'afterAltText' ],
+        'offset': int( request_data[ 'sliderOffset' ] ),
+        'offset_float': float( request_data[ 'sliderOffsetFloat' ] ),
+        # If the user selected the vertical orientation...
+        'is_vertical': request_data[ 'sliderOrientation' ] == 'vertical',
+        # If the user selected dark mode...
+        'is_dark': request_data[ 'sliderDarkMode' ] == 'dark',
+        'mouseover_action': int( request_data[ 'sliderMouseoverAction' ] ),
+        'handle_animation': int( request_data[ 'sliderHandleAnimation' ] ),
+        'handle_border_color': request_data[ 'sliderHandleBorderColor' ],
+        # If the user selected the move on click option...
+        'is_move_on_click_enabled': int( request_data[ 'sliderMoveOnClickToggle' ] ) == 1
+    }
+
+    writes.validate( values )
+
+    return values
+
 # Dashboard
 @app.route( '/dashboard/', methods=['GET'] )
-@app.route( '/dashboard/<string:instance_id>/<int:page>', methods=['GET'] )
-def dashboard( instance_id = '', page = 1 ):
+@app.route( '/dashboard/<string:instance_id>', methods=['GET'] )
+def dashboard( instance_id = '' ):
 
     """Return database contents."""
 
@@ -944,6 +1240,7 @@ def dashboard( instance_id = '', page = 1 ):
     instance = None
     extensions = None
     expiration_date = datetime.utcnow()
+    extension_count = 0
     extension_limit = DEFAULT_EXTENSION_LIMIT
     extension_limit_reached = False
 
@@ -953,33 +1250,13 @@ def dashboard( instance_id = '', page = 1 ):
         if instance_id == '' :
 
             if 'instance' in request.args :
-                # Get app instance.
-                # Extract signature and data.
-                # https://dev.wix.com/docs/build-apps/build-your-app/app-instance/app-instance-client-side
-                wix_signature, encoded_json = request.args.get( 'instance' ).split( '.', 1 )
-                payload = encoded_json.encode( "UTF-8" )
-                signature = wix_signature
-                secret = APP_SECRET.encode( "UTF-8" )
 
-                # Compare the signatures and verify a match.
-                signatures_did_match = logic.verify_hmac_signature( payload, signature, secret )
+                # Verify and decode the signed app instance.
+                # https://dev.wix.com/docs/build-apps/build-your-app/app-instance/app-instance-client-side
+                data = signed_instances.parse( request.args.get( 'instance' ) )
 
                 # If the signatures match...
-                if signatures_did_match :
-
-                    # Decode data from Wix.
-                    # Wix says, "In Ruby or Python, you should add the padding to the
-                    # Base64 encoded values that you get from Wix."
-                    # Source: https://dev.wix.com/docs/build-apps/build-your-app/app-instance/app-instance-client-side
-                    # Retrieved 12/31/2023
-                    #
-                    # The '=' below is sufficient padding.
-                    # Source: https://stackoverflow.com/questions/2941995/python-ignore-incorrect-padding-error-when-base64-decoding
-                    # Retrieved 12/31/2023
-                    decoded_data = encoded_json + ( "=" * ((4 - len( encoded_json ) % 4) % 4) )
-
-                    # Load data from Wix.
-                    data = json.loads( base64.b64decode( decoded_data ) )
+                if data is not None :
 
                     # Check if aid is returned in the instance parameter.
                     # Source: https://dev.wix.com/docs/build-apps/build-your-app/app-instance/app-instance-client-side
@@ -994,7 +1271,7 @@ def dashboard( instance_id = '', page = 1 ):
                         instance_id = data[ 'instanceId' ]
 
                         # Log event.
-                        print( "Signatures match. Instance ID is " + instance_id )
+                        logs.info( 'dashboard-authorized', instance_id = instance_id )
 
                     else:
 
@@ -1008,8 +1285,20 @@ def dashboard( instance_id = '', page = 1 ):
 
         # Update the local variables.
         instance = Instance.query.filter_by( instance_id = instance_id ).first()
-        extensions = Extension.query.filter_by( instance_id = instance_id ).paginate( page = page,
-                                                                                     per_page = 20 )
+
+        # Read one page of extensions after or before the cursor in the URL.
+        try:
+
+            extensions = queries.list_extensions(
+                instance_id,
+                after = request.args.get( 'after' ),
+                before = request.args.get( 'before' )
+            )
+
+        except ValueError:
+
+            # Reject tampered cursors.
+            abort( 400 )
 
         # Instance found.
         if instance is not None:
@@ -1039,3 +1328,24 @@ def dashboard( instance_id = '', page = 1 ):
         instance = instance,
         extensions = extensions
     )
+
+# Metrics
+@app.route( '/metrics', methods=['GET'] )
+def metrics_endpoint():
+
+    """
+    Return the metrics of every worker in the Prometheus text format.
+
+    Only served when METRICS_TOKEN is set, to scrapers that send it as a bearer token.
+    """
+
+    if not metrics.is_enabled():
+        abort( 404 )
+
+    if not metrics.is_authorized( request.headers.get( 'Authorization' ) ):
+        abort( 401 )
+
+    body, content_type = metrics.render()
+
+    return Response( body, headers = { 'Content-Type': content_type,
+                                      'Cache-Control': 'no-store' } )
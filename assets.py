@@ -0,0 +1,233 @@
+"""
+Bundle and fingerprint static assets for my Flask app for Wix.
+
+Build the bundles before starting the app with:
+
+    flask --app app build-assets
+
+Templates link the bundles through asset_url(), and fall back to the individual
+files when no manifest has been built, e.g. in development.
+
+Each build keeps the bundles of the previous ASSET_GENERATIONS - 1 builds, since
+running workers, cached widgets and published snapshots still link them until
+they restart or are republished.
+"""
+
+# Python imports
+import os
+import json
+import hashlib
+import click
+from dotenv import load_dotenv
+from flask import url_for
+
+# Minify the bundles when the optional minifiers are installed.
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+STATIC_DIR = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'static' )
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+HISTORY_NAME = 'manifest-history.json'
+
+# Keep the bundles of this many builds, counting the current one.
+ASSET_GENERATIONS = max( int( os.getenv( "ASSET_GENERATIONS", "5" ) ), 1 )
+
+# Bundles, and the static files they contain in load order.
+BUNDLES = {
+    'bundle.js': [
+        'js/jquery-3.7.0.min.js',
+        'js/jquery.event.move.js',
+        'js/jquery.twentytwenty.js',
+        'js/scripts.js'
+    ],
+    'bundle.css': [
+        'css/style.css',
+        'css/twentytwenty.css'
+    ]
+}
+
+# Bundled files are named by their content, so browsers may keep them for a year.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def minify( bundle_name, source ):
+
+    """
+    Return minified source if a minifier for its type is installed, or the source unchanged.
+    """
+
+    if bundle_name.endswith( '.js' ) and rjsmin is not None:
+        return rjsmin.jsmin( source )
+
+    if bundle_name.endswith( '.css' ) and rcssmin is not None:
+        return rcssmin.cssmin( source )
+
+    return source
+
+def build_bundle( bundle_name, file_names, static_dir = STATIC_DIR ):
+
+    """
+    Concatenate and minify the files of a bundle, and return its source.
+    """
+
+    # Initialize variables.
+    sources = []
+
+    for file_name in file_names:
+
+        with open( os.path.join( static_dir, file_name ), encoding = 'utf-8' ) as source_file:
+            sources.append( source_file.read() )
+
+    # Terminate each script so that files without trailing semicolons stay separate.
+    separator = '\n;\n' if bundle_name.endswith( '.js' ) else '\n'
+
+    return minify( bundle_name, separator.join( sources ) )
+
+def write_json( path, data ):
+
+    """
+    Replace a JSON file in one step, so readers never see it half written.
+    """
+
+    with open( path + '.tmp', 'w', encoding = 'utf-8' ) as json_file:
+        json.dump( data, json_file, indent = 2, sort_keys = True )
+
+    os.replace( path + '.tmp', path )
+
+def read_history( dist_dir ):
+
+    """
+    Return the manifests of recent builds, newest first.
+    """
+
+    try:
+
+        with open( os.path.join( dist_dir, HISTORY_NAME ), encoding = 'utf-8' ) as history_file:
+            history = json.load( history_file )
+
+    except ( FileNotFoundError, ValueError ):
+
+        history = []
+
+    return [ manifest for manifest in history if isinstance( manifest, dict ) ]
+
+def build_assets( static_dir = STATIC_DIR, generations = ASSET_GENERATIONS ):
+
+    """
+    Write every bundle under a content-hashed name, then the manifest, and return the manifest.
+
+    Bundles that none of the last generations of manifests link are removed.
+    """
+
+    # Initialize variables.
+    dist_dir = os.path.join( static_dir, DIST_DIR )
+    manifest = {}
+
+    os.makedirs( dist_dir, exist_ok = True )
+
+    for bundle_name, file_names in BUNDLES.items():
+
+        source = build_bundle( bundle_name, file_names, static_dir ).encode( 'utf-8' )
+        digest = hashlib.sha256( source ).hexdigest()[ :12 ]
+        stem, extension = os.path.splitext( bundle_name )
+        hashed_name = stem + '.' + digest + extension
+
+        with open( os.path.join( dist_dir, hashed_name ), 'wb' ) as bundle_file:
+            bundle_file.write( source )
+
+        manifest[ bundle_name ] = DIST_DIR + '/' + hashed_name
+
+    # Remember this build with the previous ones.
+    history = [ manifest ] + [ previous for previous in read_history( dist_dir )
+                               if previous != manifest ]
+    history = history[ :generations ]
+    write_json( os.path.join( dist_dir, HISTORY_NAME ), history )
+
+    # Swap in the manifest once its bundles are written.
+    write_json( os.path.join( dist_dir, MANIFEST_NAME ), manifest )
+
+    # Remove the bundles that no recent build links.
+    linked = { file_name for previous in history for file_name in previous.values() }
+
+    for file_name in os.listdir( dist_dir ):
+
+        if file_name in ( MANIFEST_NAME, HISTORY_NAME ):
+            continue
+
+        if DIST_DIR + '/' + file_name not in linked:
+            os.remove( os.path.join( dist_dir, file_name ) )
+
+    return manifest
+
+# Define the asset manifest class.
+class AssetManifest:
+
+    """
+    Look up the fingerprinted names of bundles from the manifest written by build-assets.
+    """
+
+    def __init__( self, static_dir = STATIC_DIR ):
+
+        # Initialize variables.
+        self.path = os.path.join( static_dir, DIST_DIR, MANIFEST_NAME )
+        self.bundles = {}
+        self.version = ''
+        self.load()
+
+    def load( self ):
+
+        """
+        Read the manifest, if one has been built.
+        """
+
+        try:
+
+            with open( self.path, encoding = 'utf-8' ) as manifest_file:
+                self.bundles = json.load( manifest_file )
+
+        except FileNotFoundError:
+
+            self.bundles = {}
+
+        # Summarize the bundles, so that validators of pages linking them change with them.
+        self.version = hashlib.sha256(
+            json.dumps( self.bundles, sort_keys = True ).encode( 'utf-8' ) ).hexdigest()[ :12 ]
+
+    def url( self, bundle_name ):
+
+        """
+        Return the URL of a built bundle, or None if it has not been built.
+        """
+
+        file_name = self.bundles.get( bundle_name )
+
+        if file_name is None:
+            return None
+
+        return url_for( 'static', filename = file_name )
+
+@click.command( 'build-assets' )
+def build_assets_command():
+
+    """
+    Bundle, minify and fingerprint the static JS and CSS files.
+    """
+
+    manifest = build_assets()
+
+    for bundle_name, file_name in sorted( manifest.items() ):
+        click.echo( bundle_name + ' -> static/' + file_name )
+
+    if rjsmin is None or rcssmin is None:
+        click.echo( 'Install rjsmin and rcssmin to minify the bundles.' )
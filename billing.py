@@ -0,0 +1,226 @@
+"""
+Keep instance billing state in sync with Wix for my Flask app for Wix.
+"""
+# pylint: disable=broad-exception-caught
+
+# Python imports
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+# Local imports
+from database import db
+import logic
+import logs
+import signals
+
+# Import models.
+from models import Instance
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+APP_ID = os.getenv( "APP_ID" )
+APP_SECRET = os.getenv( "APP_SECRET" )
+AUTH_PROVIDER_BASE_URL = os.getenv( "AUTH_PROVIDER_BASE_URL" )
+INSTANCE_API_URL = os.getenv( "INSTANCE_API_URL" )
+BILLING_REFRESH_WORKERS = int( os.getenv( "BILLING_REFRESH_WORKERS", "2" ) )
+BILLING_RECHECK_INTERVAL = timedelta(
+    seconds = int( os.getenv( "BILLING_RECHECK_INTERVAL", "300" ) )
+)
+
+# Create the executor that refreshes billing state off the request path.
+executor = ThreadPoolExecutor( max_workers = BILLING_REFRESH_WORKERS,
+                              thread_name_prefix = 'billing-refresh' )
+
+# Track the refresh in flight for each instance in this process.
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def apply_app_instance( instance, app_instance ):
+
+    """
+    Copy the billing state from a Wix app instance response onto an Instance record.
+
+    Returns True if the record changed.
+    """
+
+    # Initialize variables.
+    is_free = app_instance['instance']['isFree']
+    expires_on = instance.expires_on
+
+    # If the billing key is present...
+    if 'billing' in app_instance:
+
+        # Extract the billing data.
+        billing = app_instance['billing']
+
+        # If the 'expirationDate key is present...
+        if 'expirationDate' in billing:
+
+            # Get the new renewal date.
+            expires_on = datetime.strptime( billing['expirationDate'], '%Y-%m-%dT%H:%M:%SZ' )
+
+    # If nothing changed...
+    if is_free == instance.is_free and expires_on == instance.expires_on:
+        return False
+
+    # Update the record.
+    instance.is_free = is_free
+    instance.expires_on = expires_on
+
+    return True
+
+def lock_instance( instance_id ):
+
+    """
+    Hold a transaction-scoped advisory lock on the instance until the next commit or rollback.
+
+    This serializes refreshes of an instance across gunicorn workers and nodes.
+    Databases without advisory locks, e.g. SQLite in development, skip it.
+    """
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+
+        db.session.execute( text( "SELECT pg_advisory_xact_lock( hashtext( :key ) )" ),
+                           { 'key': 'billing-refresh:' + instance_id } )
+
+def refresh_instance( instance_id, force = False ):
+
+    """
+    Reconcile an instance's billing state with Wix and save any changes.
+
+    Waits for any refresh of the same instance running in another process, and
+    then skips the Wix call if that refresh checked the instance recently,
+    unless forced. Must run inside an application context. Returns True if the
+    record changed.
+    """
+
+    try:
+
+        # Wait for our turn, then read the instance as the previous holder left it.
+        lock_instance( instance_id )
+        instance = db.session.get( Instance, instance_id, populate_existing = True )
+
+        # The instance may have been removed since the refresh was requested.
+        if instance is None:
+
+            db.session.rollback()
+            return False
+
+        # If another worker just checked this instance, share its result.
+        if ( not force and instance.billing_checked_at is not None and
+                datetime.utcnow() - instance.billing_checked_at < BILLING_RECHECK_INTERVAL ):
+
+            db.session.rollback()
+            return False
+
+        return _refresh_locked_instance( instance )
+
+    except Exception:
+
+        # Release the lock.
+        db.session.rollback()
+        raise
+
+def get_app_instance( instance_id, refresh_token ):
+
+    """
+    Ask Wix for an instance's data with the app's credentials and cached access token.
+
+    Like logic.get_app_instance, returns the error instead of raising it.
+    """
+
+    return logic.get_app_instance(
+        refresh_token,
+        INSTANCE_API_URL,
+        AUTH_PROVIDER_BASE_URL,
+        APP_SECRET,
+        APP_ID,
+        instance_id = instance_id
+    )
+
+def _refresh_locked_instance( instance ):
+
+    """
+    Ask Wix for the billing state of an instance whose advisory lock we hold.
+    """
+
+    # Initialize variables.
+    instance_id = instance.instance_id
+
+    # Check with Wix for the current instance data.
+    app_instance = get_app_instance( instance_id, instance.refresh_token )
+
+    # get_app_instance returns the error instead of raising it.
+    if not isinstance( app_instance, dict ) or 'instance' not in app_instance:
+
+        raise ValueError( 'Unexpected app instance response: ' + str( app_instance ) )
+
+    # Record the check so concurrent refreshes can reuse it.
+    did_change = apply_app_instance( instance, app_instance )
+    instance.billing_checked_at = datetime.utcnow()
+
+    # Save changes and release the lock.
+    db.session.commit()
+
+    # If the billing state changed...
+    if did_change:
+
+        # Drop anything derived from the instance.
+        signals.instance_changed.send( instance_id )
+
+        # Log event.
+        logs.info( 'billing-refreshed', instance_id = instance_id, is_free = instance.is_free,
+                  expires_on = instance.expires_on )
+
+    return did_change
+
+def schedule_refresh( app, instance_id ):
+
+    """
+    Refresh an instance's billing state in the background and return the future.
+
+    Callers for an instance that is already being refreshed in this process
+    share the future of that refresh instead of starting another.
+    """
+
+    with _in_flight_lock:
+
+        future = _in_flight.get( instance_id )
+
+        if future is None:
+
+            future = executor.submit( _run_refresh, app, instance_id )
+            _in_flight[ instance_id ] = future
+
+    return future
+
+def _run_refresh( app, instance_id ):
+
+    """
+    Run a refresh in its own application context, logging rather than raising errors.
+    """
+
+    try:
+
+        with app.app_context():
+
+            return refresh_instance( instance_id )
+
+    except Exception as err :
+
+        # Provide feedback for the user.
+        logs.error( 'billing-refresh-failed', err, instance_id = instance_id )
+
+        return False
+
+    finally:
+
+        # Let the next caller start a new refresh.
+        with _in_flight_lock:
+            _in_flight.pop( instance_id, None )
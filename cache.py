@@ -0,0 +1,209 @@
+"""
+In-process caches for my Flask app for Wix.
+"""
+
+# Python imports
+import threading
+import time
+from collections import OrderedDict
+
+# Define the base cache class.
+class TTLCache:
+
+    """
+    A thread-safe, size-bounded LRU cache whose entries expire after a time-to-live.
+
+    Each gunicorn worker holds its own copy, so entries are only ever as fresh as
+    the TTL allows for writes handled by another worker.
+    """
+
+    def __init__( self, max_size = 1024, ttl = 60 ):
+
+        # Initialize variables.
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__( self ):
+        return len( self._entries )
+
+    def get( self, key, default = None ):
+
+        """
+        Return the cached value for the key, or the default if it is missing or expired.
+        """
+
+        with self._lock:
+
+            entry = self._entries.get( key )
+
+            # Cache miss.
+            if entry is None:
+
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+
+            # If the entry outlived its time-to-live...
+            if expires_at <= time.monotonic():
+
+                # Drop it and report a miss.
+                del self._entries[ key ]
+                self._forget( key, value )
+                self.misses += 1
+                return default
+
+            # Mark the entry as the most recently used.
+            self._entries.move_to_end( key )
+            self.hits += 1
+
+            return value
+
+    def set( self, key, value, ttl = None ):
+
+        """
+        Store the value under the key, evicting the least recently used entries if full.
+        """
+
+        # Use the default time-to-live unless the caller provided one.
+        if ttl is None:
+            ttl = self.ttl
+
+        with self._lock:
+
+            # Replace any existing entry.
+            if key in self._entries:
+                self._forget( key, self._entries.pop( key )[ 0 ] )
+
+            self._entries[ key ] = ( value, time.monotonic() + ttl )
+            self._remember( key, value )
+
+            # Evict the least recently used entries beyond the size limit.
+            while len( self._entries ) > self.max_size:
+
+                evicted_key, ( evicted_value, _ ) = self._entries.popitem( last = False )
+                self._forget( evicted_key, evicted_value )
+
+    def pop( self, key, default = None ):
+
+        """
+        Remove the entry for the key and return its value.
+        """
+
+        with self._lock:
+
+            entry = self._entries.pop( key, None )
+
+            if entry is None:
+                return default
+
+            self._forget( key, entry[ 0 ] )
+
+            return entry[ 0 ]
+
+    def clear( self ):
+
+        """
+        Remove every entry.
+        """
+
+        with self._lock:
+
+            for key, ( value, _ ) in self._entries.items():
+                self._forget( key, value )
+
+            self._entries.clear()
+
+    def _remember( self, key, value ):
+
+        """
+        Hook called with the lock held whenever an entry is added.
+        """
+
+    def _forget( self, key, value ):
+
+        """
+        Hook called with the lock held whenever an entry is removed.
+        """
+
+# Define the rendered widget class.
+class CachedWidget:
+
+    # pylint: disable=too-few-public-methods
+
+    """
+    A rendered widget response, its entity tag and the instance that owns it.
+
+    Compressed copies of the body are kept by encoding as they are first served.
+    checked_at is when the entity tag was last known to match the database.
+    """
+
+    __slots__ = ( 'body', 'etag', 'instance_id', 'encoded_bodies', 'checked_at' )
+
+    def __init__( self, body, etag, instance_id = None ):
+        self.body = body
+        self.etag = etag
+        self.instance_id = instance_id
+        self.encoded_bodies = {}
+        self.checked_at = time.monotonic()
+
+# Define the widget cache class.
+class WidgetCache( TTLCache ):
+
+    """
+    Cache of rendered widget responses keyed by extension ID.
+
+    Keeps a secondary index by instance ID so that every widget of an
+    instance can be dropped when its entitlement changes.
+
+    Invalidation only reaches the process that made the change, so callers
+    must revalidate entries against the database once they are a few seconds
+    old, which bounds how long other workers serve a stale widget.
+    """
+
+    def __init__( self, max_size = 1024, ttl = 60 ):
+        super().__init__( max_size, ttl )
+        self._keys_by_instance = {}
+
+    def invalidate( self, extension_id ):
+
+        """
+        Drop the cached widget for an extension.
+        """
+
+        self.pop( extension_id )
+
+    def invalidate_instance( self, instance_id ):
+
+        """
+        Drop every cached widget owned by an instance.
+        """
+
+        with self._lock:
+
+            for key in self._keys_by_instance.pop( instance_id, set() ):
+
+                entry = self._entries.pop( key, None )
+
+                if entry is not None:
+                    self._forget( key, entry[ 0 ] )
+
+    def _remember( self, key, value ):
+
+        if value.instance_id is not None:
+            self._keys_by_instance.setdefault( value.instance_id, set() ).add( key )
+
+    def _forget( self, key, value ):
+
+        keys = self._keys_by_instance.get( value.instance_id )
+
+        if keys is not None:
+
+            keys.discard( key )
+
+            if not keys:
+                del self._keys_by_instance[ value.instance_id ]
@@ -4,10 +4,12 @@ Set up database for my Flask app for Wix.
 # Python imports
 import os
 import sys
+import click
 from dotenv import load_dotenv
 
 # Flask imports
 from flask_sqlalchemy import SQLAlchemy
+from flask.cli import with_appcontext
 from flask_migrate import Migrate
 
 # Create a database object.
@@ -37,7 +39,7 @@ if DEVELOPMENT_MODE is True:
     # SQL Lite for local development.
     db_uri = 'postgresql://' + DATABASE_USERNAME + ':' + DATABASE_PASSWORD + '@' + DATABASE_HOST + ':' + DATABASE_PORT + '/' + DATABASE_NAME
     
-elif len( sys.argv ) > 0 and sys.argv[1] != 'static':
+elif len( sys.argv ) < 2 or sys.argv[1] != 'static':
 
     if os.getenv( "DATABASE_URL", None ) is None:
 
@@ -54,3 +56,17 @@ def init_db():
     # Issue CREATE statements for our tables and their related constructs.
     # Note: the db.create_all() function does not recreate or update a table if it already exists.
     db.create_all()
+
+@click.command( 'init-db' )
+@with_appcontext
+def init_db_command():
+
+    """
+    Create the tables of a new database, e.g. for local development or load tests.
+
+    Follow with 'flask db stamp head' so later migrations start from here.
+    """
+
+    init_db()
+
+    click.echo( 'Done. Created any missing tables.' )
@@ -1,2 +1,90 @@
+"""
+Gunicorn settings for my Flask app for Wix.
+
+The default sync workers serve one request at a time, so a request waiting on
+Wix takes its whole worker out of service. Set GUNICORN_WORKER_CLASS=gevent to
+serve each worker's requests as cooperative green threads instead. Blocking
+socket calls, including Wix API calls and, with psycogreen, Postgres queries,
+then yield to other requests while they wait. See "Serving modes" in the README.
+"""
+
+# Python imports
+import os
+import glob
+import multiprocessing
+
 bind = "0.0.0.0:8080"
-workers = 2
+
+# Choose the worker class: 'sync' or 'gevent'.
+worker_class = os.getenv( "GUNICORN_WORKER_CLASS", "sync" )
+
+if worker_class == 'gevent':
+
+    # One process per core is enough, since each serves many requests at once.
+    workers = int( os.getenv( "WEB_CONCURRENCY", str( multiprocessing.cpu_count() ) ) )
+
+    # Concurrent requests per worker. Keep DATABASE_POOL_SIZE and WIX_POOL_SIZE
+    # in proportion, or requests will queue for connections instead.
+    worker_connections = int( os.getenv( "GUNICORN_WORKER_CONNECTIONS", "100" ) )
+
+else:
+
+    workers = int( os.getenv( "WEB_CONCURRENCY", "2" ) )
+
+def post_fork( server, worker ):
+
+    # pylint: disable=unused-argument
+    # pylint: disable=import-outside-toplevel
+
+    """
+    Make psycopg2 cooperative in gevent workers, before any connection is opened.
+    """
+
+    if worker_class != 'gevent':
+        return
+
+    try:
+
+        from psycogreen.gevent import patch_psycopg
+
+    except ImportError:
+
+        server.log.warning( "psycogreen is not installed, so database queries block "
+                            "gevent workers." )
+        return
+
+    patch_psycopg()
+
+def on_starting( server ):
+
+    # pylint: disable=unused-argument
+
+    """
+    Clear the metrics files of a previous run, so counters start from zero.
+    """
+
+    directory = os.getenv( "PROMETHEUS_MULTIPROC_DIR" )
+
+    if not directory:
+        return
+
+    os.makedirs( directory, exist_ok = True )
+
+    for path in glob.glob( os.path.join( directory, '*.db' ) ):
+        os.remove( path )
+
+def child_exit( server, worker ):
+
+    # pylint: disable=unused-argument
+    # pylint: disable=import-outside-toplevel
+
+    """
+    Retire the live gauges of a worker that exited, e.g. checked-out connections.
+    """
+
+    if not os.getenv( "PROMETHEUS_MULTIPROC_DIR" ):
+        return
+
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead( worker.pid )
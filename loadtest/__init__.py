@@ -0,0 +1,9 @@
+"""
+Load tests for my Flask app for Wix.
+
+    wix_stub    A local stand-in for the Wix APIs that also signs webhooks.
+    run         Drives traffic mixes at the app and reports latency per route.
+    micro       Times per-request hot paths in-process, against saved baselines.
+
+See "Load Testing" in the README.
+"""
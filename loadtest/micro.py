@@ -0,0 +1,333 @@
+"""
+Microbenchmarks of the code that runs on every request to my Flask app for Wix.
+
+Run them, saving the results as a baseline:
+
+    python -m loadtest.micro --save micro-baseline.json
+
+Then, after a change, compare against the baseline:
+
+    python -m loadtest.micro --compare micro-baseline.json
+
+Each benchmark is timed in-process, against an in-memory SQLite database so that
+they measure the app's own CPU time and never touch real data. Compare runs made
+on the same machine and Python only.
+"""
+
+# Python imports
+import os
+import sys
+import json
+import timeit
+import argparse
+import platform
+import statistics
+from datetime import datetime, timedelta, timezone
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# The app reads its database URL on import.
+os.environ[ 'DEVELOPMENT_MODE' ] = 'False'
+os.environ[ 'DATABASE_URL' ] = 'sqlite://'
+
+# Local imports
+# pylint: disable=wrong-import-position
+import app as wix_app
+from database import db
+import logic
+import queries
+import webhooks
+from models import Instance, Extension
+from loadtest.wix_stub import WebhookSigner, sign_instance
+
+# Define constants.
+DEFAULT_REPEAT = 7
+DEFAULT_THRESHOLD = 0.10
+APP_SECRET = 'micro-benchmark-secret'
+EXTENSION_ID = 'micro-extension'
+INSTANCE_ID = 'micro-instance'
+
+# Wix media URLs, so widgets render their responsive image sets.
+BEFORE_IMAGE = 'https://static.wixstatic.com/media/micro_before.jpg'
+AFTER_IMAGE = 'https://static.wixstatic.com/media/micro_after.jpg'
+
+def seed_database():
+
+    """
+    Create the tables and one paid instance with one slider, and return the slider's view.
+    """
+
+    db.create_all()
+
+    db.session.merge( Instance(
+        instance_id = INSTANCE_ID,
+        site_id = INSTANCE_ID,
+        refresh_token = INSTANCE_ID,
+        is_free = False,
+        did_cancel = False,
+        expires_on = datetime.utcnow() + timedelta( days = 30 )
+    ) )
+    db.session.merge( Extension(
+        extension_id = EXTENSION_ID,
+        instance_id = INSTANCE_ID,
+        before_image = BEFORE_IMAGE,
+        before_image_thumbnail = BEFORE_IMAGE,
+        before_label_text = 'Before',
+        before_alt_text = 'The kitchen before',
+        after_image = AFTER_IMAGE,
+        after_image_thumbnail = AFTER_IMAGE,
+        after_label_text = 'After',
+        after_alt_text = 'The kitchen after',
+        offset = 50,
+        offset_float = 0.5,
+        is_vertical = False,
+        is_dark = False,
+        mouseover_action = 1,
+        handle_animation = 0,
+        handle_border_color = '#BBBBBB',
+        is_move_on_click_enabled = False
+    ) )
+    db.session.commit()
+
+    return queries.load_widget_view( EXTENSION_ID )
+
+def settings_context( view, trial_days ):
+
+    """
+    Return the context the settings route renders settings.html with.
+    """
+
+    return {
+        'page_id': 'settings',
+        'app_id': 'micro-app',
+        'app_version': wix_app.APP_VERSION,
+        'instance_id': view.instance_id,
+        'is_free': view.is_free,
+        'extension_id': view.extension_id,
+        'before_image': view.before_image,
+        'before_image_thumbnail': view.before_image_thumbnail,
+        'before_label_text': view.before_label_text,
+        'before_alt_text': view.before_alt_text,
+        'after_image': view.after_image,
+        'after_image_thumbnail': view.after_image_thumbnail,
+        'after_label_text': view.after_label_text,
+        'after_alt_text': view.after_alt_text,
+        'slider_offset': view.offset,
+        'slider_offset_float': view.offset_float,
+        'is_vertical': view.is_vertical,
+        'is_dark': view.is_dark,
+        'mouseover_action': view.mouseover_action,
+        'handle_animation': view.handle_animation,
+        'handle_border_color': view.handle_border_color,
+        'is_move_on_click_enabled': view.is_move_on_click_enabled,
+        'trial_days': trial_days.days
+    }
+
+def build_benchmarks( view ):
+
+    """
+    Return the benchmarks by name, as functions of no arguments.
+
+    Must run inside a request context.
+    """
+
+    # pylint: disable=too-many-locals
+
+    # Initialize variables.
+    trial_days = logic.calculate_trial_days( wix_app.TRIAL_DAYS, view.instance_created_at )
+    context = settings_context( view, trial_days )
+    created_at = datetime.now( timezone.utc ) - timedelta( days = 3 )
+
+    # Sign a dashboard instance as Wix does.
+    token = sign_instance( INSTANCE_ID, APP_SECRET )
+    signature, encoded_json = token.split( '.', 1 )
+    warm_parser = logic.SignedInstanceParser( APP_SECRET )
+
+    # Sign a webhook as Wix does.
+    signer = WebhookSigner( rsa.generate_private_key( public_exponent = 65537, key_size = 2048 ) )
+    verifier = webhooks.WebhookVerifier.from_pem( signer.public_pem() )
+    webhook = signer.sign( INSTANCE_ID, { 'vendorProductId': 'micro',
+                                         'expiresOn': '2030-01-01T00:00:00Z' } )
+
+    def render_widget():
+        wix_app.render_widget( EXTENSION_ID, view, trial_days )
+
+    def render_settings():
+        wix_app.render_template( 'settings.html', **context )
+
+    def verify_hmac_signature():
+        logic.verify_hmac_signature( encoded_json.encode( 'UTF-8' ), signature,
+                                    APP_SECRET.encode( 'UTF-8' ) )
+
+    def parse_instance_cold():
+        logic.SignedInstanceParser( APP_SECRET ).parse( token )
+
+    def parse_instance_cached():
+        warm_parser.parse( token )
+
+    def calculate_trial_days():
+        logic.calculate_trial_days( wix_app.TRIAL_DAYS, created_at )
+
+    def decode_webhook():
+
+        # Follow the route and the worker: replay check, verification, then the event data.
+        if not verifier.is_replay( webhook ):
+            event = verifier.verify( 'upgrade', webhook )
+            json.loads( event.data[ 'data' ] )
+
+    def load_extension_orm():
+
+        # Start each load with a new session, as each request does.
+        db.session.remove()
+        return db.session.get( Extension, EXTENSION_ID ).instance.is_free
+
+    def load_widget_view():
+        db.session.remove()
+        queries.load_widget_view( EXTENSION_ID )
+
+    return {
+        'render widget.html': render_widget,
+        'render settings.html': render_settings,
+        'verify_hmac_signature': verify_hmac_signature,
+        'parse signed instance (cold)': parse_instance_cold,
+        'parse signed instance (cached)': parse_instance_cached,
+        'calculate_trial_days': calculate_trial_days,
+        'decode webhook JWT': decode_webhook,
+        'load Extension and Instance (ORM)': load_extension_orm,
+        'load_widget_view': load_widget_view
+    }
+
+def measure( function, repeat ):
+
+    """
+    Time a function, and return its per-call times in microseconds.
+
+    The loop count is chosen so that each run takes at least 0.2 seconds.
+    """
+
+    timer = timeit.Timer( function )
+    loops, _ = timer.autorange()
+    times = [ total / loops * 1e6 for total in timer.repeat( repeat, loops ) ]
+
+    return {
+        'loops': loops,
+        'runs': repeat,
+        'min_us': round( min( times ), 3 ),
+        'median_us': round( statistics.median( times ), 3 )
+    }
+
+def environment():
+
+    """
+    Describe where the results were measured, since they only compare on the same setup.
+    """
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'database': db.engine.url.get_backend_name(),
+        'measured_at': datetime.now( timezone.utc ).isoformat( timespec = 'seconds' )
+    }
+
+def compare( baseline, results, threshold ):
+
+    """
+    Print the change in median time of each benchmark, and return the names that got slower.
+    """
+
+    # Initialize variables.
+    slower = []
+
+    print( f"{ 'benchmark':<36} { 'baseline us':>12} { 'current us':>12} { 'change':>8}" )
+
+    for name, result in results.items():
+
+        before = baseline.get( name )
+
+        if before is None:
+
+            print( f"{ name:<36} { '-':>12} { result[ 'median_us' ]:>12.3f} { 'new':>8}" )
+            continue
+
+        change = result[ 'median_us' ] / before[ 'median_us' ] - 1
+        verdict = ''
+
+        if change > threshold:
+
+            verdict = '  slower'
+            slower.append( name )
+
+        elif change < -threshold:
+
+            verdict = '  faster'
+
+        print( f"{ name:<36} { before[ 'median_us' ]:>12.3f} { result[ 'median_us' ]:>12.3f} "
+               f"{ change * 100:>+7.1f}%{ verdict }" )
+
+    return slower
+
+def main():
+
+    """
+    Run the benchmarks, then save or compare the results.
+    """
+
+    parser = argparse.ArgumentParser( description = 'Microbenchmark per-request hot paths.' )
+    parser.add_argument( '--filter', default = '',
+                        help = 'Run only benchmarks whose names contain this.' )
+    parser.add_argument( '--repeat', type = int, default = DEFAULT_REPEAT,
+                        help = 'Timed runs of each benchmark.' )
+    parser.add_argument( '--save', help = 'Write the results to this JSON file.' )
+    parser.add_argument( '--compare', help = 'Compare with results saved by --save.' )
+    parser.add_argument( '--threshold', type = float, default = DEFAULT_THRESHOLD,
+                        help = 'Fractional change in median time to flag, e.g. 0.1.' )
+    args = parser.parse_args()
+
+    # Initialize variables.
+    results = {}
+
+    # Render as the widget route would, so url_for and the templates work.
+    with wix_app.app.test_request_context( '/widget/',
+                                          query_string = { 'origCompId': EXTENSION_ID } ):
+
+        view = seed_database()
+
+        for name, function in build_benchmarks( view ).items():
+
+            if args.filter not in name:
+                continue
+
+            results[ name ] = measure( function, args.repeat )
+
+            result = results[ name ]
+            print( f"{ name:<36} { result[ 'median_us' ]:>12.3f} us  "
+                   f"(min { result[ 'min_us' ]:.3f}, "
+                   f"{ result[ 'loops' ]:d} loops x { result[ 'runs' ]:d} runs)" )
+
+        report = {
+            'environment': environment(),
+            'benchmarks': results
+        }
+
+    if args.save:
+
+        with open( args.save, 'w', encoding = 'utf-8' ) as report_file:
+            json.dump( report, report_file, indent = 2 )
+
+        print( 'Saved to ' + args.save + '.' )
+
+    if args.compare:
+
+        with open( args.compare, encoding = 'utf-8' ) as baseline_file:
+            baseline = json.load( baseline_file )
+
+        print()
+        slower = compare( baseline[ 'benchmarks' ], results, args.threshold )
+
+        # Fail, e.g. in CI, when anything got slower.
+        if slower:
+            sys.exit( 1 )
+
+if __name__ == '__main__':
+    main()
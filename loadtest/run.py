@@ -0,0 +1,505 @@
+"""
+Drive synthetic traffic at my Flask app for Wix and report latency per route.
+
+Start the Wix stub and the app with its settings, then run a traffic mix:
+
+    python -m loadtest.run --mix mixed --concurrency 20 --duration 30
+
+Each run first installs the load-test instances through /redirect-wix/ and saves
+their extensions through /widget/, so it works against an empty database.
+Pass --json to keep the report for comparison with later runs.
+"""
+# pylint: disable=broad-exception-caught
+
+# Python imports
+import re
+import sys
+import json
+import math
+import time
+import html
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import requests
+from dotenv import dotenv_values
+
+# Local imports
+from loadtest.wix_stub import DEFAULT_KEY_FILE, WebhookSigner, load_or_create_key, sign_instance
+
+# Define constants.
+DEFAULT_TARGET = 'http://127.0.0.1:8080'
+DEFAULT_INSTANCES = 5
+DEFAULT_EXTENSIONS = 50
+REQUEST_TIMEOUT = 30
+WEBHOOK_BURST = 10
+DASHBOARD_MAX_PAGES = 3
+PERCENTILES = ( 50, 95, 99 )
+
+# Wix media URLs, so widgets render their responsive image sets.
+BEFORE_IMAGE = 'https://static.wixstatic.com/media/loadtest_before.jpg'
+AFTER_IMAGE = 'https://static.wixstatic.com/media/loadtest_after.jpg'
+
+# Find the dashboard's Next link.
+NEXT_PAGE_PATTERN = re.compile( r'href="([^"]*[?&](?:amp;)?after=[^"]*)"' )
+
+# Define the fixture class.
+class Fixture:
+
+    """
+    The load-test instances and extensions, and the secrets that sign requests for them.
+    """
+
+    def __init__( self, target, app_secret, signer, instances, extensions ):
+
+        # Initialize variables.
+        self.target = target
+        self.app_secret = app_secret
+        self.signer = signer
+        self.instance_ids = [ 'loadtest-i' + str( i ) for i in range( instances ) ]
+        self.extension_ids = {
+            instance_id: [ instance_id + '-e' + str( e ) for e in range( extensions ) ]
+            for instance_id in self.instance_ids
+        }
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def random_extension( self ):
+
+        """
+        Return the instance ID and ID of a random load-test extension.
+        """
+
+        instance_id = random.choice( self.instance_ids )
+
+        return instance_id, random.choice( self.extension_ids[ instance_id ] )
+
+    def version( self, extension_id ):
+
+        """
+        Return the last version of an extension this run saw, as an editor would.
+        """
+
+        with self._lock:
+            return self.versions.get( extension_id, 1 )
+
+    def saw_version( self, extension_id, version ):
+
+        """
+        Remember the version the app answered with.
+        """
+
+        with self._lock:
+            self.versions[ extension_id ] = version
+
+# Define the recorder class.
+class Recorder:
+
+    """
+    Collect the latency and outcome of each request by route.
+    """
+
+    def __init__( self ):
+
+        # Initialize variables.
+        self.samples = {}
+        self.errors = {}
+        self.recording = False
+        self._lock = threading.Lock()
+
+    def request( self, route, session, method, url, expected = ( 200, ), **kwargs ):
+
+        """
+        Send a request, record it under the route, and return the response or None.
+        """
+
+        # Initialize variables.
+        response = None
+        started = time.perf_counter()
+
+        try:
+
+            response = session.request( method, url, timeout = REQUEST_TIMEOUT,
+                                       allow_redirects = False, **kwargs )
+            is_error = response.status_code not in expected
+
+        except requests.RequestException:
+
+            is_error = True
+
+        elapsed = time.perf_counter() - started
+
+        if self.recording:
+
+            with self._lock:
+
+                self.samples.setdefault( route, [] ).append( elapsed )
+
+                if is_error:
+                    self.errors[ route ] = self.errors.get( route, 0 ) + 1
+
+        return response
+
+    def report( self, duration ):
+
+        """
+        Return the throughput and latency percentiles of each route.
+        """
+
+        # Initialize variables.
+        routes = {}
+
+        for route, samples in sorted( self.samples.items() ):
+
+            samples = sorted( samples )
+            routes[ route ] = {
+                'requests': len( samples ),
+                'errors': self.errors.get( route, 0 ),
+                'rps': round( len( samples ) / duration, 1 ),
+                'max_ms': round( samples[ -1 ] * 1000, 1 )
+            }
+
+            for percentile in PERCENTILES:
+                routes[ route ][ 'p' + str( percentile ) + '_ms' ] = round(
+                    percentile_of( samples, percentile ) * 1000, 1 )
+
+        return routes
+
+def percentile_of( ordered, percentile ):
+
+    """
+    Return the nearest-rank percentile of a sorted, non-empty list.
+    """
+
+    rank = math.ceil( percentile / 100 * len( ordered ) )
+
+    return ordered[ max( rank, 1 ) - 1 ]
+
+def save_payload( instance_id, extension_id ):
+
+    """
+    Return a full save from the settings panel.
+    """
+
+    return {
+        'action': 'save',
+        'instanceId': instance_id,
+        'extensionId': extension_id,
+        'beforeImage': BEFORE_IMAGE,
+        'beforeImageThumbnail': BEFORE_IMAGE,
+        'beforeLabelText': 'Before',
+        'beforeAltText': 'Before',
+        'afterImage': AFTER_IMAGE,
+        'afterImageThumbnail': AFTER_IMAGE,
+        'afterLabelText': 'After',
+        'afterAltText': 'After',
+        'sliderOffset': random.randint( 10, 90 ),
+        'sliderOffsetFloat': 0.5,
+        'sliderOrientation': 'horizontal',
+        'sliderDarkMode': 'light',
+        'sliderMouseoverAction': 1,
+        'sliderHandleAnimation': 0,
+        'sliderHandleBorderColor': '#BBBBBB',
+        'sliderMoveOnClickToggle': 0
+    }
+
+def widget_view( recorder, session, fixture ):
+
+    """
+    View a widget, as site visitors do.
+    """
+
+    _instance_id, extension_id = fixture.random_extension()
+
+    recorder.request( 'GET /widget/', session, 'GET', fixture.target + '/widget/',
+                     expected = ( 200, 304 ), params = { 'viewerCompId': extension_id } )
+
+def settings_view( recorder, session, fixture ):
+
+    """
+    Open the settings panel of a widget.
+    """
+
+    _instance_id, extension_id = fixture.random_extension()
+
+    recorder.request( 'GET /settings/', session, 'GET', fixture.target + '/settings/',
+                     params = { 'origCompId': extension_id } )
+
+def settings_save( recorder, session, fixture ):
+
+    """
+    Save a whole widget from the settings panel.
+    """
+
+    instance_id, extension_id = fixture.random_extension()
+
+    recorder.request( 'POST /widget/', session, 'POST', fixture.target + '/widget/',
+                     expected = ( 201, ),
+                     data = json.dumps( save_payload( instance_id, extension_id ) ) )
+
+def settings_patch( recorder, session, fixture ):
+
+    """
+    Save a changed setting, as the settings panel does while it is being edited.
+
+    Conflicts are expected when two editors save the same widget, and are not
+    errors. After one, the save is sent again with the version the app answered,
+    as it would be once the editor reloads.
+    """
+
+    _instance_id, extension_id = fixture.random_extension()
+
+    for _attempt in range( 2 ):
+
+        response = recorder.request(
+            'PATCH /widget/<id>', session, 'PATCH', fixture.target + '/widget/' + extension_id,
+            expected = ( 200, 409 ),
+            json = {
+                'version': fixture.version( extension_id ),
+                'changes': { 'sliderOffset': random.randint( 10, 90 ) }
+            }
+        )
+
+        if response is None or response.status_code not in ( 200, 409 ):
+            break
+
+        fixture.saw_version( extension_id, response.json()[ 'version' ] )
+
+        if response.status_code == 200:
+            break
+
+def dashboard_pages( recorder, session, fixture ):
+
+    """
+    Open the dashboard of an instance and page through its extensions.
+    """
+
+    # Initialize variables.
+    instance_id = random.choice( fixture.instance_ids )
+    url = ( fixture.target + '/dashboard/?instance=' +
+            sign_instance( instance_id, fixture.app_secret ) )
+    route = 'GET /dashboard/'
+
+    for _page in range( DASHBOARD_MAX_PAGES ):
+
+        response = recorder.request( route, session, 'GET', url )
+
+        if response is None:
+            break
+
+        match = NEXT_PAGE_PATTERN.search( response.text )
+
+        if match is None:
+            break
+
+        url = requests.compat.urljoin( fixture.target, html.unescape( match.group( 1 ) ) )
+        route = 'GET /dashboard/<id>?after='
+
+def install( recorder, session, fixture ):
+
+    """
+    Install the app on a new site, which calls the Wix stub three times.
+    """
+
+    recorder.request( 'GET /redirect-wix/', session, 'GET', fixture.target + '/redirect-wix/',
+                     expected = ( 302, ),
+                     params = { 'code': 'loadtest', 'instanceId': 'loadtest-' + random_id() } )
+
+def webhook_burst( recorder, session, fixture ):
+
+    """
+    Deliver a burst of plan webhooks for an instance, as Wix does after billing changes.
+    """
+
+    # Initialize variables.
+    instance_id = random.choice( fixture.instance_ids )
+    expires_on = ( datetime.now( timezone.utc ) + timedelta( days = 30 ) ).strftime(
+        '%Y-%m-%dT%H:%M:%SZ'
+    )
+
+    for _delivery in range( WEBHOOK_BURST ):
+
+        event_type = random.choice( ( 'upgrade', 'downgrade' ) )
+        token = fixture.signer.sign( instance_id, {
+            'vendorProductId': 'loadtest',
+            'expiresOn': expires_on
+        } )
+
+        recorder.request( 'POST /' + event_type + '/', session, 'POST',
+                         fixture.target + '/' + event_type + '/', data = token )
+
+def random_id():
+
+    """
+    Return a random hexadecimal ID.
+    """
+
+    return f'{ random.getrandbits( 128 ):032x}'
+
+# Weight the scenarios of each traffic mix.
+MIXES = {
+    'widget': { widget_view: 1 },
+    'editor': { settings_view: 1, settings_patch: 4, settings_save: 1, widget_view: 2 },
+    'dashboard': { dashboard_pages: 1 },
+    'install': { install: 1, widget_view: 4 },
+    'webhooks': { webhook_burst: 1 },
+    'mixed': {
+        widget_view: 80,
+        settings_view: 4,
+        settings_patch: 8,
+        settings_save: 2,
+        dashboard_pages: 2,
+        install: 2,
+        webhook_burst: 1
+    }
+}
+
+def seed( fixture, concurrency ):
+
+    """
+    Install the load-test instances and save their extensions through the app.
+
+    Reinstalling and resaving are harmless, so every run can seed.
+    """
+
+    # Initialize variables.
+    recorder = Recorder()
+    session = requests.Session()
+
+    for instance_id in fixture.instance_ids:
+
+        response = recorder.request( 'seed', session, 'GET', fixture.target + '/redirect-wix/',
+                                    params = { 'code': 'loadtest', 'instanceId': instance_id } )
+
+        if response is None or response.status_code != 302:
+            raise RuntimeError( 'Unable to install ' + instance_id +
+                               '. Is the app pointed at the stub?' )
+
+    def save_all( instance_id ):
+
+        with requests.Session() as save_session:
+
+            for extension_id in fixture.extension_ids[ instance_id ]:
+
+                save_session.post( fixture.target + '/widget/', timeout = REQUEST_TIMEOUT,
+                                  data = json.dumps( save_payload( instance_id, extension_id ) ) )
+
+    with ThreadPoolExecutor( max_workers = concurrency ) as executor:
+        list( executor.map( save_all, fixture.instance_ids ) )
+
+def run( fixture, mix, concurrency, duration, warmup ):
+
+    """
+    Drive a traffic mix from concurrent clients, and return the recorder.
+
+    Each client sends its next request as soon as the last one is answered.
+    """
+
+    # Initialize variables.
+    recorder = Recorder()
+    scenarios = list( MIXES[ mix ].keys() )
+    weights = list( MIXES[ mix ].values() )
+    deadline = time.monotonic() + warmup + duration
+
+    def client():
+
+        with requests.Session() as session:
+
+            while time.monotonic() < deadline:
+
+                scenario = random.choices( scenarios, weights )[ 0 ]
+
+                try:
+                    scenario( recorder, session, fixture )
+                except Exception as err :
+                    print( 'Scenario ' + scenario.__name__ + ' failed: ' + str( err ),
+                           file = sys.stderr )
+
+    threads = [ threading.Thread( target = client, daemon = True ) for _ in range( concurrency ) ]
+
+    for thread in threads:
+        thread.start()
+
+    # Record only once the caches and pools have warmed up.
+    time.sleep( warmup )
+    recorder.recording = True
+
+    for thread in threads:
+        thread.join()
+
+    return recorder
+
+def print_report( routes ):
+
+    """
+    Print the report as a table.
+    """
+
+    print( f"{ 'route':<28} { 'requests':>8} { 'errors':>7} { 'rps':>8} "
+           f"{ 'p50 ms':>9} { 'p95 ms':>9} { 'p99 ms':>9} { 'max ms':>9}" )
+
+    for route, stats in routes.items():
+
+        print( f"{ route:<28} { stats[ 'requests' ]:>8d} { stats[ 'errors' ]:>7d} "
+               f"{ stats[ 'rps' ]:>8.1f} { stats[ 'p50_ms' ]:>9.1f} { stats[ 'p95_ms' ]:>9.1f} "
+               f"{ stats[ 'p99_ms' ]:>9.1f} { stats[ 'max_ms' ]:>9.1f}" )
+
+def main():
+
+    """
+    Seed, run a traffic mix, and report.
+    """
+
+    parser = argparse.ArgumentParser( description = 'Load test the app with a traffic mix.' )
+    parser.add_argument( '--target', default = DEFAULT_TARGET, help = 'URL of the app.' )
+    parser.add_argument( '--mix', choices = sorted( MIXES ), default = 'mixed' )
+    parser.add_argument( '--concurrency', type = int, default = 10 )
+    parser.add_argument( '--duration', type = float, default = 30, help = 'Seconds to record.' )
+    parser.add_argument( '--warmup', type = float, default = 5,
+                        help = 'Seconds to run before recording.' )
+    parser.add_argument( '--instances', type = int, default = DEFAULT_INSTANCES )
+    parser.add_argument( '--extensions', type = int, default = DEFAULT_EXTENSIONS,
+                        help = 'Extensions per instance.' )
+    parser.add_argument( '--env', default = 'loadtest.env',
+                        help = 'Settings written by the Wix stub.' )
+    parser.add_argument( '--key-file', default = DEFAULT_KEY_FILE,
+                        help = 'RSA key the Wix stub signs webhooks with.' )
+    parser.add_argument( '--json', dest = 'json_path', help = 'Also write the report here.' )
+    args = parser.parse_args()
+
+    # Initialize variables.
+    settings = dotenv_values( args.env )
+    fixture = Fixture(
+        args.target.rstrip( '/' ),
+        settings.get( 'APP_SECRET' ) or '',
+        WebhookSigner( load_or_create_key( args.key_file ) ),
+        args.instances,
+        args.extensions
+    )
+
+    print( 'Seeding ' + str( args.instances ) + ' instances with ' + str( args.extensions ) +
+          ' extensions each...' )
+    seed( fixture, args.concurrency )
+
+    print( 'Running the ' + args.mix + ' mix with ' + str( args.concurrency ) +
+          ' clients for ' + str( args.duration ) + 's...' )
+    recorder = run( fixture, args.mix, args.concurrency, args.duration, args.warmup )
+    routes = recorder.report( args.duration )
+
+    print_report( routes )
+
+    if args.json_path:
+
+        with open( args.json_path, 'w', encoding = 'utf-8' ) as report_file:
+
+            json.dump( {
+                'mix': args.mix,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'routes': routes
+            }, report_file, indent = 2 )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""
+A local stand-in for the Wix APIs, for load testing my Flask app for Wix.
+
+Start the stub, which writes the settings that point the app at it:
+
+    python -m loadtest.wix_stub --latency 0.25 --env loadtest.env
+
+The stub answers the OAuth /access endpoint, the app instance API and the BI
+event endpoint after a fixed delay that stands in for Wix's latency. It also
+holds the RSA key that signs load-test webhooks, and writes its public key to
+WEBHOOK_PUBLIC_KEY so the app verifies them as it would Wix's.
+"""
+
+# Python imports
+import os
+import json
+import hmac
+import uuid
+import time
+import base64
+import hashlib
+import secrets
+import argparse
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+# Define constants.
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9100
+DEFAULT_LATENCY = 0.25
+DEFAULT_KEY_FILE = 'loadtest-key.pem'
+ACCESS_TOKEN_LIFETIME = 300
+
+# Paths the app is pointed at by the settings the stub writes.
+OAUTH_PATH = '/oauth'
+INSTANCE_API_PATH = '/apps/v1/instance'
+BI_EVENT_PATH = '/apps/v1/bi-event'
+
+def load_or_create_key( path ):
+
+    """
+    Return the RSA private key in a PEM file, creating the file if it does not exist.
+    """
+
+    if os.path.exists( path ):
+
+        with open( path, 'rb' ) as key_file:
+            return serialization.load_pem_private_key( key_file.read(), password = None )
+
+    private_key = rsa.generate_private_key( public_exponent = 65537, key_size = 2048 )
+    pem = private_key.private_bytes(
+        encoding = serialization.Encoding.PEM,
+        format = serialization.PrivateFormat.PKCS8,
+        encryption_algorithm = serialization.NoEncryption()
+    )
+
+    # Keep the key private to its owner.
+    handle = os.open( path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600 )
+
+    with os.fdopen( handle, 'wb' ) as key_file:
+        key_file.write( pem )
+
+    return private_key
+
+def sign_instance( instance_id, app_secret ):
+
+    """
+    Return a signed 'instance' parameter for an instance, as Wix passes to app pages.
+    """
+
+    # Initialize variables.
+    claims = {
+        'instanceId': instance_id,
+        'signDate': datetime.now( timezone.utc ).isoformat(),
+        'permissions': 'OWNER'
+    }
+
+    # Wix leaves the padding off both halves.
+    encoded_json = base64.b64encode( json.dumps( claims ).encode( 'utf-8' ) ).decode().rstrip( '=' )
+    signature = hmac.new( app_secret.encode( 'utf-8' ), encoded_json.encode( 'utf-8' ),
+                         hashlib.sha256 ).digest()
+    encoded_signature = base64.urlsafe_b64encode( signature ).decode().rstrip( '=' )
+
+    return encoded_signature + '.' + encoded_json
+
+# Define the webhook signer class.
+class WebhookSigner:
+
+    """
+    Sign webhooks in the shape Wix sends them, with RS256.
+    """
+
+    def __init__( self, private_key ):
+
+        # Initialize variables.
+        self.private_key = private_key
+
+    def public_pem( self ):
+
+        """
+        Return the PEM-encoded public key that verifies this signer's webhooks.
+        """
+
+        return self.private_key.public_key().public_bytes(
+            encoding = serialization.Encoding.PEM,
+            format = serialization.PublicFormat.SubjectPublicKeyInfo
+        ).decode( 'utf-8' )
+
+    def sign( self, instance_id, data = None ):
+
+        """
+        Return a signed webhook for an instance, with optional event data.
+
+        Every token is unique, so the app never treats one as a redelivery.
+        """
+
+        payload = {
+            'data': json.dumps( {
+                'instanceId': instance_id,
+                'data': json.dumps( data or {} )
+            } ),
+            'iat': int( time.time() ),
+            'jti': uuid.uuid4().hex
+        }
+
+        return jwt.encode( payload, self.private_key, algorithm = 'RS256' )
+
+# Define the request handler class.
+class WixStubHandler( BaseHTTPRequestHandler ):
+
+    """
+    Answer the Wix API calls the app makes, after the server's latency.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST( self ):
+
+        # pylint: disable=invalid-name
+
+        """
+        Answer token exchanges and BI events.
+        """
+
+        # Read the body so the connection can be reused.
+        self.rfile.read( int( self.headers.get( 'Content-Length', 0 ) ) )
+
+        if self.path == OAUTH_PATH + '/access':
+
+            # Rotate the refresh token, which the app stores as a unique column.
+            self.send_json( {
+                'access_token': 'loadtest-' + uuid.uuid4().hex,
+                'refresh_token': 'loadtest-' + uuid.uuid4().hex,
+                'expires_in': ACCESS_TOKEN_LIFETIME
+            } )
+
+        elif self.path == BI_EVENT_PATH:
+
+            self.send_json( {} )
+
+        else:
+
+            self.send_json( { 'message': 'Not found' }, 404 )
+
+    def do_GET( self ):
+
+        # pylint: disable=invalid-name
+
+        """
+        Answer app instance lookups with a free, unpublished site.
+        """
+
+        if self.path.split( '?' )[ 0 ] == INSTANCE_API_PATH:
+
+            # Site IDs are a unique column, so give every lookup its own.
+            self.send_json( {
+                'instance': { 'instanceId': uuid.uuid4().hex, 'isFree': True },
+                'site': { 'siteId': uuid.uuid4().hex }
+            } )
+
+        else:
+
+            self.send_json( { 'message': 'Not found' }, 404 )
+
+    def send_json( self, data, status = 200 ):
+
+        """
+        Send a JSON response after the simulated latency.
+        """
+
+        time.sleep( self.server.latency )
+
+        body = json.dumps( data ).encode( 'utf-8' )
+
+        self.send_response( status )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, format, *args ):
+
+        # pylint: disable=redefined-builtin
+
+        """
+        Keep the console quiet under load.
+        """
+
+# Define the stub server class.
+class WixStub( ThreadingHTTPServer ):
+
+    """
+    Serve the stand-in Wix APIs, one thread per connection.
+    """
+
+    daemon_threads = True
+
+    def __init__( self, host = DEFAULT_HOST, port = DEFAULT_PORT, latency = DEFAULT_LATENCY ):
+
+        # Initialize variables.
+        self.latency = latency
+
+        super().__init__( ( host, port ), WixStubHandler )
+
+    @property
+    def base_url( self ):
+
+        """
+        Return the URL of the stub.
+        """
+
+        host, port = self.server_address[ :2 ]
+
+        return 'http://' + host + ':' + str( port )
+
+def write_env( path, base_url, signer, app_id = 'loadtest', app_secret = None ):
+
+    """
+    Write the settings that point the app at the stub, in the format of a .env file.
+
+    Both the app and the load runner read the file, so they share the app secret
+    that signs dashboard instances.
+    """
+
+    settings = {
+        'APP_ID': app_id,
+        'APP_SECRET': app_secret or secrets.token_hex( 16 ),
+        'AUTH_PROVIDER_BASE_URL': base_url + OAUTH_PATH,
+        'INSTANCE_API_URL': base_url + INSTANCE_API_PATH,
+        'WIX_API_BASE_URL': base_url,
+        'WEBHOOK_PUBLIC_KEY': signer.public_pem().strip()
+    }
+
+    with open( path, 'w', encoding = 'utf-8' ) as env_file:
+
+        for name, value in settings.items():
+            env_file.write( name + '="' + value + '"\n' )
+
+def main():
+
+    """
+    Serve the stub until interrupted.
+    """
+
+    parser = argparse.ArgumentParser( description = 'Serve a local stand-in for the Wix APIs.' )
+    parser.add_argument( '--host', default = DEFAULT_HOST )
+    parser.add_argument( '--port', type = int, default = DEFAULT_PORT )
+    parser.add_argument( '--latency', type = float, default = DEFAULT_LATENCY,
+                        help = 'Seconds to wait before each response.' )
+    parser.add_argument( '--key-file', default = DEFAULT_KEY_FILE,
+                        help = 'RSA key that signs webhooks. Created if missing.' )
+    parser.add_argument( '--env', default = 'loadtest.env',
+                        help = 'File to write the app settings to.' )
+    args = parser.parse_args()
+
+    # Initialize variables.
+    signer = WebhookSigner( load_or_create_key( args.key_file ) )
+    stub = WixStub( args.host, args.port, args.latency )
+
+    # Keep an app secret that is already configured, so running apps keep working.
+    write_env( args.env, stub.base_url, signer, app_secret = os.getenv( 'APP_SECRET' ) )
+
+    print( 'Serving the Wix stub at ' + stub.base_url + ' with ' + str( args.latency ) +
+          's latency. App settings written to ' + args.env + '.' )
+
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -4,37 +4,63 @@ Helper functions mostly to handle Wix authorization.
 # pylint: disable=broad-exception-caught
 
 # Import dependencies.
+import os
 import hmac
 import hashlib
 import base64
+import json
+import re
+import threading
 from datetime import datetime, timedelta, timezone
-import requests
+from dotenv import load_dotenv
 
-# Dump variable values to the terminal.
+# Local imports
+import cache
+import logs
+from wix_client import client as wix
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Wix access tokens are valid for five minutes unless the response says otherwise.
+# Source: https://dev.wix.com/docs/build-apps/develop-your-app/access/authentication/use-basic-oauth
+DEFAULT_ACCESS_TOKEN_LIFETIME = 300
+
+# Refresh cached access tokens this many seconds before they expire.
+ACCESS_TOKEN_REFRESH_MARGIN = 60
+
+# Keep verified signed instances for at most this many seconds after Wix signed them.
+SIGNED_INSTANCE_MAX_AGE = 3600
+
+# Send Wix REST API calls here. Benchmarks point it at a local stub.
+WIX_API_BASE_URL = os.getenv( "WIX_API_BASE_URL", "https://www.wixapis.com" )
+
+# Offer resized copies of Wix images at these widths.
+RESPONSIVE_IMAGE_WIDTHS = ( 320, 480, 640, 960, 1280, 1920 )
+
+# Match original Wix media files that the Wix image service can resize.
+# Animated GIFs are left alone, since resizing flattens them.
+WIX_MEDIA_PATTERN = re.compile(
+    r'^(https://static\.wixstatic\.com/media/)([^/?#]+\.(?:jpe?g|png|webp))$',
+    re.IGNORECASE
+)
+
+# Dump variable values to the log.
 def dump( item, name ):
 
     """
-    Print the item contents to the terminal.
+    Log the item contents as a debug event, with any secrets redacted.
     """
 
-    print( type( item ) )
-    print( name + "=" )
-    print( item )
-    print( "===========================" )
+    logs.debug( 'dump', dump_name = name, type = type( item ).__name__, value = item )
 
 def log_call( route, instance_id = None ):
 
     """
-    Log an event to the terminal.
+    Log a call from Wix to a route.
     """
 
-    print( "Got a call from Wix for /" + route + "/" )
-
-    if instance_id is not None :
-
-        print( "Instance ID: " + instance_id )
-
-    print( "=============================" )
+    logs.info( 'wix-call', route = route, instance_id = instance_id )
 
 def verify_hmac_signature( payload, signature, secret ):
 
@@ -58,8 +84,106 @@ def verify_hmac_signature( payload, signature, secret ):
     # Format signature to remove padding (Wix encoding does not add the padding character)
     expected_signature = encoded_signature.decode().replace( "=", "" )
 
-    # Compare signatures.
-    return expected_signature == signature
+    # Compare signatures in constant time.
+    return hmac.compare_digest( expected_signature.encode(), signature.encode() )
+
+# Define the signed instance parser class.
+class SignedInstanceParser:
+
+    """
+    Verify and decode the signed 'instance' parameter that Wix passes to app pages.
+
+    Verified tokens are cached with their decoded claims until an hour after
+    Wix signed them, so reloading or paging through a dashboard with the same
+    token skips the HMAC and decoding. Invalid tokens are never cached.
+    """
+
+    def __init__( self, secret, max_size = 1024, max_age = SIGNED_INSTANCE_MAX_AGE ):
+
+        # Initialize variables.
+        self.secret = secret
+        self.max_age = max_age
+        self._claims = cache.TTLCache( max_size, max_age )
+
+    @property
+    def claims( self ):
+
+        """
+        The cache of recently verified claims, e.g. for metrics.
+        """
+
+        return self._claims
+
+    def parse( self, token ):
+
+        """
+        Return the claims of a validly signed instance token, or None.
+
+        See https://dev.wix.com/docs/build-apps/build-your-app/app-instance/app-instance-client-side
+        """
+
+        # Return the claims of a token we verified recently.
+        claims = self._claims.get( token )
+
+        if claims is not None:
+            return claims
+
+        # Extract signature and data.
+        try:
+            wix_signature, encoded_json = token.split( '.', 1 )
+        except ValueError:
+            return None
+
+        # Compare the signatures and verify a match.
+        if not verify_hmac_signature( encoded_json.encode( "UTF-8" ), wix_signature,
+                                     self.secret.encode( "UTF-8" ) ):
+            return None
+
+        # Decode data from Wix.
+        # Wix says, "In Ruby or Python, you should add the padding to the
+        # Base64 encoded values that you get from Wix."
+        # Source:
+        # https://dev.wix.com/docs/build-apps/build-your-app/app-instance/app-instance-client-side
+        # Retrieved 12/31/2023
+        #
+        # The '=' below is sufficient padding.
+        # Source:
+        # https://stackoverflow.com/questions/2941995/python-ignore-incorrect-padding-error-when-base64-decoding
+        # Retrieved 12/31/2023
+        decoded_data = encoded_json + ( "=" * ((4 - len( encoded_json ) % 4) % 4) )
+
+        # Load data from Wix.
+        claims = json.loads( base64.b64decode( decoded_data ) )
+
+        # Cache the claims until the token is max_age seconds old.
+        ttl = self._remaining_lifetime( claims )
+
+        if ttl > 0:
+            self._claims.set( token, claims, ttl )
+
+        return claims
+
+    def _remaining_lifetime( self, claims ):
+
+        """
+        Return how many more seconds the claims may be cached, based on their signDate.
+        """
+
+        try:
+
+            signed_at = datetime.fromisoformat( claims[ 'signDate' ] )
+
+            if signed_at.tzinfo is None:
+                signed_at = signed_at.replace( tzinfo = timezone.utc )
+
+        except ( KeyError, TypeError, ValueError ):
+
+            # Without a usable timestamp, fall back to the full lifetime.
+            return self.max_age
+
+        age = ( datetime.now( timezone.utc ) - signed_at ).total_seconds()
+
+        return min( self.max_age - age, self.max_age )
 
 # Calculate trial days
 def calculate_trial_days( trial_days, start_date ):
@@ -68,6 +192,10 @@ def calculate_trial_days( trial_days, start_date ):
     Calculate the trial days elapsed in the Free Trial.
     """
 
+    # Databases without time zone support, e.g. SQLite, return naive UTC dates.
+    if start_date.tzinfo is None:
+        start_date = start_date.replace( tzinfo = timezone.utc )
+
     # Subtract the instance creation date
     # from today's date.
     trial_days_elapsed = datetime.now( timezone.utc ) - start_date
@@ -84,6 +212,77 @@ def calculate_trial_days( trial_days, start_date ):
 
     return trial_days
 
+# Build a responsive srcset for a Wix image.
+def wix_image_srcset( image_url, widths = RESPONSIVE_IMAGE_WIDTHS ):
+
+    """
+    Return a width-descriptor srcset of resized copies of a Wix media image, or None.
+
+    Each copy uses the Wix image service's /v1/fit/ transform with enc_auto, so
+    browsers that support WebP or AVIF get them. Heights are left effectively
+    unbounded so that the width alone sets the scale. URLs that are not
+    original Wix media files, e.g. placeholders, have no srcset.
+    """
+
+    # Initialize variables.
+    match = WIX_MEDIA_PATTERN.match( image_url or '' )
+
+    if match is None:
+        return None
+
+    media_url, file_name = match.groups()
+
+    return ', '.join(
+        media_url + file_name + '/v1/fit/w_' + str( width ) + ',h_' + str( width * 10 ) +
+        ',q_90,enc_auto/' + file_name + ' ' + str( width ) + 'w'
+        for width in widths
+    )
+
+# Translate the mouseover setting for the widget template.
+def mouseover_flags( mouseover_action ):
+
+    """
+    Return whether the slider has no overlay and whether it moves on hover.
+
+    Action 0 does nothing on mouseover, 1 shows the overlay and 2 moves the slider.
+    """
+
+    # Do nothing on mouseover.
+    if mouseover_action == 0:
+        return True, False
+
+    # Move slider on mouseover.
+    if mouseover_action == 2:
+        return False, True
+
+    return False, False
+
+# Build a validator for a rendered widget.
+def widget_etag( view, trial_days, app_version ):
+
+    """
+    Build a strong entity tag for a widget from everything that affects its markup.
+
+    Args:
+    view: The WidgetView of the extension, or None if the extension is not saved yet.
+    trial_days: The trial days remaining, as a timedelta.
+    app_version: The version of the app, which changes the templates and assets.
+
+    Returns:
+    A hex digest that changes whenever the rendered widget would change.
+    """
+
+    # Initialize variables.
+    state = [ app_version, trial_days.days ]
+
+    # Include every stored column of the extension and its owner's entitlement.
+    if view is not None:
+
+        state += list( view )
+
+    # Hash a stable representation of the state.
+    return hashlib.sha256( json.dumps( state, default = str ).encode( "UTF-8" ) ).hexdigest()
+
 # Define functions.
 def get_tokens_from_wix( auth_code, auth_provider_base_url, app_secret, app_id ):
 
@@ -106,21 +305,18 @@ def get_tokens_from_wix( auth_code, auth_provider_base_url, app_secret, app_id )
     }
 
     # Request an access token.
-    token_request = requests.post( url, json = body_parameters, timeout=2.50 )
+    token_request = wix.post( url, json = body_parameters )
     dump( token_request.text, "token_request.text" )
 
     # Return the resposne with access and refresh tokens.
     return token_request.text
 
-def get_access_token( refresh_token, auth_provider_base_url, app_secret, app_id ):
+def request_access_token( refresh_token, auth_provider_base_url, app_secret, app_id ):
 
     """
-    Get a new Wix Access Token using a Refresh Token.
-    
-    This code was adapted from functions posted by SAMobileDev repository here: 
-    https://github.com/wix-incubator/sample-wix-rest-app/blob/master/src/index.js
-    Source: Wix Sample Rest App source code https://github.com/wix-incubator
-    retrieved in June 2023.
+    Exchange a Refresh Token for new tokens and return the whole response.
+
+    Raises an exception if Wix does not return an access token.
     """
 
     # Initialize variables.
@@ -132,10 +328,31 @@ def get_access_token( refresh_token, auth_provider_base_url, app_secret, app_id
         'grant_type': "refresh_token"
     }
 
+    # Request an access token.
+    tokens = wix.post( url, json = body_parameters ).json()
+
+    # Fail loudly rather than caching an error response.
+    if 'access_token' not in tokens:
+        raise ValueError( 'Wix did not return an access token: ' + str( tokens ) )
+
+    return tokens
+
+def get_access_token( refresh_token, auth_provider_base_url, app_secret, app_id ):
+
+    """
+    Get a new Wix Access Token using a Refresh Token.
+    
+    This code was adapted from functions posted by SAMobileDev repository here: 
+    https://github.com/wix-incubator/sample-wix-rest-app/blob/master/src/index.js
+    Source: Wix Sample Rest App source code https://github.com/wix-incubator
+    retrieved in June 2023.
+    """
+
     try:
 
         # Request an access token.
-        token_request = requests.post( url, json = body_parameters, timeout = 2.50 ).json()
+        token_request = request_access_token( refresh_token, auth_provider_base_url,
+                                             app_secret, app_id )
 
         # Extract the access token from response.
         access_token = token_request[ 'access_token' ]
@@ -146,36 +363,141 @@ def get_access_token( refresh_token, auth_provider_base_url, app_secret, app_id
     except Exception as err :
 
         # Provide feedback for the user.
-        print( 'error in get_access_token' )
-        print( err )
+        logs.error( 'get-access-token-failed', err )
 
         # Exit the function.
         return err
 
-def get_app_instance( refresh_token, instance_api_url, auth_provider_base_url, app_secret, app_id ):
+# Define the access token cache class.
+class AccessTokenCache:
+
+    """
+    Thread-safe cache of Wix access tokens keyed by instance ID.
+
+    Tokens are refreshed ahead of their expiry, and concurrent callers for the
+    same instance wait for a single token exchange. When Wix rotates the refresh
+    token, on_rotate is called with the instance ID and the new refresh token so
+    the caller can store it.
+    """
+
+    def __init__( self, max_size = 4096, refresh_margin = ACCESS_TOKEN_REFRESH_MARGIN ):
+
+        # Initialize variables.
+        self.refresh_margin = refresh_margin
+        self.on_rotate = None
+        self._tokens = cache.TTLCache( max_size )
+        self._locks = [ threading.Lock() for _ in range( 64 ) ]
+
+    @property
+    def tokens( self ):
+
+        """
+        The cache of access tokens, e.g. for metrics.
+        """
+
+        return self._tokens
+
+    def get( self, instance_id, refresh_token, auth_provider_base_url, app_secret, app_id ):
+
+        """
+        Return a valid access token for the instance, exchanging the refresh token if needed.
+        """
+
+        # Return the cached token if it is still fresh.
+        access_token = self._tokens.get( instance_id )
+
+        if access_token is not None:
+            return access_token
+
+        # Let one thread per instance exchange the refresh token.
+        with self._locks[ hash( instance_id ) % len( self._locks ) ]:
+
+            # Another thread may have refreshed the token while we waited.
+            access_token = self._tokens.get( instance_id )
+
+            if access_token is not None:
+                return access_token
+
+            tokens = request_access_token( refresh_token, auth_provider_base_url,
+                                          app_secret, app_id )
+
+            return self.store( instance_id, tokens, refresh_token )
+
+    def store( self, instance_id, tokens, refresh_token = None ):
+
+        """
+        Cache the tokens returned by Wix for an instance and return the access token.
+        """
+
+        # Keep the token until shortly before it expires.
+        lifetime = int( tokens.get( 'expires_in', DEFAULT_ACCESS_TOKEN_LIFETIME ) )
+        self._tokens.set( instance_id, tokens[ 'access_token' ],
+                         max( lifetime - self.refresh_margin, 0 ) )
+
+        # If Wix issued a new refresh token, hand it over to be stored.
+        new_refresh_token = tokens.get( 'refresh_token' )
+
+        if ( refresh_token is not None and new_refresh_token and
+                new_refresh_token != refresh_token and self.on_rotate is not None ):
+
+            # The app assigns on_rotate after creating the cache.
+            self.on_rotate( instance_id, new_refresh_token ) # pylint: disable=not-callable
+
+        return tokens[ 'access_token' ]
+
+    def invalidate( self, instance_id ):
+
+        """
+        Forget the cached token for an instance.
+        """
+
+        self._tokens.pop( instance_id )
+
+# Create the shared access token cache.
+access_tokens = AccessTokenCache()
+
+def get_app_instance( refresh_token, instance_api_url, auth_provider_base_url, app_secret, app_id,
+                     *, instance_id = None ):
+
+    # pylint: disable=too-many-arguments
 
     """
     This is a call to Wix instance API - you can find it here: 
     https://dev.wix.com/api/rest/app-management/apps/app-instance/get-app-instance
+
+    If the instance ID is given, the access token comes from the shared cache.
     """
 
     try:
-        print( 'get_app_instance with refreshToken = ' + refresh_token )
-        print( "==============================" )
-        access_token = get_access_token( refresh_token, auth_provider_base_url, app_secret, app_id )
+        logs.debug( 'get-app-instance', instance_id = instance_id )
+
+        if instance_id is not None:
+
+            access_token = access_tokens.get( instance_id, refresh_token, auth_provider_base_url,
+                                             app_secret, app_id )
+
+        else:
+
+            access_token = get_access_token( refresh_token, auth_provider_base_url,
+                                            app_secret, app_id )
 
         headers = {
             'Authorization': access_token
         }
-        instance = requests.get( instance_api_url, headers = headers, timeout = 2.50 ).json()
+        response = wix.get( instance_api_url, headers = headers )
+
+        # Drop a cached token that Wix no longer accepts so the next call refreshes it.
+        if response.status_code == 401 and instance_id is not None:
+            access_tokens.invalidate( instance_id )
+
+        instance = response.json()
 
         return instance
 
     except Exception as err :
 
         # Provide feedback for the user.
-        print( 'error in get_app_instance' )
-        print( err )
+        logs.error( 'get-app-instance-failed', err, instance_id = instance_id )
 
         # Exit the function.
         return err
@@ -187,12 +509,11 @@ def finish_app_installation( access_token ):
     to mark the installation as finished:
     https://dev.wix.com/docs/rest/articles/getting-started/authentication#step-7-app-finishes-installation
     """
-    print( 'Finish app installation.' )
-    print( "==============================" )
+    logs.debug( 'finish-app-installation' )
     try:
 
         # Initialize variables.
-        post_request_url = "https://www.wixapis.com/apps/v1/bi-event"
+        post_request_url = WIX_API_BASE_URL + "/apps/v1/bi-event"
         headers = {
             'Authorization': access_token
         }
@@ -201,11 +522,10 @@ def finish_app_installation( access_token ):
         }
 
         # Mark the installation as finished
-        response = requests.post(
+        response = wix.post(
             post_request_url,
             headers = headers,
-            json = body_parameters,
-            timeout = 2.50
+            json = body_parameters
         ).json()
 
         return response
@@ -213,8 +533,7 @@ def finish_app_installation( access_token ):
     except Exception as err :
 
         # Provide feedback for the user.
-        print( 'error in finish_app_installation' )
-        print( err )
+        logs.error( 'finish-app-installation-failed', err )
 
         # Exit the function.
         return err
@@ -0,0 +1,309 @@
+"""
+Structured logging for my Flask app for Wix.
+
+Each event is written as one JSON line on stdout, e.g.
+
+    {"time": "2024-05-01T12:00:00.123Z", "level": "info", "event": "webhook-queued", ...}
+
+Callers only put the event on a queue. A background thread formats and writes
+it, so requests never wait on stdout. If the queue fills up, new events are
+dropped and counted rather than blocking the request.
+
+Fields that look like secrets, e.g. tokens, and tokens inside URLs and text
+are redacted before they are written.
+
+Set LOG_SAMPLE_RATES to keep only a fraction of the info and debug events of
+busy routes, by Flask endpoint, e.g. "widget=0.01,patch_widget=0.1". Sampled
+events carry their sample_rate. Warnings and errors are always kept.
+"""
+
+# Python imports
+import os
+import re
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from flask import has_request_context, request
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+LOG_LEVEL = os.getenv( "LOG_LEVEL", "INFO" ).upper()
+LOG_QUEUE_SIZE = int( os.getenv( "LOG_QUEUE_SIZE", "10000" ) )
+LOG_SAMPLE_RATES = os.getenv( "LOG_SAMPLE_RATES", "" )
+
+# Redact fields with these names, and their nested fields.
+SECRET_FIELD_PATTERN = re.compile(
+    r'token|secret|password|authorization|cookie|signature|^code$|^instance$',
+    re.IGNORECASE
+)
+
+# Redact secrets inside text: query parameters, JSON members, bearer tokens and JWTs.
+SECRET_TEXT_PATTERNS = (
+    ( re.compile(
+        r'\b((?:access_token|refresh_token|client_secret|token|code|instance)=)[^&\s"\']+'
+    ), r'\1[REDACTED]' ),
+    ( re.compile( r'("(?:access_token|refresh_token|client_secret|code)"\s*:\s*)"[^"]*"' ),
+      r'\1"[REDACTED]"' ),
+    ( re.compile( r'\b(Bearer\s+)\S+', re.IGNORECASE ), r'\1[REDACTED]' ),
+    ( re.compile( r'\beyJ[\w-]+\.[\w-]+\.[\w-]*' ), '[REDACTED]' )
+)
+REDACTED = '[REDACTED]'
+
+# Log through a logger of our own, so library loggers keep their settings.
+logger = logging.getLogger( 'before-after-images' )
+logger.setLevel( LOG_LEVEL )
+logger.propagate = False
+
+def parse_sample_rates( value ):
+
+    """
+    Parse "endpoint=rate,..." into a dictionary of rates from 0 to 1.
+    """
+
+    # Initialize variables.
+    rates = {}
+
+    for item in value.split( ',' ):
+
+        endpoint, _separator, rate = item.partition( '=' )
+
+        if endpoint.strip() and rate.strip():
+            rates[ endpoint.strip() ] = min( max( float( rate ), 0.0 ), 1.0 )
+
+    return rates
+
+sample_rates = parse_sample_rates( LOG_SAMPLE_RATES )
+
+def redact( value ):
+
+    """
+    Return a copy of a field value with secrets replaced by [REDACTED].
+    """
+
+    if isinstance( value, dict ):
+
+        return {
+            str( key ): REDACTED if SECRET_FIELD_PATTERN.search( str( key ) ) else redact( item )
+            for key, item in value.items()
+        }
+
+    if isinstance( value, ( list, tuple ) ):
+        return [ redact( item ) for item in value ]
+
+    if value is None or isinstance( value, ( bool, int, float ) ):
+        return value
+
+    # Log anything else, e.g. exceptions, as its text.
+    text = str( value )
+
+    for pattern, replacement in SECRET_TEXT_PATTERNS:
+        text = pattern.sub( replacement, text )
+
+    return text
+
+# Define the JSON formatter class.
+class JsonFormatter( logging.Formatter ):
+
+    """
+    Format an event as one line of JSON, with its secrets redacted.
+    """
+
+    def format( self, record ):
+
+        # Initialize variables.
+        line = {
+            'time': datetime.fromtimestamp( record.created, timezone.utc )
+                .isoformat( timespec = 'milliseconds' ).replace( '+00:00', 'Z' ),
+            'level': record.levelname.lower(),
+            'event': record.msg
+        }
+        line.update( redact( getattr( record, 'fields', {} ) ) )
+
+        if record.exc_text:
+            line[ 'traceback' ] = redact( record.exc_text )
+
+        return json.dumps( line, default = str )
+
+# Define the queue handler class.
+class DroppingQueueHandler( logging.handlers.QueueHandler ):
+
+    """
+    Put events on a bounded queue without ever waiting, dropping them when it is full.
+    """
+
+    def __init__( self, event_queue ):
+
+        super().__init__( event_queue )
+
+        # Initialize variables.
+        self.dropped = 0
+
+    def prepare( self, record ):
+
+        """
+        Keep the fields for the formatter. Only a traceback must be rendered now.
+        """
+
+        if record.exc_info:
+
+            record.exc_text = logging.Formatter().formatException( record.exc_info )
+            record.exc_info = None
+
+        return record
+
+    def enqueue( self, record ):
+
+        """
+        Queue the event, or count it as dropped.
+        """
+
+        try:
+
+            self.queue.put_nowait( record )
+
+        except queue.Full:
+
+            self.dropped += 1
+
+# Define the stream handler class.
+class JsonLineHandler( logging.StreamHandler ):
+
+    """
+    Write events as JSON lines, first reporting any events the queue dropped.
+    """
+
+    def __init__( self, dropping_handler, stream = None ):
+
+        super().__init__( stream )
+
+        # Initialize variables.
+        self.queue_handler = dropping_handler
+        self.reported_drops = 0
+        self.setFormatter( JsonFormatter() )
+
+    def emit( self, record ):
+
+        dropped = self.queue_handler.dropped
+
+        if dropped > self.reported_drops:
+
+            drop_record = logging.LogRecord( logger.name, logging.WARNING, '', 0,
+                                            'log-events-dropped', None, None )
+            drop_record.fields = { 'count': dropped - self.reported_drops }
+            self.reported_drops = dropped
+            super().emit( drop_record )
+
+        super().emit( record )
+
+# Create the queue, the handler that fills it and the thread that empties it.
+log_queue = queue.Queue( LOG_QUEUE_SIZE )
+queue_handler = DroppingQueueHandler( log_queue )
+listener = logging.handlers.QueueListener( log_queue, JsonLineHandler( queue_handler, sys.stdout ) )
+logger.addHandler( queue_handler )
+
+def start():
+
+    """
+    Start the thread that writes queued events.
+    """
+
+    if listener._thread is None: # pylint: disable=protected-access
+        listener.start()
+
+def stop():
+
+    """
+    Write the events still queued and stop the thread.
+    """
+
+    if listener._thread is not None: # pylint: disable=protected-access
+        listener.stop()
+
+def restart_after_fork():
+
+    """
+    Give a forked process, e.g. a preloaded gunicorn worker, its own queue and writer thread.
+    """
+
+    # The parent's thread does not exist in the child, and may have held the queue's lock.
+    child_queue = queue.Queue( LOG_QUEUE_SIZE )
+    queue_handler.queue = child_queue
+    listener.queue = child_queue
+    listener._thread = None # pylint: disable=protected-access
+
+    start()
+
+start()
+atexit.register( stop )
+os.register_at_fork( after_in_child = restart_after_fork )
+
+def event( name, level = logging.INFO, /, **fields ):
+
+    """
+    Log an event with fields, unless its level is disabled or its route is sampled out.
+    """
+
+    if not logger.isEnabledFor( level ):
+        return
+
+    # Sample the info and debug events of busy routes.
+    if level < logging.WARNING and sample_rates and has_request_context():
+
+        rate = sample_rates.get( request.endpoint )
+
+        if rate is not None and rate < 1.0:
+
+            if random.random() >= rate:
+                return
+
+            fields[ 'sample_rate' ] = rate
+
+    # Build the record directly, which skips looking up the caller's frame.
+    record = logger.makeRecord( logger.name, level, '', 0, name, None, None )
+    record.fields = fields
+    logger.handle( record )
+
+def debug( name, /, **fields ):
+
+    """
+    Log a debug event.
+    """
+
+    event( name, logging.DEBUG, **fields )
+
+def info( name, /, **fields ):
+
+    """
+    Log an info event.
+    """
+
+    event( name, logging.INFO, **fields )
+
+def warning( name, /, **fields ):
+
+    """
+    Log a warning event.
+    """
+
+    event( name, logging.WARNING, **fields )
+
+def error( name, err = None, /, **fields ):
+
+    """
+    Log an error event, with the exception that caused it, if any.
+    """
+
+    if err is not None:
+
+        fields[ 'error' ] = str( err )
+        fields[ 'error_type' ] = type( err ).__name__
+
+    event( name, logging.ERROR, **fields )
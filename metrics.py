@@ -0,0 +1,366 @@
+"""
+Prometheus metrics for my Flask app for Wix.
+
+Set METRICS_TOKEN to serve /metrics to scrapers that send it as a bearer token:
+
+    Authorization: Bearer <METRICS_TOKEN>
+
+Under gunicorn, also set PROMETHEUS_MULTIPROC_DIR to an empty directory that
+every worker can write to. Each worker then records its metrics in files
+there, and /metrics adds up every worker's, whichever one serves the scrape.
+gunicorn_config.py clears the directory at startup and retires the files of
+workers that exit.
+"""
+
+# Python imports
+import os
+import hmac
+import time
+import threading
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.pool import Pool, QueuePool
+
+# Local imports
+import signals
+
+# Record metrics only when prometheus_client is installed.
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+METRICS_TOKEN = os.getenv( "METRICS_TOKEN" )
+PROMETHEUS_MULTIPROC_DIR = os.getenv( "PROMETHEUS_MULTIPROC_DIR" )
+
+# Latency buckets in seconds, from cached widgets to slow Wix calls.
+LATENCY_BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 )
+POOL_WAIT_BUCKETS = ( 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0 )
+
+if prometheus_client is not None:
+
+    REQUEST_DURATION = prometheus_client.Histogram(
+        'http_request_duration_seconds', 'Time to serve a request, by route.',
+        [ 'method', 'route' ], buckets = LATENCY_BUCKETS )
+    REQUESTS = prometheus_client.Counter(
+        'http_requests', 'Requests served, by route and status code.',
+        [ 'method', 'route', 'status' ] )
+    WIX_REQUEST_DURATION = prometheus_client.Histogram(
+        'wix_request_duration_seconds', 'Time of a Wix API call, including retries.',
+        [ 'method', 'path' ], buckets = LATENCY_BUCKETS )
+    WIX_REQUESTS = prometheus_client.Counter(
+        'wix_requests', 'Wix API calls, by outcome: a status class or "error".',
+        [ 'method', 'path', 'outcome' ] )
+    DB_POOL_CHECKOUTS = prometheus_client.Counter(
+        'db_pool_checkouts', 'Database connections checked out of the pool.' )
+    DB_POOL_CHECKED_OUT = prometheus_client.Gauge(
+        'db_pool_checked_out', 'Database connections checked out now.',
+        multiprocess_mode = 'livesum' )
+    DB_POOL_WAIT = prometheus_client.Histogram(
+        'db_pool_wait_seconds', 'Time to get a connection from the pool, including connecting.',
+        buckets = POOL_WAIT_BUCKETS )
+    WEBHOOKS_RECEIVED = prometheus_client.Counter(
+        'webhooks_received', 'Webhooks received, by type and outcome.',
+        [ 'event_type', 'outcome' ] )
+    WEBHOOKS_PROCESSED = prometheus_client.Counter(
+        'webhooks_processed', 'Queued webhooks processed, by type and outcome.',
+        [ 'event_type', 'outcome' ] )
+    CACHE_LOOKUPS = prometheus_client.Counter(
+        'cache_lookups', 'In-process cache lookups, by cache and result.',
+        [ 'cache', 'result' ] )
+    CACHE_ENTRIES = prometheus_client.Gauge(
+        'cache_entries', 'Entries held by in-process caches.',
+        [ 'cache' ], multiprocess_mode = 'livesum' )
+    WIX_POOL_CONNECTIONS = prometheus_client.Counter(
+        'wix_pool_connections', 'Connections opened to Wix, by host.', [ 'host' ] )
+    WIX_POOL_REQUESTS = prometheus_client.Counter(
+        'wix_pool_requests', 'Requests sent to Wix over pooled connections, by host.',
+        [ 'host' ] )
+    WIX_POOL_IDLE = prometheus_client.Gauge(
+        'wix_pool_idle_connections', 'Open connections to Wix waiting in the pool, by host.',
+        [ 'host' ], multiprocess_mode = 'livesum' )
+
+else:
+
+    REQUEST_DURATION = REQUESTS = None
+    WIX_REQUEST_DURATION = WIX_REQUESTS = None
+    DB_POOL_CHECKOUTS = DB_POOL_CHECKED_OUT = DB_POOL_WAIT = None
+    WEBHOOKS_RECEIVED = WEBHOOKS_PROCESSED = None
+    CACHE_LOOKUPS = CACHE_ENTRIES = None
+    WIX_POOL_CONNECTIONS = WIX_POOL_REQUESTS = WIX_POOL_IDLE = None
+
+def is_enabled():
+
+    """
+    Return True if metrics are recorded and may be served.
+    """
+
+    return prometheus_client is not None and bool( METRICS_TOKEN )
+
+def is_authorized( authorization ):
+
+    """
+    Return True if an Authorization header carries the metrics token.
+    """
+
+    if not is_enabled() or not authorization:
+        return False
+
+    return hmac.compare_digest( authorization.encode( 'utf-8' ),
+                               ( 'Bearer ' + METRICS_TOKEN ).encode( 'utf-8' ) )
+
+def render():
+
+    """
+    Return the metrics of every worker in the Prometheus text format, and its content type.
+    """
+
+    if PROMETHEUS_MULTIPROC_DIR:
+
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector( registry )
+
+    else:
+
+        registry = prometheus_client.REGISTRY
+
+    return prometheus_client.generate_latest( registry ), prometheus_client.CONTENT_TYPE_LATEST
+
+def observe_request( method, route, status, duration ):
+
+    """
+    Record a served request. Unmatched URLs share one route, so bots cannot add labels.
+    """
+
+    if prometheus_client is None:
+        return
+
+    route = route or 'unmatched'
+
+    REQUEST_DURATION.labels( method, route ).observe( duration )
+    REQUESTS.labels( method, route, str( status ) ).inc()
+
+def record_wix_request( method, url = '', status = None, duration = 0.0, **_extra ):
+
+    """
+    Record a finished Wix API call.
+    """
+
+    if prometheus_client is None:
+        return
+
+    # Label by path only; the query string may hold IDs.
+    path = urlsplit( url ).path or '/'
+    outcome = 'error' if status is None else str( status // 100 ) + 'xx'
+
+    WIX_REQUEST_DURATION.labels( method, path ).observe( duration )
+    WIX_REQUESTS.labels( method, path, outcome ).inc()
+
+def record_webhook_received( event_type, outcome = '', **_extra ):
+
+    """
+    Record a webhook delivery: 'queued', 'redelivered' or 'invalid'.
+    """
+
+    if prometheus_client is not None:
+        WEBHOOKS_RECEIVED.labels( event_type, outcome ).inc()
+
+def record_webhook_processed( event_type, outcome = '', **_extra ):
+
+    """
+    Record a processed webhook: 'applied', 'unchanged', 'retry' or 'dead'.
+    """
+
+    if prometheus_client is not None:
+        WEBHOOKS_PROCESSED.labels( event_type, outcome ).inc()
+
+def record_checkout( dbapi_connection, connection_record, connection_proxy ):
+
+    # pylint: disable=unused-argument
+    # SQLAlchemy passes these arguments to every listener.
+
+    """
+    Record a connection checked out of a pool.
+    """
+
+    if prometheus_client is None:
+        return
+
+    DB_POOL_CHECKOUTS.inc()
+    DB_POOL_CHECKED_OUT.inc()
+
+def record_checkin( dbapi_connection, connection_record ):
+
+    # pylint: disable=unused-argument
+
+    """
+    Record a connection returned to a pool.
+    """
+
+    if prometheus_client is not None:
+        DB_POOL_CHECKED_OUT.dec()
+
+# Define the timed pool class.
+class TimedQueuePool( QueuePool ):
+
+    """
+    A QueuePool that records how long each checkout waited for a connection.
+
+    Waits grow when more requests need connections than pool_size plus
+    max_overflow allow, e.g. with many gevent green threads per worker.
+    """
+
+    def connect( self ):
+
+        """
+        Check out a connection, timing the wait.
+        """
+
+        started = time.perf_counter()
+        connection = super().connect()
+
+        if prometheus_client is not None:
+            DB_POOL_WAIT.observe( time.perf_counter() - started )
+
+        return connection
+
+# Define the cache metrics class.
+class CacheMetrics:
+
+    """
+    Copy the hit and miss counts of in-process caches into Prometheus counters.
+
+    The caches count lookups in plain integers, so that lookups stay cheap.
+    sync() adds what each cache counted since the last sync, and is called after
+    each request.
+    """
+
+    def __init__( self ):
+
+        # Initialize variables.
+        self.caches = {}
+        self._synced = {}
+        self._lock = threading.Lock()
+
+    def track( self, name, ttl_cache ):
+
+        """
+        Report a cache's lookups and size under a name.
+        """
+
+        self.caches[ name ] = ttl_cache
+        self._synced[ name ] = ( ttl_cache.hits, ttl_cache.misses )
+
+    def sync( self ):
+
+        """
+        Add each cache's new hits and misses to the counters, and update its size.
+        """
+
+        if prometheus_client is None:
+            return
+
+        # Skip the sync if another thread is already doing it. A with block would wait.
+        if not self._lock.acquire( blocking = False ): # pylint: disable=consider-using-with
+            return
+
+        try:
+
+            for name, ttl_cache in self.caches.items():
+
+                hits, misses = ttl_cache.hits, ttl_cache.misses
+                synced_hits, synced_misses = self._synced[ name ]
+
+                if hits > synced_hits:
+                    CACHE_LOOKUPS.labels( name, 'hit' ).inc( hits - synced_hits )
+
+                if misses > synced_misses:
+                    CACHE_LOOKUPS.labels( name, 'miss' ).inc( misses - synced_misses )
+
+                self._synced[ name ] = ( hits, misses )
+                CACHE_ENTRIES.labels( name ).set( len( ttl_cache ) )
+
+        finally:
+
+            self._lock.release()
+
+# Define the Wix pool metrics class.
+class WixPoolMetrics:
+
+    # pylint: disable=too-few-public-methods
+    # The client decides what is tracked, so sync() is all there is to call.
+
+    """
+    Copy the connection pool statistics of a Wix client into Prometheus metrics.
+
+    The pools count the connections they open and the requests they send, so
+    comparing the two shows how well connections are reused. Like
+    CacheMetrics, sync() adds what each pool counted since the last sync, and
+    is called after each request.
+    """
+
+    def __init__( self, wix_client ):
+
+        # Initialize variables.
+        self.wix_client = wix_client
+        self._synced = {}
+        self._lock = threading.Lock()
+
+    def sync( self ):
+
+        """
+        Add each pool's new connections and requests to the counters, and update its idle count.
+        """
+
+        if prometheus_client is None:
+            return
+
+        # Skip the sync if another thread is already doing it.
+        if not self._lock.acquire( blocking = False ): # pylint: disable=consider-using-with
+            return
+
+        try:
+
+            for pool in self.wix_client.stats():
+
+                host = pool[ 'host' ]
+                opened, sent = pool[ 'connections_opened' ], pool[ 'requests_sent' ]
+                synced_opened, synced_sent = self._synced.get( host, ( 0, 0 ) )
+
+                # A pool the client dropped and opened again counts from zero.
+                if opened < synced_opened or sent < synced_sent:
+                    synced_opened, synced_sent = 0, 0
+
+                if opened > synced_opened:
+                    WIX_POOL_CONNECTIONS.labels( host ).inc( opened - synced_opened )
+
+                if sent > synced_sent:
+                    WIX_POOL_REQUESTS.labels( host ).inc( sent - synced_sent )
+
+                self._synced[ host ] = ( opened, sent )
+                WIX_POOL_IDLE.labels( host ).set( pool[ 'idle_connections' ] )
+
+        finally:
+
+            self._lock.release()
+
+def instrument():
+
+    """
+    Record Wix API calls, webhooks and database pool checkouts. Call once at startup.
+    """
+
+    if prometheus_client is None:
+        return
+
+    signals.wix_request_finished.connect( record_wix_request )
+    signals.webhook_received.connect( record_webhook_received )
+    signals.webhook_processed.connect( record_webhook_processed )
+    event.listen( Pool, 'checkout', record_checkout )
+    event.listen( Pool, 'checkin', record_checkin )
@@ -28,6 +28,7 @@ class Instance( db.Model ):
     is_free: db.Column              = db.Column( db.Boolean, default = True )
     did_cancel: db.Column           = db.Column( db.Boolean, default = False )
     expires_on: db.Column           = db.Column( db.DateTime )
+    billing_checked_at: db.Column   = db.Column( db.DateTime )
     extension_count: db.Column      = db.Column( db.Integer, default = 0 )
     extension_limit: db.Column      = db.Column( db.Integer, default = 999 )
     created_at: db.Column           = db.Column( db.DateTime( timezone = True ),
@@ -66,8 +67,50 @@ class Extension( db.Model ):
     handle_animation: db.Column             = db.Column( db.Integer, default = 0 )
     handle_border_color: db.Column          = db.Column( db.String( 20 ), default = '#BBBBBB' )
     is_move_on_click_enabled: db.Column     = db.Column( db.Boolean, default = False )
+    version: db.Column                      = db.Column( db.Integer, default = 1,
+                                                server_default = '1', nullable = False )
+    save_sequence: db.Column                = db.Column( db.BigInteger )
     created_at: db.Column                   = db.Column( db.DateTime( timezone = True ),
                                                 server_default = func.now() )
 
+    __table_args__ = (
+        db.Index( 'ix_extension_instance_created', 'instance_id', 'created_at', 'extension_id' ),
+    )
+
     def __repr__( self ):
         return f'<slider { self.extension_id } in { self.instance_id }>'
+
+# Define the webhook queue table class.
+class QueuedWebhook( db.Model ):
+
+    # pylint: disable=too-many-instance-attributes
+    # pylint: disable=too-few-public-methods
+    # Ten is reasonable in this case, and the workers query it directly.
+
+    """
+    Class to define the webhook queue table.
+
+    Webhook handlers append verified events here and return immediately.
+    Workers process each instance's events in order, retrying failures until
+    they are marked dead. A worker marks the event it claims processing and
+    leases it until available_at.
+    """
+    id: db.Column                   = db.Column( db.Integer, primary_key = True )
+    event_type: db.Column           = db.Column( db.String( 50 ), nullable = False )
+    instance_id: db.Column          = db.Column( db.String( 255 ), nullable = False )
+    payload: db.Column              = db.Column( db.Text, nullable = False )
+    status: db.Column               = db.Column( db.String( 20 ), default = 'pending',
+                                                nullable = False )
+    attempts: db.Column             = db.Column( db.Integer, default = 0, nullable = False )
+    last_error: db.Column           = db.Column( db.String( 2000 ) )
+    available_at: db.Column         = db.Column( db.DateTime, server_default = func.now() )
+    processed_at: db.Column         = db.Column( db.DateTime )
+    created_at: db.Column           = db.Column( db.DateTime( timezone = True ),
+                                                server_default = func.now() )
+
+    __table_args__ = (
+        db.Index( 'ix_queued_webhook_status_instance', 'status', 'instance_id', 'id' ),
+    )
+
+    def __repr__( self ):
+        return f'<webhook { self.id } { self.event_type } for { self.instance_id }>'
@@ -0,0 +1,428 @@
+"""
+Set-based database queries for my Flask app for Wix.
+"""
+
+# Python imports
+import os
+import base64
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import NamedTuple, Optional
+import click
+from dotenv import load_dotenv
+from flask.cli import with_appcontext
+from sqlalchemy import DateTime, case, delete, func, literal, select, tuple_, update
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import aliased
+
+# Local imports
+from database import db
+import signals
+
+# Import models.
+from models import Instance, Extension
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+PURGE_CHUNK_SIZE = int( os.getenv( "PURGE_CHUNK_SIZE", "1000" ) )
+DASHBOARD_PAGE_SIZE = int( os.getenv( "DASHBOARD_PAGE_SIZE", "20" ) )
+
+# SQLite compares timestamps as text, and stores server-default ones to the second,
+# so cursor timestamps are bound in the same format there.
+CURSOR_TIMESTAMP = DateTime( timezone = True ).with_variant(
+    sqlite.DATETIME( storage_format = '%(year)04d-%(month)02d-%(day)02d '
+                                      '%(hour)02d:%(minute)02d:%(second)02d' ),
+    'sqlite'
+)
+
+# Define the widget view class.
+class WidgetView( NamedTuple ):
+
+    # pylint: disable=too-many-instance-attributes
+
+    """
+    A read-only snapshot of an extension and its owner's entitlement, for rendering.
+    """
+    extension_id: str
+    instance_id: str
+    before_image: str
+    before_image_thumbnail: str
+    before_label_text: str
+    before_alt_text: str
+    after_image: str
+    after_image_thumbnail: str
+    after_label_text: str
+    after_alt_text: str
+    offset: int
+    offset_float: float
+    is_vertical: bool
+    is_dark: bool
+    mouseover_action: int
+    handle_animation: int
+    handle_border_color: str
+    is_move_on_click_enabled: bool
+    version: int
+    created_at: datetime
+    is_free: bool
+    did_cancel: bool
+    expires_on: Optional[ datetime ]
+    instance_created_at: datetime
+
+# Define the patch result class.
+class PatchResult( NamedTuple ):
+
+    """
+    The outcome of a partial update: 'missing', 'unchanged', 'conflict' or 'updated'.
+    """
+    status: str
+    version: Optional[ int ]
+
+# Define the extension page class.
+class ExtensionPage( NamedTuple ):
+
+    """
+    One page of an instance's extensions, with cursors for the neighbouring pages.
+    """
+    items: list
+    next_cursor: Optional[ str ]
+    previous_cursor: Optional[ str ]
+
+def purge_extensions( instance_id, chunk_size = PURGE_CHUNK_SIZE ):
+
+    """
+    Delete every extension of an instance without loading them, and return the IDs removed.
+
+    Each chunk is one DELETE, and it commits together with the matching decrement of
+    the instance's extension count, so the count never disagrees with the rows left.
+    The last chunk resets the count to zero. Safe to repeat after an interruption.
+    """
+
+    # Initialize variables.
+    removed = []
+
+    while True:
+
+        # Select the next chunk of extension IDs inside the DELETE itself.
+        chunk = (
+            select( Extension.extension_id )
+            .where( Extension.instance_id == instance_id )
+            .limit( chunk_size )
+            .scalar_subquery()
+        )
+
+        deleted_ids = db.session.scalars(
+            delete( Extension )
+            .where( Extension.extension_id.in_( chunk ) )
+            .returning( Extension.extension_id )
+            .execution_options( synchronize_session = False )
+        ).all()
+
+        deleted = len( deleted_ids )
+        removed += deleted_ids
+
+        # Decrement the count by the rows deleted, or reset it once none are left.
+        if deleted < chunk_size:
+
+            extension_count = 0
+
+        else:
+
+            extension_count = case(
+                ( Instance.extension_count > deleted, Instance.extension_count - deleted ),
+                else_ = 0
+            )
+
+        db.session.execute(
+            update( Instance )
+            .where( Instance.instance_id == instance_id )
+            .values( extension_count = extension_count )
+            .execution_options( synchronize_session = False )
+        )
+
+        # End the chunk's transaction.
+        db.session.commit()
+
+        if deleted < chunk_size:
+            break
+
+    return removed
+
+def load_widget_view( extension_id ):
+
+    """
+    Return the WidgetView of an extension, or None, with one joined query.
+
+    Only the columns the widget and settings pages render are read, and no
+    ORM objects are built. Extensions without an owning instance are treated
+    as missing.
+    """
+
+    if extension_id is None:
+        return None
+
+    row = db.session.execute(
+        select(
+            Extension.extension_id,
+            Extension.instance_id,
+            Extension.before_image,
+            Extension.before_image_thumbnail,
+            Extension.before_label_text,
+            Extension.before_alt_text,
+            Extension.after_image,
+            Extension.after_image_thumbnail,
+            Extension.after_label_text,
+            Extension.after_alt_text,
+            Extension.offset,
+            Extension.offset_float,
+            Extension.is_vertical,
+            Extension.is_dark,
+            Extension.mouseover_action,
+            Extension.handle_animation,
+            Extension.handle_border_color,
+            Extension.is_move_on_click_enabled,
+            Extension.version,
+            Extension.created_at,
+            Instance.is_free,
+            Instance.did_cancel,
+            Instance.expires_on,
+            Instance.created_at
+        )
+        .join( Instance, Instance.instance_id == Extension.instance_id )
+        .where( Extension.extension_id == extension_id )
+    ).first()
+
+    if row is None:
+        return None
+
+    return WidgetView( *row )
+
+def patch_extension( extension_id, expected_version, values ):
+
+    """
+    Apply changed column values to an extension if it is still at the expected version.
+
+    Only the given columns are read and written. Values that already match the
+    row are not written at all, whatever the version, and a write bumps the
+    version so that a stale editor gets a conflict instead of overwriting
+    newer changes.
+    """
+
+    # Read the current values of just the submitted columns.
+    row = db.session.execute(
+        select( Extension.version, *[ getattr( Extension, column ) for column in values ] )
+        .where( Extension.extension_id == extension_id )
+    ).first()
+
+    if row is None:
+
+        db.session.rollback()
+        return PatchResult( 'missing', None )
+
+    current_version = row[ 0 ]
+    changes = {
+        column: value
+        for column, value, stored in zip( values, values.values(), row[ 1: ] )
+        if value != stored
+    }
+
+    # Skip no-op writes.
+    if not changes:
+
+        db.session.rollback()
+        return PatchResult( 'unchanged', current_version )
+
+    if expected_version != current_version:
+
+        db.session.rollback()
+        return PatchResult( 'conflict', current_version )
+
+    # Write only if nobody else wrote since we read, and order it after older buffered saves.
+    updated = db.session.execute(
+        update( Extension )
+        .where( Extension.extension_id == extension_id )
+        .where( Extension.version == expected_version )
+        .values( version = Extension.version + 1, save_sequence = time.time_ns(), **changes )
+        .execution_options( synchronize_session = False )
+    ).rowcount
+
+    if updated == 0:
+
+        db.session.rollback()
+        return PatchResult( 'conflict', db.session.scalar(
+            select( Extension.version ).where( Extension.extension_id == extension_id ) ) )
+
+    db.session.commit()
+
+    # Drop anything derived from the extension.
+    signals.extension_changed.send( extension_id )
+
+    return PatchResult( 'updated', expected_version + 1 )
+
+def encode_cursor( extension ):
+
+    """
+    Return an opaque URL-safe token marking an extension's position in the listing.
+    """
+
+    position = [ extension.created_at.isoformat(), extension.extension_id ]
+
+    return base64.urlsafe_b64encode( json.dumps( position ).encode() ).decode().rstrip( '=' )
+
+def decode_cursor( cursor ):
+
+    """
+    Return the (created_at, extension_id) position in a cursor token, ready to
+    compare with the ix_extension_instance_created columns.
+
+    The position uses the stored created_at of the cursor's extension, so it
+    compares equal to itself on any database, and the cursor's own timestamp
+    only if that extension was deleted since. Raises ValueError if the token is
+    malformed.
+    """
+
+    try:
+
+        padded = cursor + ( '=' * ( -len( cursor ) % 4 ) )
+        created_at, extension_id = json.loads( base64.urlsafe_b64decode( padded ) )
+        created_at = literal( datetime.fromisoformat( created_at ), CURSOR_TIMESTAMP )
+        extension_id = str( extension_id )
+
+    except ( TypeError, ValueError ) as err :
+
+        raise ValueError( 'Invalid cursor: ' + str( cursor ) ) from err
+
+    # Look the extension up apart from the rows being paged.
+    cursor_extension = aliased( Extension )
+    stored = (
+        select( cursor_extension.created_at )
+        .where( cursor_extension.extension_id == extension_id )
+        .scalar_subquery()
+    )
+
+    return tuple_( func.coalesce( stored, created_at ), literal( extension_id ) )
+
+def list_extensions( instance_id, after = None, before = None, per_page = DASHBOARD_PAGE_SIZE ):
+
+    """
+    Return a page of an instance's extensions, oldest first, using keyset pagination.
+
+    Pass the next_cursor of a page as after, or its previous_cursor as before, to
+    fetch the neighbouring page. Each page is a range scan of the
+    ix_extension_instance_created index, so its cost does not grow with the
+    table or with the instance's number of extensions. Nothing is counted.
+    """
+
+    # Initialize variables.
+    position = tuple_( Extension.created_at, Extension.extension_id )
+    query = select( Extension ).where( Extension.instance_id == instance_id )
+
+    # Walk backwards from the start of the following page.
+    if before is not None:
+
+        query = ( query.where( position < decode_cursor( before ) )
+                 .order_by( Extension.created_at.desc(), Extension.extension_id.desc() ) )
+
+    else:
+
+        if after is not None:
+            query = query.where( position > decode_cursor( after ) )
+
+        query = query.order_by( Extension.created_at, Extension.extension_id )
+
+    # Read one extra row to learn whether there is another page in this direction.
+    items = list( db.session.scalars( query.limit( per_page + 1 ) ) )
+    has_more = len( items ) > per_page
+    items = items[ :per_page ]
+
+    if before is not None:
+        items.reverse()
+
+    # Link to the neighbouring pages.
+    next_cursor = None
+    previous_cursor = None
+
+    if items:
+
+        if has_more or before is not None:
+            next_cursor = encode_cursor( items[ -1 ] )
+
+        if ( has_more and before is not None ) or after is not None:
+            previous_cursor = encode_cursor( items[ 0 ] )
+
+    return ExtensionPage( items, next_cursor, previous_cursor )
+
+def check_paging( extensions = 7, per_page = 3 ):
+
+    """
+    Page through throwaway extensions forwards and backwards, and return the IDs
+    of each pass, which list every extension once if paging works.
+
+    The extensions are added in one transaction, so they share a created_at and
+    only their IDs order them. Nothing is committed.
+    """
+
+    # Initialize variables.
+    instance_id = 'check-paging-' + uuid.uuid4().hex
+    forwards = []
+    backwards = []
+
+    try:
+
+        db.session.add( Instance( instance_id = instance_id ) )
+        db.session.add_all( [
+            Extension( extension_id = instance_id + '-' + str( number ).zfill( 4 ),
+                      instance_id = instance_id )
+            for number in range( extensions )
+        ] )
+        db.session.flush()
+
+        # Follow the Next links to the last page.
+        page = list_extensions( instance_id, per_page = per_page )
+        forwards += [ extension.extension_id for extension in page.items ]
+
+        while page.next_cursor is not None:
+
+            page = list_extensions( instance_id, after = page.next_cursor, per_page = per_page )
+            forwards += [ extension.extension_id for extension in page.items ]
+
+        # Follow the Previous links back to the first page.
+        backwards = [ extension.extension_id for extension in page.items ]
+
+        while page.previous_cursor is not None:
+
+            page = list_extensions( instance_id, before = page.previous_cursor,
+                                   per_page = per_page )
+            backwards = [ extension.extension_id for extension in page.items ] + backwards
+
+    finally:
+
+        db.session.rollback()
+
+    return forwards, backwards
+
+@click.command( 'check-paging' )
+@click.option( '--extensions', default = 7, show_default = True,
+              help = 'Throwaway extensions to page through.' )
+@click.option( '--per-page', default = 3, show_default = True, help = 'Extensions per page.' )
+@with_appcontext
+def check_paging_command( extensions, per_page ):
+
+    """
+    Check dashboard paging against the configured database, e.g. SQLite or Postgres.
+    """
+
+    forwards, backwards = check_paging( extensions, per_page )
+
+    for direction, extension_ids in ( ( 'Forwards', forwards ), ( 'Backwards', backwards ) ):
+
+        if len( extension_ids ) != extensions or extension_ids != sorted( set( extension_ids ) ):
+
+            raise click.ClickException( direction + ' paging listed ' +
+                                       str( len( extension_ids ) ) + ' of ' +
+                                       str( extensions ) + ' extensions, or out of order.' )
+
+    click.echo( 'Done. Paged through ' + str( extensions ) + ' extensions both ways.' )
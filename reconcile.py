@@ -0,0 +1,276 @@
+"""
+Bulk billing reconciliation for my Flask app for Wix.
+
+Run it from cron or by hand with:
+
+    flask --app app reconcile-billing --horizon-days 1 --concurrency 8 --rate 10
+"""
+# pylint: disable=broad-exception-caught
+
+# Python imports
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import or_, select, update
+
+# Local imports
+from database import db
+import billing
+import logs
+import signals
+
+# Import models.
+from models import Instance
+
+# Define constants.
+DEFAULT_CHECKPOINT_PATH = 'reconcile-billing.checkpoint.json'
+
+# Define the rate limiter class.
+class RateLimiter:
+
+    # pylint: disable=too-few-public-methods
+
+    """
+    Space calls evenly so that all threads together stay under a rate per second.
+    """
+
+    def __init__( self, rate ):
+
+        # Initialize variables.
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait( self ):
+
+        """
+        Block until the caller may make its next call.
+        """
+
+        with self._lock:
+
+            now = time.monotonic()
+            slot = max( now, self._next_slot )
+            self._next_slot = slot + self.interval
+
+        if slot > now:
+            time.sleep( slot - now )
+
+def load_checkpoint( path ):
+
+    """
+    Return the saved progress of an interrupted run, or None.
+    """
+
+    if not os.path.exists( path ):
+        return None
+
+    with open( path, encoding = 'utf-8' ) as checkpoint_file:
+        return json.load( checkpoint_file )
+
+def save_checkpoint( path, checkpoint ):
+
+    """
+    Atomically save the progress of the current run.
+    """
+
+    temporary_path = path + '.tmp'
+
+    with open( temporary_path, 'w', encoding = 'utf-8' ) as checkpoint_file:
+        json.dump( checkpoint, checkpoint_file )
+
+    os.replace( temporary_path, path )
+
+def fetch_billing( row, limiter ):
+
+    """
+    Ask Wix for the billing state of one instance row, or return None on failure.
+    """
+
+    # Stay under the global rate limit.
+    limiter.wait()
+
+    try:
+
+        app_instance = billing.get_app_instance( row.instance_id, row.refresh_token )
+
+        # get_app_instance returns the error instead of raising it.
+        if not isinstance( app_instance, dict ) or 'instance' not in app_instance:
+
+            logs.warning( 'reconcile-failed', instance_id = row.instance_id, error = app_instance )
+            return None
+
+        return app_instance
+
+    except Exception as err :
+
+        logs.error( 'reconcile-failed', err, instance_id = row.instance_id )
+        return None
+
+def select_batch( cutoff, checked_before, last_instance_id, batch_size ):
+
+    """
+    Return the next batch of instances due for reconciliation, in instance ID order.
+    """
+
+    query = (
+        select( Instance.instance_id, Instance.refresh_token, Instance.is_free,
+               Instance.expires_on )
+        .where( Instance.expires_on.is_not( None ) )
+        .where( Instance.expires_on <= cutoff )
+        .where( or_( Instance.billing_checked_at.is_( None ),
+                    Instance.billing_checked_at < checked_before ) )
+        .order_by( Instance.instance_id )
+        .limit( batch_size )
+    )
+
+    # Continue after the last instance of the previous batch.
+    if last_instance_id is not None:
+        query = query.where( Instance.instance_id > last_instance_id )
+
+    return db.session.execute( query ).all()
+
+def reconcile_billing( horizon, batch_size, concurrency, rate, checkpoint_path, *,
+                       restart = False ):
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-locals
+
+    """
+    Refresh every instance whose paid plan has expired or expires within the horizon.
+
+    Returns the number of instances checked and the number that changed.
+    """
+
+    # Initialize variables.
+    now = datetime.utcnow()
+    checkpoint = None if restart else load_checkpoint( checkpoint_path )
+    limiter = RateLimiter( rate )
+
+    # Start a new run unless an interrupted one can be resumed.
+    if checkpoint is None:
+
+        checkpoint = {
+            'cutoff': ( now + horizon ).isoformat(),
+            'checked_before': ( now - billing.BILLING_RECHECK_INTERVAL ).isoformat(),
+            'last_instance_id': None,
+            'checked': 0,
+            'changed': 0
+        }
+
+    else:
+
+        click.echo( 'Resuming after Instance #' + str( checkpoint[ 'last_instance_id' ] ) )
+
+    cutoff = datetime.fromisoformat( checkpoint[ 'cutoff' ] )
+    checked_before = datetime.fromisoformat( checkpoint[ 'checked_before' ] )
+
+    with ThreadPoolExecutor( max_workers = concurrency,
+                            thread_name_prefix = 'reconcile-billing' ) as executor:
+
+        while True:
+
+            rows = select_batch( cutoff, checked_before, checkpoint[ 'last_instance_id' ],
+                                batch_size )
+
+            # Release the read transaction while Wix is being called.
+            db.session.rollback()
+
+            if not rows:
+                break
+
+            # Ask Wix about the whole batch concurrently.
+            responses = executor.map( lambda row: fetch_billing( row, limiter ), rows )
+
+            # Collect the new state of every instance Wix answered for.
+            updates = []
+            changed_instance_ids = []
+            checked_at = datetime.utcnow()
+
+            for row, app_instance in zip( rows, responses ):
+
+                if app_instance is None:
+                    continue
+
+                is_free = app_instance[ 'instance' ][ 'isFree' ]
+                expires_on = row.expires_on
+                expiration_date = app_instance.get( 'billing', {} ).get( 'expirationDate' )
+
+                if expiration_date is not None:
+                    expires_on = datetime.strptime( expiration_date, '%Y-%m-%dT%H:%M:%SZ' )
+
+                updates.append( {
+                    'instance_id': row.instance_id,
+                    'is_free': is_free,
+                    'expires_on': expires_on,
+                    'billing_checked_at': checked_at
+                } )
+
+                if is_free != row.is_free or expires_on != row.expires_on:
+                    changed_instance_ids.append( row.instance_id )
+
+            # Write the whole batch with one executemany UPDATE by primary key.
+            if updates:
+
+                db.session.execute( update( Instance ), updates )
+                db.session.commit()
+
+            # Drop anything derived from the changed instances.
+            for instance_id in changed_instance_ids:
+                signals.instance_changed.send( instance_id )
+
+            # Record progress so an interrupted run can resume after this batch.
+            checkpoint[ 'last_instance_id' ] = rows[ -1 ].instance_id
+            checkpoint[ 'checked' ] += len( updates )
+            checkpoint[ 'changed' ] += len( changed_instance_ids )
+            save_checkpoint( checkpoint_path, checkpoint )
+
+            click.echo( 'Reconciled ' + str( len( rows ) ) + ' instances through #' +
+                       checkpoint[ 'last_instance_id' ] + ' (' + str( len( updates ) ) +
+                       ' answered, ' + str( len( changed_instance_ids ) ) + ' changed).' )
+
+    # The run finished, so the next one starts from the beginning.
+    if os.path.exists( checkpoint_path ):
+        os.remove( checkpoint_path )
+
+    return checkpoint[ 'checked' ], checkpoint[ 'changed' ]
+
+@click.command( 'reconcile-billing' )
+@click.option( '--horizon-days', default = 1.0, show_default = True,
+              help = 'Also refresh plans expiring within this many days.' )
+@click.option( '--batch-size', default = 500, show_default = True,
+              help = 'Instances read and updated per batch.' )
+@click.option( '--concurrency', default = 8, show_default = True,
+              help = 'Concurrent Wix API calls.' )
+@click.option( '--rate', default = 10.0, show_default = True,
+              help = 'Maximum instances checked per second across all threads.' )
+@click.option( '--checkpoint', 'checkpoint_path', default = DEFAULT_CHECKPOINT_PATH,
+              show_default = True, help = 'File that records progress for resuming.' )
+@click.option( '--restart', is_flag = True, help = 'Ignore any saved checkpoint.' )
+@with_appcontext
+def reconcile_billing_command( horizon_days, batch_size, concurrency, rate, checkpoint_path,
+                              restart ):
+
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    # Click passes each option as an argument.
+
+    """
+    Reconcile expired and expiring paid plans with Wix.
+    """
+
+    checked, changed = reconcile_billing(
+        timedelta( days = horizon_days ),
+        batch_size,
+        concurrency,
+        rate,
+        checkpoint_path,
+        restart = restart
+    )
+
+    click.echo( 'Done. ' + str( checked ) + ' instances checked, ' + str( changed ) + ' changed.' )
@@ -0,0 +1,137 @@
+"""
+Compress responses for my Flask app for Wix.
+"""
+
+# Python imports
+import os
+import gzip
+from dotenv import load_dotenv
+
+# Use brotli when it is installed.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+COMPRESSION_MIN_SIZE = int( os.getenv( "COMPRESSION_MIN_SIZE", "1024" ) )
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Compress text responses only. Images and fonts are compressed already.
+COMPRESSIBLE_MIMETYPES = (
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml'
+)
+
+def supported_encodings():
+
+    """
+    Return the encodings this process can produce, most preferred first.
+    """
+
+    if brotli is not None:
+        return ( 'br', 'gzip' )
+
+    return ( 'gzip', )
+
+def choose_encoding( accept_encodings ):
+
+    """
+    Return the best encoding the client accepts, or None.
+
+    accept_encodings is the request's parsed Accept-Encoding header.
+    """
+
+    # Initialize variables.
+    best_encoding = None
+    best_quality = 0
+
+    for encoding in supported_encodings():
+
+        quality = accept_encodings[ encoding ]
+
+        # Ties go to the encoding we prefer, which comes first.
+        if quality > best_quality:
+
+            best_encoding = encoding
+            best_quality = quality
+
+    return best_encoding
+
+def compress( data, encoding ):
+
+    """
+    Return data compressed with an encoding from supported_encodings().
+    """
+
+    if encoding == 'br':
+        return brotli.compress( data, quality = BROTLI_QUALITY )
+
+    # Leave the timestamp out so the same body always compresses to the same bytes.
+    return gzip.compress( data, compresslevel = GZIP_LEVEL, mtime = 0 )
+
+def encoded_etag( etag, encoding ):
+
+    """
+    Return the entity tag of an encoded variant, which must differ from the identity's.
+    """
+
+    if encoding is None:
+        return etag
+
+    return etag + '-' + encoding
+
+def is_compressible( response ):
+
+    """
+    Return True if the response is a buffered text body that compression may apply to.
+    """
+
+    return (
+        response.status_code == 200 and
+        not response.direct_passthrough and
+        not response.is_streamed and
+        'Content-Encoding' not in response.headers and
+        response.mimetype in COMPRESSIBLE_MIMETYPES
+    )
+
+def compress_response( response, accept_encodings, min_size = COMPRESSION_MIN_SIZE ):
+
+    """
+    Compress a response in place for the client, if it is worth it, and return it.
+
+    Responses that may be compressed vary by Accept-Encoding, whether or not
+    this client gets a compressed body.
+    """
+
+    if not is_compressible( response ):
+        return response
+
+    response.vary.add( 'Accept-Encoding' )
+
+    # Initialize variables.
+    encoding = choose_encoding( accept_encodings )
+    data = response.get_data()
+
+    if encoding is None or len( data ) < min_size:
+        return response
+
+    response.set_data( compress( data, encoding ) )
+    response.headers[ 'Content-Encoding' ] = encoding
+
+    # Keep validators distinct per encoding.
+    etag, is_weak = response.get_etag()
+
+    if etag is not None:
+        response.set_etag( encoded_etag( etag, encoding ), weak = is_weak )
+
+    return response
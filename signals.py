@@ -0,0 +1,30 @@
+"""
+Signals for my Flask app for Wix.
+
+Senders announce changes to stored data so that anything derived from it,
+e.g. cached widgets, can be refreshed without the sender knowing about it.
+"""
+
+# Python imports
+from blinker import Namespace
+
+# Create a namespace for the app's signals.
+app_signals = Namespace()
+
+# Sent with the extension ID as the sender whenever an Extension is saved or deleted.
+extension_changed = app_signals.signal( 'extension-changed' )
+
+# Sent with the instance ID as the sender whenever an Instance's entitlement changes.
+instance_changed = app_signals.signal( 'instance-changed' )
+
+# Sent with the HTTP method as the sender after each Wix API call, with the
+# URL, the response status (None if it failed) and the duration in seconds.
+wix_request_finished = app_signals.signal( 'wix-request-finished' )
+
+# Sent with the event type as the sender for each webhook delivery, with its
+# outcome: 'queued', 'redelivered' or 'invalid'.
+webhook_received = app_signals.signal( 'webhook-received' )
+
+# Sent with the event type as the sender after a worker processes a queued
+# webhook, with its outcome: 'applied', 'unchanged', 'retry' or 'dead'.
+webhook_processed = app_signals.signal( 'webhook-processed' )
@@ -0,0 +1,375 @@
+"""
+Publish pre-rendered widget snapshots for my Flask app for Wix.
+
+Each publishable extension is written to <WIDGET_SNAPSHOT_DIR>/<extension ID>.html,
+so a front-line server can answer widget views without calling Flask, e.g. with nginx:
+
+    location = /widget/ {
+        root /srv/baie/widget-snapshots;
+        try_files /$arg_origCompId.html /$arg_viewerCompId.html @flask;
+    }
+
+Snapshots are refreshed when an extension or its instance changes, and
+
+    flask --app app publish-widget-snapshots
+
+rebuilds all of them and removes the rest. Run it after deploys, and every
+SNAPSHOT_REBUILD_HOURS alongside reconcile-billing so that snapshots follow
+expiring plans. Paid widgets that expire before the next rebuild are left to
+Flask, so a snapshot never outlives its plan.
+"""
+# pylint: disable=broad-exception-caught
+
+# Python imports
+import os
+import re
+import fcntl
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from dotenv import load_dotenv
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+# Local imports
+from database import db
+import logic
+import logs
+import queries
+
+# Import models.
+from models import Extension
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+WIDGET_SNAPSHOT_DIR = os.getenv( "WIDGET_SNAPSHOT_DIR" )
+SNAPSHOT_BATCH_SIZE = 500
+SNAPSHOT_REBUILD_INTERVAL = timedelta(
+    hours = float( os.getenv( "SNAPSHOT_REBUILD_HOURS", "24" ) )
+)
+LOCK_NAME = '.publish.lock'
+
+# Only extension IDs that are safe as file names are published.
+EXTENSION_ID_PATTERN = re.compile( r'^[A-Za-z0-9_-]{1,200}$' )
+
+def is_publishable( view, trial_days, now ):
+
+    """
+    Return True if a snapshot of the widget cannot go stale before the next rebuild.
+
+    Widgets in a free trial change when the trial ends, and paid widgets change
+    when their plan expires. Nothing refreshes a snapshot when time passes, so
+    paid widgets that expire before the next rebuild removes their snapshot are
+    left to Flask, which checks the plan on every view.
+    """
+
+    if view.is_free:
+        return trial_days.days <= 0
+
+    return view.expires_on is None or view.expires_on > now + SNAPSHOT_REBUILD_INTERVAL
+
+def snapshot_path( directory, extension_id ):
+
+    """
+    Return the path of an extension's snapshot, or None if its ID is not a safe file name.
+    """
+
+    if extension_id is None or not EXTENSION_ID_PATTERN.match( extension_id ):
+        return None
+
+    return os.path.join( directory, extension_id + '.html' )
+
+def write_snapshot( path, body ):
+
+    """
+    Atomically replace a snapshot, so readers see either the old or the new file.
+    """
+
+    directory = os.path.dirname( path )
+    os.makedirs( directory, exist_ok = True )
+
+    # Write to a temporary file beside the snapshot, then swap it in.
+    handle, temporary_path = tempfile.mkstemp( dir = directory, prefix = '.snapshot-',
+                                              suffix = '.tmp' )
+
+    try:
+
+        with os.fdopen( handle, 'w', encoding = 'utf-8' ) as snapshot_file:
+            snapshot_file.write( body )
+
+        os.chmod( temporary_path, 0o644 )
+        os.replace( temporary_path, path )
+
+    except Exception:
+
+        os.remove( temporary_path )
+        raise
+
+def lock_directory( directory ):
+
+    """
+    Open and exclusively lock a snapshot directory's lock file, and return the file.
+
+    Each process publishes on its own, so publishes of an extension hold the lock
+    from reading its state to writing its snapshot. The last snapshot written is
+    then rendered from the last state read. Closing the file releases the lock.
+    """
+
+    os.makedirs( directory, exist_ok = True )
+
+    lock_file = open( os.path.join( directory, LOCK_NAME ), 'a', # pylint: disable=consider-using-with
+                     encoding = 'utf-8' )
+
+    try:
+
+        fcntl.flock( lock_file, fcntl.LOCK_EX )
+
+    except Exception:
+
+        lock_file.close()
+        raise
+
+    return lock_file
+
+def remove_snapshot( path ):
+
+    """
+    Remove a snapshot if it exists, so views fall through to Flask.
+    """
+
+    try:
+        os.remove( path )
+    except FileNotFoundError:
+        pass
+
+# Define the snapshot publisher class.
+class SnapshotPublisher:
+
+    """
+    Keep the widget snapshots of a directory in step with the database.
+
+    render( extension_id, view, trial_days ) returns the widget HTML, and is
+    called inside a request context for the widget route. Signal receivers
+    schedule refreshes on a background thread so that saves never wait on
+    rendering. Publishing is disabled when no directory is configured.
+    """
+
+    def __init__( self, app, render, trial_length, directory = WIDGET_SNAPSHOT_DIR ):
+
+        # Initialize variables.
+        self.app = app
+        self.render = render
+        self.trial_length = trial_length
+        self.directory = directory
+        self._executor = ThreadPoolExecutor( max_workers = 1,
+                                            thread_name_prefix = 'widget-snapshots' )
+        self._scheduled = set()
+        self._lock = threading.Lock()
+
+    def schedule( self, extension_id ):
+
+        """
+        Refresh an extension's snapshot in the background.
+        """
+
+        if not self.directory or snapshot_path( self.directory, extension_id ) is None:
+            return
+
+        # Collapse repeated requests while one is waiting.
+        with self._lock:
+
+            if extension_id in self._scheduled:
+                return
+
+            self._scheduled.add( extension_id )
+
+        self._submit( self._run, extension_id )
+
+    def schedule_instance( self, instance_id ):
+
+        """
+        Refresh the snapshots of every extension of an instance in the background.
+        """
+
+        if not self.directory:
+            return
+
+        self._submit( self._run_instance, instance_id )
+
+    def _submit( self, function, key ):
+
+        """
+        Run a refresh on the background thread, or now if the thread has stopped.
+        """
+
+        try:
+
+            self._executor.submit( function, key )
+
+        except RuntimeError:
+
+            # The thread stops as the interpreter exits, before the write buffer
+            # flushes the last saves, so publish those before exiting.
+            function( key )
+
+    def publish( self, extension_id, directory = None ):
+
+        """
+        Write or remove an extension's snapshot now, and return True if it was written.
+
+        Must run inside an application context.
+        """
+
+        # Initialize variables.
+        directory = directory or self.directory
+        path = snapshot_path( directory, extension_id )
+
+        if path is None:
+            return False
+
+        # Keep a slower publish from replacing a newer snapshot in another process.
+        with lock_directory( directory ):
+            return self._publish( extension_id, path )
+
+    def _publish( self, extension_id, path ):
+
+        """
+        Write or remove an extension's snapshot from its current state.
+        """
+
+        # Start from a fresh transaction, so we see what any earlier publish saw.
+        db.session.rollback()
+
+        view = queries.load_widget_view( extension_id )
+
+        # Deleted and unpublishable extensions are served by Flask.
+        if view is None:
+
+            remove_snapshot( path )
+            return False
+
+        trial_days = logic.calculate_trial_days( self.trial_length, view.instance_created_at )
+
+        if not is_publishable( view, trial_days, datetime.utcnow() ):
+
+            remove_snapshot( path )
+            return False
+
+        # Render as the widget route would.
+        with self.app.test_request_context( '/widget/',
+                                           query_string = { 'origCompId': extension_id } ):
+            body = self.render( extension_id, view, trial_days )
+
+        write_snapshot( path, body )
+
+        return True
+
+    def rebuild( self, directory = None ):
+
+        """
+        Publish every extension and remove snapshots of anything else.
+
+        Must run inside an application context. Returns the number of snapshots written.
+        """
+
+        # Initialize variables.
+        directory = directory or self.directory
+        published = set()
+        last_extension_id = None
+
+        while True:
+
+            # Walk the extensions in primary key order.
+            query = select( Extension.extension_id ).order_by( Extension.extension_id )
+
+            if last_extension_id is not None:
+                query = query.where( Extension.extension_id > last_extension_id )
+
+            extension_ids = db.session.scalars( query.limit( SNAPSHOT_BATCH_SIZE ) ).all()
+
+            if not extension_ids:
+                break
+
+            for extension_id in extension_ids:
+
+                if self.publish( extension_id, directory ):
+                    published.add( extension_id + '.html' )
+
+            last_extension_id = extension_ids[ -1 ]
+
+            # Release the read transaction between batches.
+            db.session.rollback()
+
+        # Remove snapshots of deleted or unpublishable extensions.
+        if os.path.isdir( directory ):
+
+            for file_name in os.listdir( directory ):
+
+                if file_name.endswith( '.html' ) and file_name not in published:
+                    remove_snapshot( os.path.join( directory, file_name ) )
+
+        return len( published )
+
+    def _run( self, extension_id ):
+
+        """
+        Refresh one snapshot in its own application context, logging rather than raising errors.
+        """
+
+        with self._lock:
+            self._scheduled.discard( extension_id )
+
+        try:
+
+            with self.app.app_context():
+                self.publish( extension_id )
+
+        except Exception as err :
+
+            logs.error( 'snapshot-publish-failed', err, extension_id = extension_id )
+
+    def _run_instance( self, instance_id ):
+
+        """
+        Refresh the snapshots of an instance's extensions, logging rather than raising errors.
+        """
+
+        try:
+
+            with self.app.app_context():
+
+                extension_ids = db.session.scalars(
+                    select( Extension.extension_id ).where( Extension.instance_id == instance_id )
+                ).all()
+
+                for extension_id in extension_ids:
+                    self.publish( extension_id )
+
+        except Exception as err :
+
+            logs.error( 'snapshot-publish-failed', err, instance_id = instance_id )
+
+@click.command( 'publish-widget-snapshots' )
+@click.option( '--output', 'directory', default = None,
+              help = 'Directory to write to. Defaults to WIDGET_SNAPSHOT_DIR.' )
+@with_appcontext
+def publish_widget_snapshots_command( directory ):
+
+    """
+    Rebuild the static snapshots of every publishable widget.
+    """
+
+    publisher = current_app.extensions[ 'widget_snapshots' ]
+    directory = directory or publisher.directory
+
+    if not directory:
+        raise click.UsageError( 'Set WIDGET_SNAPSHOT_DIR or pass --output.' )
+
+    written = publisher.rebuild( directory )
+
+    click.echo( 'Done. ' + str( written ) + ' snapshots written to ' + directory + '.' )
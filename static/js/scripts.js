@@ -50,6 +50,16 @@ function updateWidgetExtension( e ){
     console.log( "updateWidgetExtension called." );
     console.log( e );
 
+    // Show the new settings.
+    renderWidgetExtension( e );
+
+    // Save changes.
+    publishWidgetExtension( e )
+}
+
+// Show a slider with the given settings.
+function renderWidgetExtension( e ){
+
     // Initialize variables.
     var slider = document.getElementById( extension_id + "-twentytwenty" );
     var beforeImage = document.getElementById( extension_id + "-before-image" );
@@ -76,6 +86,9 @@ function updateWidgetExtension( e ){
     slider.dataset.sliderDarkMode = e.sliderDarkMode;
 
     // Update image attributes.
+    // Drop the server-rendered srcset, which describes the previous images.
+    beforeImage.removeAttribute( "srcset" );
+    afterImage.removeAttribute( "srcset" );
     beforeImage.src = e.beforeImage;
     afterImage.src  = e.afterImage;
     beforeImage.alt = e.beforeAltText;
@@ -143,9 +156,6 @@ function updateWidgetExtension( e ){
 
     // Ensure the component window sizes appropriately for the images.
     resizeComponentWindow();
-
-    // Save changes.
-    publishWidgetExtension( e )
 }
 
 // Do something when the user deletes an extension.
@@ -167,6 +177,36 @@ function deleteWidgetExtension( e ){
     });
 }
 
+// Get the settings of a slider in the shape the app saves them.
+function getWidgetExtensionState( slider ){
+
+    return {
+        beforeImage: slider.dataset.beforeImage,
+        beforeImageThumbnail: slider.dataset.beforeImageThumbnail,
+        beforeLabelText: slider.dataset.beforeLabelText,
+        beforeAltText: slider.dataset.beforeAltText,
+        afterImage: slider.dataset.afterImage,
+        afterImageThumbnail: slider.dataset.afterImageThumbnail,
+        afterLabelText: slider.dataset.afterLabelText,
+        afterAltText: slider.dataset.afterAltText,
+        sliderOffset: slider.dataset.sliderOffset,
+        sliderOffsetFloat: slider.dataset.sliderOffsetFloat,
+        sliderOrientation: slider.dataset.sliderOrientation,
+        sliderMouseoverAction: slider.dataset.sliderMouseoverAction,
+        sliderHandleAnimation: slider.dataset.sliderHandleAnimation,
+        sliderMoveOnClickToggle: slider.dataset.sliderMoveOnClickToggle,
+        sliderHandleBorderColor: slider.dataset.sliderHandleBorderColor,
+        sliderDarkMode: slider.dataset.sliderDarkMode
+    };
+}
+
+// Remember the settings the app last saved, so that later saves send only the changes.
+var saved_state = null;
+
+// After a conflict, remember the settings that were rejected. The settings panel
+// still holds them, so later saves skip them rather than overwrite the other edit.
+var rejected_state = null;
+
 // Do something when the user saves the website.
 function publishWidgetExtension( e ){
 
@@ -176,35 +216,112 @@ function publishWidgetExtension( e ){
 
     // Get the extensions current attribute data.
     var slider =  document.getElementById( extension_id + "-twentytwenty" );
+    var state = getWidgetExtensionState( slider );
+    var changes = {};
+
+    // New extensions are saved in full.
+    if( extension_version === null || saved_state === null ){
+
+        saveWidgetExtension( slider, state );
+        return;
+    }
+
+    // Collect the settings that changed since the last save.
+    for( var field in state ){
+
+        if( state[ field ] === saved_state[ field ] ){
+
+            continue;
+        }
+
+        // Skip stale settings the app already rejected.
+        if( rejected_state !== null && state[ field ] === rejected_state[ field ] ){
+
+            continue;
+        }
+
+        changes[ field ] = state[ field ];
+    }
+
+    // Skip the request if nothing changed.
+    if( Object.keys( changes ).length === 0 ){
+
+        return;
+    }
+
+    // Send only the changes, with the version they were made against.
+    fetch( url_for_widget + encodeURIComponent( slider.dataset.sliderId ), {
+        method: "PATCH",
+        body: JSON.stringify({
+            version: extension_version,
+            changes: changes
+        }),
+        headers: {
+        "Content-type": "application/json; charset=UTF-8"
+        }
+    }).then( function( response ){
+
+        // The app has not saved this extension yet, so save it in full.
+        if( response.status == 404 ){
+
+            saveWidgetExtension( slider, state );
+            return;
+        }
+
+        return response.json().then( function( data ){
+
+            extension_version = data.version;
+
+            if( response.ok ){
+
+                saved_state = state;
+                return;
+            }
+
+            // Another editor saved first. Show what they saved instead of overwriting it.
+            if( response.status == 409 && data.state ){
+
+                rejected_state = state;
+                renderWidgetExtension( data.state );
+                saved_state = getWidgetExtensionState( slider );
+                showConflictNotice();
+            }
+        });
+    });
+}
+
+// Tell the user their last changes were not saved because the slider changed elsewhere.
+function showConflictNotice(){
+
+    var notice = document.getElementById( extension_id + "-conflict-notice" );
+
+    if( notice === null ){
+
+        notice = document.createElement( "div" );
+        notice.id = extension_id + "-conflict-notice";
+        notice.className = "alert alert-warning fixed-top w-90 mx-3 my-3";
+        notice.setAttribute( "role", "alert" );
+        notice.innerText = "This slider was changed in another window, so your last changes were " +
+            "not saved. It now shows the latest saved settings. Reopen Settings before editing it again.";
+        document.querySelector( ".content" ).prepend( notice );
+    }
+}
+
+// Send all the settings of a slider to the app.
+function saveWidgetExtension( slider, state ){
 
     // Send the attribute data to the app in an asynchronous POST request.
     fetch( url_for_widget, {
         method: "POST",
-        body: JSON.stringify({
+        body: JSON.stringify( Object.assign({
             action: "save",
             extensionId: slider.dataset.sliderId,
             siteId: Wix.Utils.getSiteOwnerId(),
             userId: Wix.Utils.getUid(),
-            instanceId: Wix.Utils.getInstanceId(),
-            beforeImage: slider.dataset.beforeImage,
-            beforeImageThumbnail: slider.dataset.beforeImageThumbnail,
-            beforeLabelText: slider.dataset.beforeLabelText,
-            beforeAltText: slider.dataset.beforeAltText,
-            afterImage: slider.dataset.afterImage,
-            afterImageThumbnail: slider.dataset.afterImageThumbnail,
-            afterLabelText: slider.dataset.afterLabelText,
-            afterAltText: slider.dataset.afterAltText,
-            sliderOffset: slider.dataset.sliderOffset,
-            sliderOffsetFloat: slider.dataset.sliderOffsetFloat,
-            sliderOrientation: slider.dataset.sliderOrientation,
-            sliderMouseoverAction: slider.dataset.sliderMouseoverAction,
-            sliderHandleAnimation: slider.dataset.sliderHandleAnimation,
-            sliderMoveOnClickToggle: slider.dataset.sliderMoveOnClickToggle,
-            sliderHandleBorderColor: slider.dataset.sliderHandleBorderColor,
-            sliderDarkMode: slider.dataset.sliderDarkMode
-        }),
+            instanceId: Wix.Utils.getInstanceId()
+        }, state ) ),
         headers: {
         "Content-type": "application/json; charset=UTF-8"
         }
     });
-}
\ No newline at end of file
+}
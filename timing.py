@@ -0,0 +1,208 @@
+"""
+Time where each request to my Flask app for Wix spends its time.
+
+Sampled requests count their database queries and add up the time spent in
+the database, in Wix API calls and in rendering templates. The totals are
+sent back in a Server-Timing header, which browser developer tools show
+beside the request, and logged as one request-timing event per request.
+"""
+
+# Python imports
+import os
+import time
+import random
+import contextvars
+from dotenv import load_dotenv
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Local imports
+import logs
+import signals
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+# Fraction of requests to time, from 0 (none) to 1 (all).
+REQUEST_TIMING_SAMPLE_RATE = float( os.getenv( "REQUEST_TIMING_SAMPLE_RATE", "1.0" ) )
+
+# The timer of the request being served by this thread or green thread, if sampled.
+current_timer = contextvars.ContextVar( 'request_timer', default = None )
+
+# Define the request timer class.
+class RequestTimer:
+
+    """
+    Accumulate the time a request spends in the database, Wix and templates.
+    """
+
+    __slots__ = ( 'started', 'queries', 'db_time', 'wix_calls', 'wix_time', 'render_time',
+                 'render_started' )
+
+    def __init__( self ):
+
+        # Initialize variables.
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.wix_calls = 0
+        self.wix_time = 0.0
+        self.render_time = 0.0
+        self.render_started = []
+
+    def server_timing( self, total ):
+
+        """
+        Return the value of a Server-Timing header, with durations in milliseconds.
+        """
+
+        return (
+            f'db;dur={ self.db_time * 1000:.1f};desc="queries={ self.queries }", '
+            f'wix;dur={ self.wix_time * 1000:.1f};desc="calls={ self.wix_calls }", '
+            f'render;dur={ self.render_time * 1000:.1f}, total;dur={ total * 1000:.1f}'
+        )
+
+    def summary( self, total ):
+
+        """
+        Return the totals of the request, with durations in milliseconds.
+        """
+
+        return {
+            'total_ms': round( total * 1000, 1 ),
+            'db_ms': round( self.db_time * 1000, 1 ),
+            'queries': self.queries,
+            'wix_ms': round( self.wix_time * 1000, 1 ),
+            'wix_calls': self.wix_calls,
+            'render_ms': round( self.render_time * 1000, 1 )
+        }
+
+def start( sample_rate = REQUEST_TIMING_SAMPLE_RATE ):
+
+    """
+    Start timing the current request if it is sampled.
+
+    Always replaces the previous request's timer, since threads serve many requests.
+    """
+
+    if sample_rate > 0 and random.random() < sample_rate:
+        current_timer.set( RequestTimer() )
+    else:
+        current_timer.set( None )
+
+def finish( response, request ):
+
+    """
+    Add the Server-Timing header of a timed request to its response, log it, and return it.
+    """
+
+    timer = current_timer.get()
+
+    if timer is None:
+        return response
+
+    current_timer.set( None )
+
+    # Initialize variables.
+    total = time.perf_counter() - timer.started
+    route = request.url_rule.rule if request.url_rule is not None else None
+
+    response.headers.add( 'Server-Timing', timer.server_timing( total ) )
+
+    # Log one event per request. Leave the query string out, since it may hold signed tokens.
+    logs.info( 'request-timing', method = request.method, route = route, path = request.path,
+              status = response.status_code, **timer.summary( total ) )
+
+    return response
+
+def before_cursor_execute( conn, cursor, statement, parameters, context, executemany ):
+
+    # pylint: disable=unused-argument
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    # SQLAlchemy passes these arguments to every listener.
+
+    """
+    Note when a query of a timed request starts.
+    """
+
+    # Keep the start on the execution itself, so a failed query leaves nothing behind.
+    if current_timer.get() is not None and context is not None:
+        context.timing_started = time.perf_counter()
+
+def after_cursor_execute( conn, cursor, statement, parameters, context, executemany ):
+
+    # pylint: disable=unused-argument
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+
+    """
+    Add a finished query to the timed request.
+    """
+
+    timer = current_timer.get()
+    started = getattr( context, 'timing_started', None )
+
+    # Queries that started before the request was timed are not counted.
+    if timer is not None and started is not None:
+
+        timer.queries += 1
+        timer.db_time += time.perf_counter() - started
+
+def record_wix_request( method, duration = 0.0, **_extra ):
+
+    # pylint: disable=unused-argument
+
+    """
+    Add a finished Wix API call to the timed request.
+    """
+
+    timer = current_timer.get()
+
+    if timer is not None:
+
+        timer.wix_calls += 1
+        timer.wix_time += duration
+
+def record_render_start( sender, **_extra ):
+
+    # pylint: disable=unused-argument
+
+    """
+    Note when a template of a timed request starts rendering.
+    """
+
+    timer = current_timer.get()
+
+    if timer is not None:
+        timer.render_started.append( time.perf_counter() )
+
+def record_render_end( sender, **_extra ):
+
+    # pylint: disable=unused-argument
+
+    """
+    Add a rendered template to the timed request.
+    """
+
+    timer = current_timer.get()
+
+    if timer is not None and timer.render_started:
+        timer.render_time += time.perf_counter() - timer.render_started.pop()
+
+def instrument():
+
+    """
+    Listen for queries, Wix API calls and template rendering in every timed request.
+
+    Call once at startup. Work outside timed requests, e.g. on background
+    threads, is ignored.
+    """
+
+    event.listen( Engine, 'before_cursor_execute', before_cursor_execute )
+    event.listen( Engine, 'after_cursor_execute', after_cursor_execute )
+    signals.wix_request_finished.connect( record_wix_request )
+    before_render_template.connect( record_render_start )
+    template_rendered.connect( record_render_end )
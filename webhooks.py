@@ -0,0 +1,662 @@
+"""
+Durable processing of Wix webhooks for my Flask app for Wix.
+
+The webhook routes only verify and enqueue events. The worker pool below
+applies them to the database, in order for each instance, with retries.
+"""
+# pylint: disable=broad-exception-caught
+
+# Python imports
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+import click
+import jwt
+from cryptography.hazmat.primitives.serialization import load_pem_public_key
+from dotenv import load_dotenv
+from flask.cli import with_appcontext
+from sqlalchemy import exists, select, update
+from sqlalchemy.orm import aliased
+
+# Local imports
+from database import db
+import cache
+import logs
+import queries
+import signals
+
+# Import models.
+from models import Instance, QueuedWebhook
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+WEBHOOK_WORKERS = int( os.getenv( "WEBHOOK_WORKERS", "2" ) )
+WEBHOOK_MAX_ATTEMPTS = int( os.getenv( "WEBHOOK_MAX_ATTEMPTS", "8" ) )
+WEBHOOK_POLL_INTERVAL = float( os.getenv( "WEBHOOK_POLL_INTERVAL", "5" ) )
+WEBHOOK_RETRY_BASE = timedelta( seconds = 5 )
+WEBHOOK_RETRY_MAX = timedelta( minutes = 30 )
+WEBHOOK_LEASE = timedelta( seconds = int( os.getenv( "WEBHOOK_LEASE_SECONDS", "300" ) ) )
+WEBHOOK_REPLAY_CACHE_SIZE = int( os.getenv( "WEBHOOK_REPLAY_CACHE_SIZE", "10000" ) )
+WEBHOOK_REPLAY_CACHE_TTL = int( os.getenv( "WEBHOOK_REPLAY_CACHE_TTL", "86400" ) )
+
+# Events that still have to run. Processing events are leased until available_at.
+UNFINISHED = ( 'pending', 'processing' )
+
+# Match each PEM block in a string that may hold several keys.
+PEM_PATTERN = re.compile( r'-----BEGIN PUBLIC KEY-----.+?-----END PUBLIC KEY-----', re.DOTALL )
+
+# Define the verified event class.
+class WixWebhookEvent( NamedTuple ):
+
+    """
+    A webhook whose signature has been verified.
+    """
+
+    event_type: str
+    instance_id: str
+    payload: str
+    data: dict
+    digest: str
+
+# Define the claim class.
+class Claim( NamedTuple ):
+
+    """
+    A queued event leased to this worker, copied so that rollbacks do not expire it.
+    """
+
+    id: int
+    event_type: str
+    instance_id: str
+    payload: str
+    attempts: int
+    received_at: datetime
+    lease_until: datetime
+
+# Define the verifier class.
+class WebhookVerifier:
+
+    """
+    Verify signed Wix webhooks against RSA public keys parsed once at startup.
+
+    Several keys may be configured so that Wix can rotate its key without downtime.
+    Digests of recently accepted tokens are remembered, so redelivered webhooks can
+    be acknowledged without decoding them or touching the database.
+    """
+
+    def __init__( self, public_keys, replay_cache_size = WEBHOOK_REPLAY_CACHE_SIZE,
+                 replay_cache_ttl = WEBHOOK_REPLAY_CACHE_TTL ):
+
+        # Initialize variables.
+        self.public_keys = list( public_keys )
+        self._seen = cache.TTLCache( replay_cache_size, replay_cache_ttl )
+
+    @classmethod
+    def from_pem( cls, *pem_strings ):
+
+        """
+        Create a verifier from strings holding one or more PEM-encoded public keys.
+        """
+
+        # Initialize variables.
+        public_keys = []
+
+        for pem_string in pem_strings:
+
+            if not pem_string:
+                continue
+
+            for pem in PEM_PATTERN.findall( pem_string ):
+                public_keys.append( load_pem_public_key( pem.encode( "UTF-8" ) ) )
+
+        return cls( public_keys )
+
+    @staticmethod
+    def digest( encoded_jwt ):
+
+        """
+        Return the digest that identifies a delivery.
+        """
+
+        if isinstance( encoded_jwt, str ):
+            encoded_jwt = encoded_jwt.encode( "UTF-8" )
+
+        return hashlib.sha256( encoded_jwt ).hexdigest()
+
+    @property
+    def seen( self ):
+
+        """
+        The cache of recently accepted deliveries, e.g. for metrics.
+        """
+
+        return self._seen
+
+    def is_replay( self, encoded_jwt ):
+
+        """
+        Return True if this exact token was accepted recently.
+        """
+
+        return self._seen.get( self.digest( encoded_jwt ) ) is not None
+
+    def remember( self, event ):
+
+        """
+        Record that an event was accepted, so redeliveries are recognized.
+        """
+
+        self._seen.set( event.digest, True )
+
+    def verify( self, event_type, encoded_jwt ):
+
+        """
+        Verify the token's signature with each key in turn and return the event.
+
+        Raises jwt.InvalidTokenError if no key verifies it, and jwt.InvalidKeyError,
+        which is not one, if no key is configured. Both are jwt.PyJWTError.
+        """
+
+        if not self.public_keys:
+            raise jwt.InvalidKeyError( 'No webhook public key is configured.' )
+
+        # Initialize variables.
+        error = None
+
+        for public_key in self.public_keys:
+
+            try:
+
+                data = jwt.decode( encoded_jwt, public_key, algorithms=["RS256"] )
+                break
+
+            except jwt.InvalidSignatureError as err :
+
+                # Try the next key.
+                error = err
+
+        else:
+
+            raise error
+
+        # Load the JSON payload.
+        request_data = json.loads( data['data'] )
+
+        return WixWebhookEvent(
+            event_type = event_type,
+            instance_id = request_data[ 'instanceId' ],
+            payload = data['data'],
+            data = request_data,
+            digest = self.digest( encoded_jwt )
+        )
+
+def enqueue( event_type, instance_id, payload ):
+
+    """
+    Durably append a verified webhook event to the queue.
+    """
+
+    event = QueuedWebhook(
+        event_type = event_type,
+        instance_id = instance_id,
+        payload = payload,
+        status = 'pending',
+        attempts = 0,
+        available_at = datetime.utcnow()
+    )
+
+    db.session.add( event )
+    db.session.commit()
+
+    return event
+
+def process_uninstall( request_data, event_time ):
+
+    # pylint: disable=unused-argument
+
+    """
+    Remove the extensions of an uninstalled instance. Returns True if anything changed.
+
+    The purge commits each chunk. The worker's lease keeps the event claimed
+    meanwhile, and a purge cut short is finished when the event runs again.
+    """
+
+    # Extract the instance ID
+    instance_id = request_data[ 'instanceId' ]
+
+    # Search the tables for records, filtering by instance ID.
+    instance = db.session.get( Instance, instance_id )
+
+    # Wix will repeatedly call this route if we return an error code.
+    # Prevent that from happening by proceeding only if the instance exists.
+    if instance is None:
+        return False
+
+    # Delete the extensions and reset the extension count.
+    removed = queries.purge_extensions( instance_id )
+
+    # Drop anything derived from the deleted extensions.
+    for extension_id in removed:
+        signals.extension_changed.send( extension_id )
+
+    # Log event.
+    logs.info( 'instance-uninstalled', instance_id = instance_id,
+              extensions_deleted = len( removed ) )
+
+    return True
+
+def process_upgrade( request_data, event_time ):
+
+    """
+    Mark an instance as paid. Returns True if anything changed.
+    """
+
+    # Initialize variables.
+    one_month_from_received = event_time + timedelta( 1 * 30 )
+    product_data = json.loads( request_data['data'] )
+
+    # Extract the instance ID
+    instance_id = request_data[ 'instanceId' ]
+
+    # Extract the product ID
+    product_id = product_data[ 'vendorProductId' ]
+
+    # Search the tables for records, filtering by instance ID.
+    instance = Instance.query.filter_by( instance_id = instance_id ).first()
+
+    # Log the key webhook fields so missed or malformed upgrades are diagnosable.
+    logs.info( 'upgrade-received', instance_id = instance_id, vendor_product_id = product_id,
+              expires_on = product_data.get( 'expiresOn' ),
+              instance_found = instance is not None )
+
+    # If the instance exists and the product_id is not null.
+    if instance and product_id:
+
+        # Change the user to a paid user.
+        instance.is_free = False
+        instance.did_cancel = False
+
+        # Extract the expiration date
+        if 'expiresOn' in product_data :
+
+            instance.expires_on = datetime.strptime( product_data[ 'expiresOn' ],
+                                                    '%Y-%m-%dT%H:%M:%SZ' )
+
+        else :
+
+            # Default to the shortest allowable paid interval.
+            instance.expires_on = one_month_from_received
+
+        # Log event.
+        logs.info( 'instance-upgraded', instance_id = instance_id,
+                  expires_on = instance.expires_on )
+
+        return True
+
+    if instance is None:
+
+        # The webhook fired for an instance we have no record of. Without this
+        # the user silently stays on the free tier despite paying.
+        logs.warning( 'upgrade-missed', instance_id = instance_id,
+                     reason = 'no Instance record; paid user may be stranded on free tier' )
+
+    else:
+
+        # Log event.
+        logs.warning( 'upgrade-missed', instance_id = instance_id,
+                     reason = 'vendorProductId missing' )
+
+    return False
+
+def process_downgrade( request_data, event_time ):
+
+    # pylint: disable=unused-argument
+
+    """
+    Flag an instance's cancellation. Returns True if anything changed.
+    """
+
+    # Initialize variables.
+    product_data = json.loads( request_data['data'] )
+
+    # Extract the instance ID
+    instance_id = request_data[ 'instanceId' ]
+
+    # Extract the product ID
+    product_id = product_data[ 'vendorProductId' ]
+
+    # Search the tables for records, filtering by instance ID.
+    instance = Instance.query.filter_by( instance_id = instance_id ).first()
+
+    # If the instance exists and the product_id is not null.
+    if instance and product_id:
+
+        # Flag the user cancellation.
+        instance.did_cancel = True
+
+        # Log event.
+        logs.info( 'instance-downgraded', instance_id = instance_id )
+
+        return True
+
+    return False
+
+# Map each event type to the function that applies it.
+PROCESSORS = {
+    'uninstall': process_uninstall,
+    'upgrade': process_upgrade,
+    'downgrade': process_downgrade
+}
+
+def claim_next( lease = WEBHOOK_LEASE ):
+
+    """
+    Claim and return the next event that is ready to run, or None.
+
+    An event is only ready once every earlier unfinished event of the same
+    instance has finished, which keeps each instance's events in order. The
+    claim marks the event processing and commits, leasing it to this worker
+    until available_at. Processing may then commit as it goes. If the worker
+    dies, the lease expires and another worker claims the event again.
+    """
+
+    # Initialize variables.
+    earlier = aliased( QueuedWebhook )
+    now = datetime.utcnow()
+
+    query = (
+        select( QueuedWebhook )
+        .where( QueuedWebhook.status.in_( UNFINISHED ) )
+        .where( QueuedWebhook.available_at <= now )
+        .where( ~exists().where(
+            earlier.instance_id == QueuedWebhook.instance_id,
+            earlier.status.in_( UNFINISHED ),
+            earlier.id < QueuedWebhook.id
+        ) )
+        .order_by( QueuedWebhook.id )
+        .limit( 1 )
+        .with_for_update( skip_locked = True, of = QueuedWebhook )
+    )
+
+    event = db.session.execute( query ).scalars().first()
+
+    if event is None:
+
+        db.session.rollback()
+        return None
+
+    # Take the lease only if nobody took it since we read, for databases without row locks.
+    lease_until = now + lease
+    claimed = db.session.execute(
+        update( QueuedWebhook )
+        .where( QueuedWebhook.id == event.id, QueuedWebhook.status == event.status,
+               QueuedWebhook.available_at == event.available_at )
+        .values( status = 'processing', available_at = lease_until )
+        .execution_options( synchronize_session = False )
+    ).rowcount
+
+    if claimed == 0:
+
+        db.session.rollback()
+        return None
+
+    # Copy the event before the commit expires it.
+    claim = Claim( event.id, event.event_type, event.instance_id, event.payload,
+                  event.attempts, received_at( event ), lease_until )
+
+    db.session.commit()
+
+    return claim
+
+def process_next():
+
+    """
+    Process the next ready event. Must run inside an application context.
+
+    Returns True if an event was claimed, whether or not it succeeded.
+    """
+
+    claim = claim_next()
+
+    if claim is None:
+        return False
+
+    try:
+
+        # Apply the event, then mark it done with any changes left uncommitted.
+        did_change = PROCESSORS[ claim.event_type ]( json.loads( claim.payload ),
+                                                    claim.received_at )
+
+        # Only the worker that still holds the lease may complete the event. If it
+        # expired and another worker claimed the event, that worker completes it.
+        completed = db.session.execute(
+            update( QueuedWebhook )
+            .where( *holds_lease( claim ) )
+            .values( status = 'done', attempts = claim.attempts + 1,
+                    processed_at = datetime.utcnow() )
+            .execution_options( synchronize_session = False )
+        ).rowcount
+
+        if completed == 0:
+
+            db.session.rollback()
+            logs.warning( 'webhook-lease-lost', webhook_id = claim.id )
+            return True
+
+        db.session.commit()
+
+        # Drop anything derived from the instance.
+        if did_change:
+            signals.instance_changed.send( claim.instance_id )
+
+        signals.webhook_processed.send( claim.event_type,
+                                       outcome = 'applied' if did_change else 'unchanged' )
+
+    except Exception as err :
+
+        db.session.rollback()
+        status = record_failure( claim, err )
+
+        signals.webhook_processed.send( claim.event_type,
+                                       outcome = 'dead' if status == 'dead' else 'retry' )
+
+    return True
+
+def holds_lease( claim ):
+
+    """
+    Return the conditions matching a claimed event only while its lease is ours.
+    """
+
+    return ( QueuedWebhook.id == claim.id, QueuedWebhook.status == 'processing',
+            QueuedWebhook.available_at == claim.lease_until )
+
+def received_at( event ):
+
+    """
+    Return when the event was received as a naive UTC datetime, like our other columns.
+    """
+
+    if event.created_at is None:
+        return datetime.utcnow()
+
+    if event.created_at.tzinfo is None:
+        return event.created_at
+
+    return event.created_at.astimezone( timezone.utc ).replace( tzinfo = None )
+
+def record_failure( claim, err ):
+
+    """
+    Schedule a retry of a failed event with exponential backoff, or mark it dead.
+
+    Returns the event's new status.
+    """
+
+    # Initialize variables.
+    event_id = claim.id
+    attempts = claim.attempts + 1
+    values = {
+        'status': 'pending',
+        'attempts': attempts,
+        'last_error': str( err )[ :2000 ]
+    }
+
+    # Give up on events that keep failing.
+    if attempts >= WEBHOOK_MAX_ATTEMPTS:
+
+        values[ 'status' ] = 'dead'
+        logs.error( 'webhook-dead', err, webhook_id = event_id, attempts = attempts )
+
+    else:
+
+        delay = min( WEBHOOK_RETRY_BASE * ( 2 ** ( attempts - 1 ) ), WEBHOOK_RETRY_MAX )
+        values[ 'available_at' ] = datetime.utcnow() + delay
+        logs.warning( 'webhook-retry', webhook_id = event_id, attempts = attempts,
+                     retry_in_seconds = delay.total_seconds(), error = str( err ) )
+
+    db.session.execute(
+        update( QueuedWebhook )
+        .where( *holds_lease( claim ) )
+        .values( **values )
+    )
+    db.session.commit()
+
+    return values[ 'status' ]
+
+def drain( max_events = None ):
+
+    """
+    Process ready events until none are left or the limit is reached.
+    """
+
+    # Initialize variables.
+    processed = 0
+
+    while max_events is None or processed < max_events:
+
+        if not process_next():
+            break
+
+        processed += 1
+
+    return processed
+
+# Define the worker pool class.
+class WebhookWorkerPool:
+
+    # pylint: disable=too-many-instance-attributes
+    # Eight is reasonable in this case.
+
+    """
+    Background threads that drain the webhook queue in each gunicorn worker.
+
+    Threads wake up when an event is enqueued in this process, and otherwise poll
+    so that retries and events enqueued by other processes are picked up.
+    """
+
+    def __init__( self, workers = WEBHOOK_WORKERS, poll_interval = WEBHOOK_POLL_INTERVAL ):
+
+        # Initialize variables.
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._app = None
+        self._threads = []
+        self._pid = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start( self, app ):
+
+        """
+        Start the worker threads of this process if they are not running yet.
+        """
+
+        # Threads do not survive a fork, so start them again in each worker process.
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+
+            if self._pid == os.getpid():
+                return
+
+            self._app = app
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread( target = self._run, name = 'webhook-worker-' + str( number ),
+                                 daemon = True )
+                for number in range( self.workers )
+            ]
+
+            for thread in self._threads:
+                thread.start()
+
+            self._pid = os.getpid()
+
+        atexit.register( self.stop )
+
+    def notify( self ):
+
+        """
+        Wake the workers because an event was enqueued.
+        """
+
+        self._wake.set()
+
+    def stop( self, timeout = 5 ):
+
+        """
+        Ask the workers to finish their current event and exit.
+        """
+
+        self._stopping.set()
+        self._wake.set()
+
+        for thread in self._threads:
+            thread.join( timeout )
+
+    def _run( self ):
+
+        """
+        Drain the queue until asked to stop.
+        """
+
+        while not self._stopping.is_set():
+
+            try:
+
+                with self._app.app_context():
+                    processed = drain()
+
+            except Exception as err :
+
+                logs.error( 'webhook-worker-failed', err )
+                processed = 0
+
+            # Sleep until woken or until it is time to poll again.
+            if processed == 0:
+
+                self._wake.wait( self.poll_interval )
+                self._wake.clear()
+
+@click.command( 'drain-webhooks' )
+@click.option( '--max-events', type = int, default = None, help = 'Stop after this many events.' )
+@with_appcontext
+def drain_webhooks_command( max_events ):
+
+    """
+    Process queued webhooks that are ready to run, then exit.
+    """
+
+    processed = drain( max_events )
+
+    click.echo( 'Processed ' + str( processed ) + ' webhooks.' )
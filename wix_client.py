@@ -0,0 +1,183 @@
+"""
+A pooled HTTP client for the Wix APIs.
+"""
+
+# Python imports
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+# Local imports
+import signals
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+WIX_CONNECT_TIMEOUT = float( os.getenv( "WIX_CONNECT_TIMEOUT", "1.0" ) )
+WIX_READ_TIMEOUT = float( os.getenv( "WIX_READ_TIMEOUT", "2.5" ) )
+WIX_POOL_SIZE = int( os.getenv( "WIX_POOL_SIZE", "10" ) )
+WIX_MAX_RETRIES = int( os.getenv( "WIX_MAX_RETRIES", "2" ) )
+
+# Retry these responses, which Wix returns for transient failures.
+RETRY_STATUSES = ( 429, 500, 502, 503, 504 )
+
+# Define the client class.
+class WixClient:
+
+    """
+    A keep-alive HTTP client shared by every Wix API call in a worker process.
+
+    Connections are pooled per host and reused across requests and threads.
+    Connection failures are retried for every method, since the request never
+    reached Wix. Read failures and transient error statuses are only retried
+    for idempotent methods, so token exchanges and BI events are not sent twice.
+    Backoff between attempts is exponential with jitter.
+    """
+
+    def __init__( self, pool_size = WIX_POOL_SIZE, max_retries = WIX_MAX_RETRIES,
+                 connect_timeout = WIX_CONNECT_TIMEOUT, read_timeout = WIX_READ_TIMEOUT ):
+
+        # Initialize variables.
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.timeout = ( connect_timeout, read_timeout )
+        self._session = None
+        self._adapter = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session( self ):
+
+        """
+        Return this process's session, creating it after a fork.
+
+        Gunicorn forks workers from the master process, and pooled sockets must
+        never be shared between processes.
+        """
+
+        if self._pid != os.getpid():
+
+            with self._lock:
+
+                if self._pid != os.getpid():
+
+                    self._session, self._adapter = self._build_session()
+                    self._pid = os.getpid()
+
+        return self._session
+
+    def _build_session( self ):
+
+        """
+        Create a session whose adapter pools connections and retries transient failures.
+        """
+
+        retry = Retry(
+            total = self.max_retries,
+            backoff_factor = 0.2,
+            backoff_jitter = 0.2,
+            status_forcelist = RETRY_STATUSES,
+            allowed_methods = Retry.DEFAULT_ALLOWED_METHODS,
+            respect_retry_after_header = True,
+            raise_on_status = False
+        )
+        adapter = HTTPAdapter(
+            pool_connections = 4,
+            pool_maxsize = self.pool_size,
+            max_retries = retry
+        )
+
+        session = requests.Session()
+        session.mount( 'https://', adapter )
+        session.mount( 'http://', adapter )
+
+        return session, adapter
+
+    def request( self, method, url, **kwargs ):
+
+        """
+        Send a request through the pool with separate connect and read timeouts.
+        """
+
+        kwargs.setdefault( 'timeout', self.timeout )
+
+        # Initialize variables.
+        status = None
+        started = time.perf_counter()
+
+        try:
+
+            response = self.session.request( method, url, **kwargs )
+            status = response.status_code
+
+            return response
+
+        finally:
+
+            # Report the call, including retries, e.g. to request timing.
+            signals.wix_request_finished.send( method, url = url, status = status,
+                                              duration = time.perf_counter() - started )
+
+    def get( self, url, **kwargs ):
+
+        """
+        Send a GET request.
+        """
+
+        return self.request( 'GET', url, **kwargs )
+
+    def post( self, url, **kwargs ):
+
+        """
+        Send a POST request.
+        """
+
+        return self.request( 'POST', url, **kwargs )
+
+    def stats( self ):
+
+        """
+        Return the connection pool statistics of this process, one entry per host.
+        """
+
+        # Initialize variables.
+        stats = []
+
+        # Nothing has been sent from this process yet.
+        if self._adapter is None or self._pid != os.getpid():
+            return stats
+
+        pools = self._adapter.poolmanager.pools
+
+        for key in pools.keys():
+
+            pool = pools.get( key )
+
+            if pool is None:
+                continue
+
+            # The pool queue is padded with None placeholders for unopened slots.
+            idle_connections = 0
+
+            if pool.pool is not None:
+                idle_connections = sum( 1 for conn in list( pool.pool.queue ) if conn is not None )
+
+            stats.append( {
+                'host': pool.host,
+                'port': pool.port,
+                'connections_opened': pool.num_connections,
+                'requests_sent': pool.num_requests,
+                'idle_connections': idle_connections,
+                'max_connections': self.pool_size
+            } )
+
+        return stats
+
+# Create the client shared by the app.
+client = WixClient()
@@ -0,0 +1,457 @@
+"""
+Coalesce rapid extension saves for my Flask app for Wix.
+"""
+# pylint: disable=broad-exception-caught
+
+# Python imports
+import os
+import atexit
+import threading
+import time
+from dotenv import load_dotenv
+from sqlalchemy import Boolean, Float, Integer, String, or_, update
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+# Local imports
+from database import db
+import logs
+import queries
+import signals
+
+# Import models.
+from models import Extension
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Define constants.
+EXTENSION_WRITE_WINDOW = float( os.getenv( "EXTENSION_WRITE_WINDOW", "2.0" ) )
+FLUSH_WAIT_TIMEOUT = 5
+
+def validate( values ):
+
+    """
+    Raise ValueError unless column values fit the Extension columns they are for.
+
+    Saves are validated before they are buffered, since the client has its
+    answer before they are written.
+    """
+
+    for column, value in values.items():
+
+        column_type = Extension.__table__.columns[ column ].type
+
+        if value is None:
+            continue
+
+        if isinstance( column_type, String ):
+
+            if not isinstance( value, str ):
+                raise ValueError( column + ' must be text.' )
+
+            if column_type.length is not None and len( value ) > column_type.length:
+                raise ValueError( column + ' is longer than ' + str( column_type.length ) +
+                                 ' characters.' )
+
+        elif isinstance( column_type, Boolean ):
+
+            if not isinstance( value, bool ):
+                raise ValueError( column + ' must be true or false.' )
+
+        elif isinstance( column_type, Integer ):
+
+            if isinstance( value, bool ) or not isinstance( value, int ):
+                raise ValueError( column + ' must be a whole number.' )
+
+        elif isinstance( column_type, Float ):
+
+            if isinstance( value, bool ) or not isinstance( value, ( int, float ) ):
+                raise ValueError( column + ' must be a number.' )
+
+def is_transient( err ):
+
+    """
+    Return True if a database error may pass on retry, e.g. a lost connection or a lock.
+    """
+
+    return ( isinstance( err, ( OperationalError, InterfaceError ) ) or
+             getattr( err, 'connection_invalidated', False ) )
+
+# Define the write buffer class.
+class ExtensionWriteBuffer:
+
+    # pylint: disable=too-many-instance-attributes
+    # Nine is reasonable in this case.
+
+    """
+    Buffer saves of existing extensions and write each extension once per window.
+
+    The settings panel saves on every change, so dragging the offset or typing
+    a label sends dozens of saves. Saves of an extension are merged, the last
+    write winning for each column, and a background thread writes them as one
+    UPDATE when the first save is a window old. Reads flush the extension first
+    so they see their own writes, and the buffer is flushed when the process
+    exits. Buffers are per process, so another gunicorn worker may serve the
+    previous state for up to one window.
+
+    Full saves carry the whole state, so the latest one wins. Each buffered
+    write records when its last save arrived as the row's save_sequence, and
+    only applies if the row holds an older one. A worker that flushes older
+    saves after another worker wrote newer ones leaves the row alone. Reads
+    wait for a write of the extension that is already under way.
+
+    Partial saves (PATCH) carry the version they were made against, so they
+    are written at once with a version-checked UPDATE after any buffered saves
+    of the extension. The editor learns of a conflict in the response.
+
+    Each extension is written in its own transaction, so a row the database
+    rejects loses only its own saves. Saves that fail on a transient error,
+    e.g. a lost connection, are buffered again and retried a window later.
+    """
+
+    def __init__( self, window = EXTENSION_WRITE_WINDOW ):
+
+        # Initialize variables.
+        self.window = window
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._pending = {}
+        self._writing = {}
+        self._app = None
+        self._thread = None
+        self._pid = None
+
+    def start( self, app ):
+
+        """
+        Start the flushing thread of this process if it is not running yet.
+        """
+
+        # Threads do not survive a fork, so start it again in each worker process.
+        with self._lock:
+
+            if self._pid == os.getpid():
+                return
+
+            self._pending = {}
+            self._writing = {}
+            self._app = app
+            self._stopping.clear()
+            self._thread = threading.Thread( target = self._run, name = 'extension-writes',
+                                            daemon = True )
+            self._thread.start()
+            self._pid = os.getpid()
+
+        atexit.register( self.stop )
+
+    def submit( self, extension_id, values ):
+
+        """
+        Buffer new column values for an existing extension, whatever its version.
+        """
+
+        # Order saves across processes by when they arrived.
+        sequence = time.time_ns()
+
+        with self._lock:
+
+            pending = self._pending.get( extension_id )
+
+            if pending is None:
+
+                # The window starts with the first buffered save.
+                self._pending[ extension_id ] = ( dict( values ), time.monotonic(), sequence )
+                self._wake.set()
+
+            else:
+
+                pending[ 0 ].update( values )
+                self._pending[ extension_id ] = ( pending[ 0 ], pending[ 1 ],
+                                                 max( pending[ 2 ], sequence ) )
+
+    def patch( self, extension_id, expected_version, values ):
+
+        """
+        Write changed column values now if the editor saw the latest version.
+
+        Buffered saves of the extension are written first, so the version check
+        sees them. Returns a queries.PatchResult. Must run inside an application
+        context.
+        """
+
+        self.flush( extension_id )
+
+        return queries.patch_extension( extension_id, expected_version, values )
+
+    def is_pending( self, extension_id ):
+
+        """
+        Return True if the extension has buffered saves, so it is known to exist.
+        """
+
+        with self._lock:
+            return extension_id in self._pending
+
+    def discard( self, extension_id ):
+
+        """
+        Drop the buffered saves of an extension that is being deleted.
+        """
+
+        with self._lock:
+            self._pending.pop( extension_id, None )
+
+    def flush( self, extension_id, timeout = FLUSH_WAIT_TIMEOUT ):
+
+        """
+        Write the buffered saves of one extension now, if it has any.
+
+        Waits for a write of the extension that another thread already started.
+        Must run inside an application context. Returns the number of extensions written.
+        """
+
+        # Requests without an extension ID have nothing to flush.
+        if not extension_id:
+            return 0
+
+        with self._lock:
+            writing = self._writing.get( extension_id )
+
+        # Let a write under way land, so the caller reads it.
+        if writing is not None:
+            writing.wait( timeout )
+
+        with self._lock:
+
+            if extension_id not in self._pending:
+                return 0
+
+            batch = self._claim( [ extension_id ] )
+
+        return self._write( batch )
+
+    def flush_all( self ):
+
+        """
+        Write the buffered saves of every extension now, e.g. at shutdown.
+
+        Must run inside an application context. Returns the number of extensions written.
+        """
+
+        with self._lock:
+            batch = self._claim( list( self._pending ) )
+
+        return self._write( batch )
+
+    def stop( self, timeout = 5 ):
+
+        """
+        Stop the flushing thread and write everything still buffered.
+        """
+
+        self._stopping.set()
+        self._wake.set()
+
+        if self._thread is not None:
+            self._thread.join( timeout )
+
+        if self._app is not None and self._pid == os.getpid():
+
+            with self._app.app_context():
+                self.flush_all()
+
+    def _write( self, batch ):
+
+        """
+        Write a batch of claimed saves, one transaction per extension.
+
+        Returns the number of extensions written.
+        """
+
+        try:
+            return self._write_claimed( batch )
+        finally:
+            self._release( batch )
+
+    def _write_claimed( self, batch ):
+
+        """
+        Write each extension of a batch unless newer saves were written first.
+        """
+
+        # Initialize variables.
+        written = []
+        retry = {}
+
+        for extension_id, ( values, first_saved, sequence, _written ) in batch.items():
+
+            try:
+
+                updated = db.session.execute(
+                    update( Extension )
+                    .where( Extension.extension_id == extension_id )
+                    .where( or_( Extension.save_sequence.is_( None ),
+                                Extension.save_sequence < sequence ) )
+                    .values( version = Extension.version + 1, save_sequence = sequence,
+                            **values )
+                    .execution_options( synchronize_session = False )
+                ).rowcount
+
+                # Another process wrote newer saves, or the extension was deleted.
+                if updated == 0:
+
+                    db.session.rollback()
+                    logs.info( 'extension-save-superseded', extension_id = extension_id )
+                    continue
+
+                db.session.commit()
+
+            except Exception as err :
+
+                db.session.rollback()
+
+                if is_transient( err ):
+
+                    retry[ extension_id ] = ( values, first_saved, sequence )
+                    logs.warning( 'extension-save-retry', extension_id = extension_id,
+                                 error = str( err ) )
+
+                else:
+
+                    logs.error( 'extension-save-failed', err, extension_id = extension_id )
+
+                continue
+
+            written.append( extension_id )
+
+        self._requeue( retry )
+
+        # Drop anything derived from the extensions.
+        for extension_id in written:
+            signals.extension_changed.send( extension_id )
+
+        if written:
+
+            # Log event.
+            logs.info( 'extension-saves-written', count = len( written ) )
+
+        return len( written )
+
+    def _claim( self, extension_ids ):
+
+        """
+        Remove buffered saves to write and mark them under way. Call with the lock held.
+        """
+
+        # Initialize variables.
+        batch = {}
+
+        for extension_id in extension_ids:
+
+            values, first_saved, sequence = self._pending.pop( extension_id )
+            written = threading.Event()
+            batch[ extension_id ] = ( values, first_saved, sequence, written )
+            self._writing[ extension_id ] = written
+
+        return batch
+
+    def _release( self, batch ):
+
+        """
+        Mark the writes of a batch finished and wake the readers waiting for them.
+        """
+
+        with self._lock:
+
+            for extension_id, entry in batch.items():
+
+                if self._writing.get( extension_id ) is entry[ 3 ]:
+                    del self._writing[ extension_id ]
+
+        for entry in batch.values():
+            entry[ 3 ].set()
+
+    def _requeue( self, batch ):
+
+        """
+        Buffer saves that failed to write again, under any saves that arrived since.
+        """
+
+        if not batch:
+            return
+
+        # Initialize variables.
+        now = time.monotonic()
+
+        with self._lock:
+
+            for extension_id, ( values, _first_saved, sequence ) in batch.items():
+
+                merged = dict( values )
+                pending = self._pending.get( extension_id )
+
+                # Newer saves win.
+                if pending is not None:
+
+                    merged.update( pending[ 0 ] )
+                    sequence = max( sequence, pending[ 2 ] )
+
+                # Retry a whole window later.
+                self._pending[ extension_id ] = ( merged, now, sequence )
+
+        self._wake.set()
+
+    def _due( self ):
+
+        """
+        Remove and return the buffered saves whose window has passed, and the wait until the next.
+        """
+
+        # Initialize variables.
+        now = time.monotonic()
+        due = []
+        wait = None
+
+        with self._lock:
+
+            for extension_id, ( _values, first_saved, _sequence ) in self._pending.items():
+
+                remaining = first_saved + self.window - now
+
+                if remaining <= 0:
+
+                    due.append( extension_id )
+
+                elif wait is None or remaining < wait:
+
+                    wait = remaining
+
+            batch = self._claim( due )
+
+        return batch, wait
+
+    def _run( self ):
+
+        """
+        Write buffered saves as their windows pass, until asked to stop.
+        """
+
+        while not self._stopping.is_set():
+
+            batch, wait = self._due()
+
+            if batch:
+
+                try:
+
+                    with self._app.app_context():
+                        self._write( batch )
+
+                except Exception as err :
+
+                    logs.error( 'extension-saves-failed', err, count = len( batch ) )
+
+            # Sleep until the next window passes or a new save arrives.
+            self._wake.wait( wait )
+            self._wake.clear()